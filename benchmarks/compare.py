@@ -0,0 +1,38 @@
+import json
+import sys
+
+import click
+
+
+def _ratio(old, new):
+    return new / old if old and new is not None else None
+
+
+@click.command()
+@click.argument('baseline', type=click.File())
+@click.argument('current', type=click.File())
+@click.option('--threshold', default=1.1, show_default=True, type=float,
+              help='Exit with an error when a stage takes this many times as long as in the baseline.')
+def main(baseline, current, threshold):
+    old, new = json.load(baseline), json.load(current)
+    if old['params'] != new['params']:
+        click.echo(f'Warning: the runs used different parameters: {old["params"]} and {new["params"]}', err=True)
+    click.echo(f'{"stage":<24}{"baseline":>10}{"current":>10}{"time":>8}{"memory":>8}')
+    regressions = []
+    for name, stage in new['stages'].items():
+        if name not in old['stages']:
+            continue
+        base = old['stages'][name]
+        time_ratio = _ratio(base['wall'], stage['wall'])
+        memory_ratio = _ratio(base.get('peak_memory'), stage.get('peak_memory'))
+        click.echo(f'{name:<24}{base["wall"]:>9.3f}s{stage["wall"]:>9.3f}s{time_ratio:>7.2f}x' +
+                   (f'{memory_ratio:>7.2f}x' if memory_ratio is not None else f'{"-":>8}'))
+        if time_ratio > threshold:
+            regressions.append(name)
+    if regressions:
+        click.echo(f'Slower than {threshold}x the baseline: {", ".join(regressions)}', err=True)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+import random
+from typing import Iterator, List, Optional
+
+from varcomb.writer import VCFWriter
+
+BASES = 'ACGT'
+# Length of every synthetic contig; positions are spread evenly over it
+CONTIG_LENGTH = 250_000_000
+
+
+def header_lines(n_chroms: int, n_samples: int, n_info: int) -> List[str]:
+    lines = ['##fileformat=VCFv4.2']
+    lines.extend(f'##contig=<ID=chr{i},length={CONTIG_LENGTH}>' for i in range(1, n_chroms + 1))
+    lines.append('##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">')
+    lines.append('##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">')
+    lines.extend(f'##INFO=<ID=I{i},Number=1,Type=Integer,Description="Synthetic field {i}">' for i in range(max(n_info - 2, 0)))
+    lines.append('##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">')
+    lines.append('##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">')
+    lines.append('\t'.join(['#CHROM', 'POS', 'ID', 'REF', 'ALT', 'QUAL', 'FILTER', 'INFO', 'FORMAT'] +
+                           [f'S{i}' for i in range(n_samples)]))
+    return lines
+
+
+def _alleles(rng: random.Random):
+    ref = rng.choice(BASES)
+    kind = rng.random()
+    if kind < 0.8:
+        return ref, rng.choice(BASES.replace(ref, ''))
+    if kind < 0.9:
+        return ref, ref + ''.join(rng.choice(BASES) for _ in range(rng.randint(1, 5)))
+    return ref + ''.join(rng.choice(BASES) for _ in range(rng.randint(1, 5))), ref
+
+
+def _record(rng: random.Random, chrom: str, pos: int, n_samples: int, n_info: int) -> List[str]:
+    ref, alt = _alleles(rng)
+    info = [f'DP={rng.randint(5, 200)}', f'AF={rng.random():.3f}'] + [f'I{i}={rng.randint(0, 99)}' for i in range(n_info - 2)]
+    samples = []
+    for _ in range(n_samples):
+        ref_depth, alt_depth = rng.randint(0, 60), rng.randint(0, 60)
+        samples.append(f'{rng.choice(("0/0", "0/1", "1/1"))}:{ref_depth},{alt_depth}')
+    return [chrom, str(pos), '.', ref, alt, f'{rng.uniform(1, 500):.1f}', rng.choice(('PASS', 'PASS', 'PASS', 'LowQual')),
+            ';'.join(info[:n_info]) or '.', 'GT:AD'] + samples
+
+
+def generate_vcf(n_records: int, n_chroms: int = 24, n_samples: int = 1, n_info: int = 2,
+                 dup_rate: float = 0.0, seed: int = 0, shuffle: bool = False) -> Iterator[str]:
+    # A deterministic synthetic VCF: the same arguments always give the same lines.
+    # A fraction dup_rate of the records repeats the previous position, half of them as an identical row.
+    rng = random.Random(seed)
+    yield from header_lines(n_chroms, n_samples, n_info)
+    records = []
+    per_chrom = -(-n_records // n_chroms)
+    step = max(CONTIG_LENGTH // max(per_chrom, 1), 2)
+    n = 0
+    for i in range(1, n_chroms + 1):
+        pos = 0
+        previous: Optional[List[str]] = None
+        for _ in range(min(per_chrom, n_records - n)):
+            if previous is not None and rng.random() < dup_rate:
+                record = list(previous) if rng.random() < 0.5 else _record(rng, previous[0], int(previous[1]), n_samples, n_info)
+            else:
+                pos += rng.randint(1, 2 * step - 1)
+                record = _record(rng, f'chr{i}', pos, n_samples, n_info)
+            previous = record
+            line = '\t'.join(record)
+            if shuffle:
+                records.append(line)
+            else:
+                yield line
+            n += 1
+    if shuffle:
+        rng.shuffle(records)
+        yield from records
+
+
+def write_vcf_file(fname: str, n_records: int, **kwargs) -> str:
+    with VCFWriter(fname) as writer:
+        writer.write_lines(generate_vcf(n_records, **kwargs))
+    return fname
@@ -0,0 +1,126 @@
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import click
+from click.testing import CliRunner
+
+from benchmarks.generate import write_vcf_file
+from varcomb.client import client
+from varcomb.columnar import ColumnarVCF
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+
+# A stage prepares its input outside of the measurement, then runs on it and returns the number of records handled
+Stage = Tuple[str, Callable[[], Any], Callable[[Any], int]]
+
+
+def _parsed(fname: str):
+    return lambda: parse_vcf_file(read_vcf(fname))
+
+
+def _merge(n: int, *args: str) -> Callable[[Any], int]:
+    def run(_) -> int:
+        result = CliRunner().invoke(client, list(args), catch_exceptions=False)
+        if result.exit_code != 0:
+            raise RuntimeError(f'{" ".join(args)} failed: {result.output}')
+        return n
+    return run
+
+
+def stages(fnames: List[str], n_records: int, directory: str, processes: int) -> List[Stage]:
+    fname = fnames[0]
+    out = os.path.join(directory, 'out.vcf')
+    merge = ['merge-vcfs', '--vcf_out', out] + [arg for fname in fnames for arg in ('--vcf_file', fname)]
+    n = n_records * len(fnames)
+    return [
+        ('read', lambda: fname, lambda fname: sum(1 for line in read_vcf(fname) if not line.startswith('#'))),
+        ('parse', lambda: fname, lambda fname: len(parse_vcf_file(read_vcf(fname)))),
+        ('parse_columnar', lambda: fname, lambda fname: len(ColumnarVCF.from_file(fname))),
+        ('parse_columnar_processes', lambda: fname, lambda fname: len(ColumnarVCF.from_file(fname, processes=processes))),
+        ('sort', _parsed(fname), lambda vcf: len(vcf.sort())),
+        ('remove_true_duplicates', _parsed(fname), lambda vcf: len(vcf.remove_true_duplicates())),
+        ('remove_loc_dup', _parsed(fname), lambda vcf: len(vcf.remove_loc_dup())),
+        ('annotate', _parsed(fname), lambda vcf: len(vcf.annotate('benchmark'))),
+        ('write', _parsed(fname), lambda vcf: vcf.to_file(out) or len(vcf)),
+        ('write_bgzf', _parsed(fname), lambda vcf: vcf.to_file(f'{out}.gz') or len(vcf)),
+        ('merge_vcfs', lambda: None, _merge(n, *merge)),
+        ('merge_vcfs_streaming', lambda: None, _merge(n, *merge, '--streaming')),
+        ('merge_vcfs_processes', lambda: None, _merge(n, *merge, '--processes', str(processes))),
+    ]
+
+
+def measure(setup: Callable[[], Any], run: Callable[[Any], int], repeat: int, memory: bool) -> Dict[str, Any]:
+    # Best of repeat runs for the timings; the peak memory of a separate run, as tracing slows everything down
+    walls, cpus, records = [], [], 0
+    for _ in range(repeat):
+        data = setup()
+        wall, cpu = time.perf_counter(), time.process_time()
+        records = run(data)
+        walls.append(time.perf_counter() - wall)
+        cpus.append(time.process_time() - cpu)
+        del data
+    result: Dict[str, Any] = {'wall': min(walls), 'cpu': min(cpus), 'records': records,
+                              'records_per_sec': records / min(walls) if records and min(walls) else None}
+    if memory:
+        data = setup()
+        tracemalloc.start()
+        try:
+            run(data)
+            result['peak_memory'] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def _commit() -> Optional[str]:
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--records', default=100_000, show_default=True, type=click.IntRange(min=1), help='Records per input file.')
+@click.option('--chroms', default=24, show_default=True, type=click.IntRange(min=1))
+@click.option('--samples', default=1, show_default=True, type=click.IntRange(min=0))
+@click.option('--info', default=2, show_default=True, type=click.IntRange(min=0), help='INFO fields per record.')
+@click.option('--dup_rate', default=0.05, show_default=True, type=click.FloatRange(0, 1),
+              help='Fraction of the records that repeat the position of the previous one.')
+@click.option('--inputs', default=2, show_default=True, type=click.IntRange(min=1), help='Input files for the merge stages.')
+@click.option('--gz', is_flag=True, help='Write the inputs BGZF compressed.')
+@click.option('--processes', default=2, show_default=True, type=click.IntRange(min=2))
+@click.option('--repeat', default=3, show_default=True, type=click.IntRange(min=1))
+@click.option('--no_memory', is_flag=True, help='Skip the peak memory runs.')
+@click.option('--stage', multiple=True, help='Only run these stages. Can be repeated.')
+@click.option('--seed', default=0, show_default=True, type=int)
+@click.option('--output', type=click.Path(), help='Write the results as JSON to this file instead of stdout.')
+def main(records, chroms, samples, info, dup_rate, inputs, gz, processes, repeat, no_memory, stage, seed, output):
+    params = {'records': records, 'chroms': chroms, 'samples': samples, 'info': info, 'dup_rate': dup_rate,
+              'inputs': inputs, 'gz': gz, 'processes': processes, 'repeat': repeat, 'seed': seed}
+    results: Dict[str, Any] = {'commit': _commit(), 'python': platform.python_version(), 'params': params, 'stages': {}}
+    with tempfile.TemporaryDirectory(prefix='varcomb-benchmark') as directory:
+        fnames = [write_vcf_file(os.path.join(directory, f'{i}.vcf{".gz" if gz else ""}'), records, n_chroms=chroms,
+                                 n_samples=samples, n_info=info, dup_rate=dup_rate, seed=seed + i)
+                  for i in range(inputs)]
+        for name, setup, run in stages(fnames, records, directory, processes):
+            if stage and name not in stage:
+                continue
+            results['stages'][name] = measure(setup, run, repeat, memory=not no_memory)
+            click.echo(f'{name}: {results["stages"][name]["wall"]:.3f}s', err=True)
+    data = json.dumps(results, indent=2)
+    if output is None:
+        click.echo(data)
+    else:
+        with open(output, 'w') as f:
+            f.write(data + '\n')
+
+
+if __name__ == '__main__':
+    main()
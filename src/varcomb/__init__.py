@@ -1,2 +1,3 @@
+from varcomb.columnar import ColumnarVCF
 from varcomb.core import VCF, Location, VCFrow
 from varcomb.parsers import parse_vcf_file
@@ -0,0 +1,119 @@
+import csv
+import logging
+import resource
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass
+from typing import IO, Any, Dict, List, Optional, Tuple
+
+from varcomb.merge import run_merge
+from varcomb.stats import Stats
+
+MANIFEST_COLUMNS = ('sample', 'vcf_out', 'vcf_file')
+SUMMARY_COLUMNS = ('sample', 'status', 'records_in', 'records_out', 'duplicates', 'wall', 'cpu', 'peak_rss', 'vcf_out', 'error')
+
+
+@dataclass
+class Job:
+    sample: str
+    fnames: List[str]
+    annotations: List[Optional[str]]
+    fname_out: str
+
+
+def read_manifest(fname: str) -> List[Job]:
+    # Tab separated with a header line: sample, vcf_out, vcf_file and optionally ann_vcf, where vcf_file
+    # and ann_vcf hold comma separated lists in the same order. Empty lines and lines starting with # are skipped
+    with open(fname, newline='') as f:
+        reader = csv.DictReader((line for line in f if line.strip() and not line.startswith('#')), delimiter='\t')
+        missing = [column for column in MANIFEST_COLUMNS if column not in (reader.fieldnames or [])]
+        if missing:
+            raise ValueError(f'{fname} misses the column(s): {", ".join(missing)}')
+        jobs, samples = [], set()
+        for n, line in enumerate(reader, start=1):
+            if None in line.values():
+                raise ValueError(f'{fname}, sample {n}: has fewer columns than the header')
+            sample = line['sample']
+            fnames = [name.strip() for name in line['vcf_file'].split(',') if name.strip()]
+            annotations: List[Optional[str]] = [None] * len(fnames)
+            if line.get('ann_vcf'):
+                annotations = [annotation.strip() or None for annotation in line['ann_vcf'].split(',')]
+            if not sample or not fnames or not line['vcf_out']:
+                raise ValueError(f'{fname}, sample {n}: sample, vcf_out and vcf_file can not be empty')
+            if len(annotations) != len(fnames):
+                raise ValueError(f'{fname}, sample {n}: ann_vcf must have one annotation for every vcf_file')
+            if sample in samples:
+                raise ValueError(f'{fname}, sample {n}: sample {sample} is listed twice')
+            samples.add(sample)
+            jobs.append(Job(sample, fnames, annotations, line['vcf_out']))
+    return jobs
+
+
+def _limit_memory(max_memory: Optional[int]):
+    # Runs in every worker: allocations beyond the limit raise MemoryError in the merge of that sample
+    if max_memory is None:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_AS)
+    resource.setrlimit(resource.RLIMIT_AS, (max_memory if hard == resource.RLIM_INFINITY else min(max_memory, hard), hard))
+
+
+def _run_job(job: Job, options: Dict[str, Any]) -> Dict[str, Any]:
+    stats = Stats('merge-vcfs')
+    result: Dict[str, Any] = {'sample': job.sample, 'vcf_out': job.fname_out, 'status': 'ok', 'error': ''}
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result['records_in'], result['records_out'] = run_merge(job.fnames, job.fname_out, job.annotations, stats=stats, **options)
+        result['duplicates'] = result['records_in'] - result['records_out']
+    except MemoryError:
+        result.update(status='failed', error='out of memory')
+    except Exception as e:
+        result.update(status='failed', error=f'{type(e).__name__}: {e}')
+    result['wall'] = round(time.perf_counter() - wall, 3)
+    result['cpu'] = round(time.process_time() - cpu, 3)
+    # The peak of the worker, which may have merged other samples before this one
+    result['peak_rss'] = stats.to_dict()['peak_rss']
+    return result
+
+
+def _run_pool(jobs: List[Job], options: Dict[str, Any], workers: int,
+              max_memory: Optional[int]) -> Tuple[Dict[str, Dict[str, Any]], List[Job]]:
+    # The results of the jobs that finished, and the jobs that did not because a worker died and broke the pool
+    results: Dict[str, Dict[str, Any]] = {}
+    unfinished: List[Job] = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_limit_memory, initargs=(max_memory,)) as executor:
+        futures = [executor.submit(_run_job, job, options) for job in jobs]
+        for job, future in zip(jobs, futures):
+            try:
+                results[job.sample] = future.result()
+            except BrokenProcessPool:
+                unfinished.append(job)
+    return results, unfinished
+
+
+def run_batch(jobs: List[Job], options: Dict[str, Any], workers: int, max_memory: Optional[int] = None) -> List[Dict[str, Any]]:
+    # One merge per job on a pool of workers. A failed merge is reported in its result instead of stopping the others
+    results: Dict[str, Dict[str, Any]] = {}
+    pending = jobs
+    while pending:
+        done, unfinished = _run_pool(pending, options, workers, max_memory)
+        results.update(done)
+        # A worker that is killed, e.g. by the kernel when it runs out of memory, takes down the pool. Jobs start in
+        # order, so the ones that were running are among the first unfinished ones. Each of those runs again on its
+        # own, so only the job that kills its worker fails, and the jobs that never started go to a new pool.
+        for job in unfinished[:workers]:
+            done, died = _run_pool([job], options, 1, max_memory)
+            results.update(done)
+            if died:
+                results[job.sample] = {'sample': job.sample, 'vcf_out': job.fname_out, 'status': 'failed',
+                                       'error': 'worker process died'}
+        pending = unfinished[workers:]
+    for job in jobs:
+        logging.info(f'{job.sample}: {results[job.sample]["status"]}')
+    return [results[job.sample] for job in jobs]
+
+
+def write_summary(f: IO[str], results: List[Dict[str, Any]]):
+    writer = csv.DictWriter(f, SUMMARY_COLUMNS, restval='', delimiter='\t', lineterminator='\n')
+    writer.writeheader()
+    writer.writerows(results)
@@ -0,0 +1,163 @@
+import io
+import struct
+import zlib
+from typing import Iterator, Tuple, Union
+
+# Uncompressed bytes per block, as used by htslib, so a compressed block always fits in 64KB
+BLOCK_SIZE = 0xff00
+HEADER = struct.Struct('<BBBBIBBHBBHH')
+FOOTER = struct.Struct('<II')
+EOF = bytes.fromhex('1f8b08040000000000ff0600424302001b0003000000000000000000')
+
+
+def compress_block(data: bytes, level: int = 6) -> bytes:
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = HEADER.pack(31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, HEADER.size + len(cdata) + FOOTER.size - 1)
+    return header + cdata + FOOTER.pack(zlib.crc32(data), len(data))
+
+
+class BgzfWriter:
+    __slots__ = '_handle', '_buffer', '_coffset', 'level'
+
+    def __init__(self, fname: str, level: int = 6):
+        self._handle = open(fname, 'wb')
+        self._buffer = bytearray()
+        self._coffset = 0
+        self.level = level
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _write_block(self, data: bytes):
+        block = compress_block(data, self.level)
+        self._handle.write(block)
+        self._coffset += len(block)
+
+    def tell(self) -> int:
+        # Virtual offset: compressed offset of the current block and offset inside its uncompressed data
+        return self._coffset << 16 | len(self._buffer)
+
+    def write(self, data: Union[str, bytes]):
+        if isinstance(data, str):
+            data = data.encode()
+        self._buffer += data
+        while len(self._buffer) >= BLOCK_SIZE:
+            self._write_block(bytes(self._buffer[:BLOCK_SIZE]))
+            del self._buffer[:BLOCK_SIZE]
+
+    def flush(self):
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+        self._handle.flush()
+
+    def close(self):
+        self.flush()
+        self._handle.write(EOF)
+        self._handle.close()
+
+
+class BgzfReader:
+    __slots__ = '_handle', '_block', '_coffset', '_next', '_uoffset'
+
+    def __init__(self, fname: str):
+        self._handle = open(fname, 'rb')
+        self._block = b''
+        self._coffset = 0
+        self._next = 0
+        self._uoffset = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _load(self, coffset: int) -> bool:
+        self._handle.seek(coffset)
+        header = self._handle.read(HEADER.size)
+        if len(header) < HEADER.size:
+            self._block, self._coffset, self._next, self._uoffset = b'', coffset, coffset, 0
+            return False
+        bsize = block_size(header, self._handle)
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        cdata = self._handle.read(bsize - 12 - xlen - FOOTER.size)
+        self._handle.seek(FOOTER.size, 1)
+        self._block = zlib.decompress(cdata, -15)
+        self._coffset, self._next, self._uoffset = coffset, coffset + bsize, 0
+        return True
+
+    def seek(self, voffset: int):
+        self._load(voffset >> 16)
+        self._uoffset = voffset & 0xffff
+
+    def tell(self) -> int:
+        if self._uoffset == len(self._block) and self._block:
+            return self._next << 16
+        return self._coffset << 16 | self._uoffset
+
+    def readline(self) -> bytes:
+        parts = []
+        while True:
+            i = self._block.find(b'\n', self._uoffset)
+            if i >= 0:
+                parts.append(self._block[self._uoffset:i + 1])
+                self._uoffset = i + 1
+                return b''.join(parts)
+            parts.append(self._block[self._uoffset:])
+            self._uoffset = len(self._block)
+            if not self._load(self._next):
+                return b''.join(parts)
+
+    def close(self):
+        self._handle.close()
+
+
+def block_size(header: bytes, handle=None) -> int:
+    magic1, magic2, _, flags, _, _, _, xlen, si1, si2, slen, bsize = HEADER.unpack(header)
+    if (magic1, magic2) != (31, 139) or not flags & 4 or xlen < 6:
+        raise ValueError('Not a BGZF block')
+    if (si1, si2, slen, xlen) == (66, 67, 2, 6):
+        return bsize + 1
+    # The BC subfield is not the only or the first extra subfield
+    if handle is None:
+        raise ValueError('BGZF block without a leading BC subfield')
+    extra = header[12:] + handle.read(xlen - 6)
+    offset = 0
+    while offset < xlen:
+        si1, si2, slen = struct.unpack_from('<BBH', extra, offset)
+        if (si1, si2) == (66, 67):
+            return struct.unpack_from('<H', extra, offset + 4)[0] + 1
+        offset += 4 + slen
+    raise ValueError('BGZF block without a BC subfield')
+
+
+def is_bgzf(header: bytes) -> bool:
+    try:
+        block_size(header[:HEADER.size], io.BytesIO(header[HEADER.size:]))
+    except (ValueError, struct.error):
+        return False
+    return True
+
+
+def scan_blocks(data) -> Iterator[Tuple[int, int]]:
+    # Start and end of the deflated data of every block, found by hopping from block header to block header
+    offset = 0
+    while offset + HEADER.size <= len(data):
+        header = data[offset:offset + HEADER.size]
+        xlen = struct.unpack_from('<H', header, 10)[0]
+        bsize = block_size(header, io.BytesIO(data[offset + HEADER.size:offset + 12 + xlen]))
+        yield offset + 12 + xlen, offset + bsize - FOOTER.size
+        offset += bsize
+
+
+def inflate_block(data, start: int, end: int) -> bytes:
+    block = zlib.decompress(data[start:end], -15)
+    crc, size = FOOTER.unpack_from(data, end)
+    if size != len(block) or crc != zlib.crc32(block):
+        raise ValueError(f'Corrupt BGZF block at offset {start}')
+    return block
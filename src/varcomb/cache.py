@@ -0,0 +1,139 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+from hashlib import blake2b
+from typing import Any, Dict, List, Optional
+
+from varcomb.columnar import COLUMNS, ColumnarVCF
+
+CACHE_SIZE = 2 << 30
+# Bumped whenever the layout of an entry changes, so old entries are parsed again
+MAGIC = b'VARCOMB1'
+# Magic and the offset of the JSON metadata, which comes last
+PREFIX = struct.Struct('<8sQ')
+HASH_BLOCK = 1 << 20
+
+
+def content_digest(fname: str) -> str:
+    digest = blake2b(digest_size=16)
+    with open(fname, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class VCFCache:
+    # Parsed inputs as ColumnarVCF, stored so that the columns are read back in one go and the record
+    # buffer is memory-mapped. Entries are found by path, size and mtime, and only used when the content
+    # hash of the input still matches. The least recently used entries go when the cache exceeds max_size.
+    __slots__ = 'directory', 'max_size'
+
+    def __init__(self, directory: str, max_size: int = CACHE_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        os.makedirs(directory, exist_ok=True)
+
+    def entry(self, fname: str) -> str:
+        stat = os.stat(fname)
+        key = f'{os.path.abspath(fname)}\0{stat.st_size}\0{stat.st_mtime_ns}'
+        return os.path.join(self.directory, f'{blake2b(key.encode(), digest_size=16).hexdigest()}.vcc')
+
+    def get(self, fname: str) -> ColumnarVCF:
+        entry = self.entry(fname)
+        digest = content_digest(fname)
+        vcf = self.load(entry, digest)
+        if vcf is not None:
+            logging.info(f'Read {fname} from the cache')
+            return vcf
+        vcf = ColumnarVCF.from_file(fname)
+        self.store(entry, digest, vcf)
+        return vcf
+
+    def load(self, entry: str, digest: str) -> Optional[ColumnarVCF]:
+        try:
+            f = open(entry, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            magic, meta_offset = PREFIX.unpack(f.read(PREFIX.size))
+            if magic != MAGIC:
+                return None
+            f.seek(meta_offset)
+            meta = json.loads(f.read())
+            if meta['digest'] != digest or meta['byteorder'] != sys.byteorder:
+                return None
+            vcf = ColumnarVCF(header=meta['header'])
+            vcf.contigs = meta['contigs']
+            columns = {}
+            for name, typecode, offset, size in meta['columns']:
+                column = array(typecode)
+                if column.itemsize * meta['rows'] != size:
+                    return None
+                f.seek(offset)
+                column.fromfile(f, meta['rows'])
+                columns[name] = column
+            for name in COLUMNS:
+                setattr(vcf, name, columns[name])
+            vcf._fingerprints = columns['fingerprints']
+            offset, size = meta['buffer']
+            vcf.buffer = mmap.mmap(f.fileno(), size, offset=offset, access=mmap.ACCESS_READ) if size else b''
+        # Marks the entry as recently used
+        os.utime(entry)
+        return vcf
+
+    def store(self, entry: str, digest: str, vcf: ColumnarVCF):
+        columns = [(name, getattr(vcf, name)) for name in COLUMNS] + [('fingerprints', vcf.fingerprints())]
+        size = PREFIX.size + sum(len(column) * column.itemsize + 8 for _, column in columns) + \
+            mmap.ALLOCATIONGRANULARITY + len(vcf.buffer)
+        if size > self.max_size:
+            return
+        self.evict(self.max_size - size)
+        meta: Dict[str, Any] = {'digest': digest, 'byteorder': sys.byteorder, 'rows': len(vcf),
+                                'header': list(vcf.header or []), 'contigs': vcf.contigs, 'columns': []}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(PREFIX.pack(MAGIC, 0))
+                for name, column in columns:
+                    f.write(bytes(-f.tell() % 8))
+                    meta['columns'].append((name, column.typecode, f.tell(), len(column) * column.itemsize))
+                    column.tofile(f)
+                # The buffer is mapped on its own, so it starts at a multiple of the mmap granularity
+                f.write(bytes(-f.tell() % mmap.ALLOCATIONGRANULARITY))
+                meta['buffer'] = (f.tell(), len(vcf.buffer))
+                f.write(vcf.buffer)
+                meta_offset = f.tell()
+                f.write(json.dumps(meta).encode())
+                f.seek(0)
+                f.write(PREFIX.pack(MAGIC, meta_offset))
+            os.replace(tmp, entry)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    def entries(self) -> List[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory) if entry.name.endswith('.vcc')]
+
+    def evict(self, max_size: int):
+        # Removes the least recently used entries until the others take at most max_size bytes.
+        # Other processes may use the same cache, so entries can disappear while this runs.
+        entries = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+        total = 0
+        for _, size, path in sorted(entries, reverse=True):
+            total += size
+            if total > max_size:
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
@@ -1,42 +1,198 @@
+import cProfile
 import logging
+import os
+from contextlib import contextmanager
 
 import click
 
-from varcomb.parsers import parse_vcf_file
-from varcomb.utilities import read_vcf
+from varcomb.batch import read_manifest, run_batch, write_summary
+from varcomb.cache import CACHE_SIZE, VCFCache
+from varcomb.core import FINGERPRINTS
+from varcomb.dedup import KEYS, POLICIES, STREAMING_KEYS
+from varcomb.diff import diff_vcf_files
+from varcomb.exceptions import VCFNotSortedError
+from varcomb.match import match_vcf_files
+from varcomb.merge import run_merge
+from varcomb.stats import Stats, file_size
+from varcomb.tabix import INDEX_FORMATS
+from varcomb.utilities import parse_region, read_regions_file
 
 
 @click.group()
 @click.option('--log_file')
+@click.option('--profile', type=click.Path(), help='Profile the command with cProfile, and write the stats to this file.')
+@click.option('--stats_json', type=click.File('w', lazy=True),
+              help='Write the wall and CPU time, peak RSS and throughput of every stage as JSON to this file ("-" for stdout).')
 @click.pass_context
-def client(ctx, log_file, type=click.Path()):
+def client(ctx, log_file, profile=None, stats_json=None, type=click.Path()):
     logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s', datefmt='%Y/%m/%d %H:%M:%S', level=logging.INFO, filename=log_file)
+    ctx.ensure_object(dict)
+    stats = ctx.obj['stats'] = Stats(ctx.invoked_subcommand)
+    if stats_json is not None:
+        ctx.call_on_close(lambda: stats.dump(stats_json))
+    if profile is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def dump():
+            profiler.disable()
+            profiler.dump_stats(profile)
+        ctx.call_on_close(dump)
+
+
+def _collect_inputs(vcf_file1, vcf_file2, vcf_file, ann_vcf1, ann_vcf2, ann_vcf):
+    if ann_vcf and len(ann_vcf) != len(vcf_file):
+        raise click.BadParameter('--ann_vcf must be given once for every --vcf_file', param_hint='--ann_vcf')
+    fnames, annotations = [], []
+    for fname, annotation in [(vcf_file1, ann_vcf1), (vcf_file2, ann_vcf2)]:
+        if fname is not None:
+            fnames.append(fname)
+            annotations.append(annotation)
+    fnames.extend(vcf_file)
+    annotations.extend(ann_vcf if ann_vcf else [None] * len(vcf_file))
+    if not fnames:
+        raise click.UsageError('No input VCF files given')
+    return fnames, annotations
+
+
+def _check_merge_options(vcf_outs, index, streaming, dedup_key, cache_dir, pipelined=False, processes=1, regions=None):
+    if index is not None and not all(vcf_out.endswith('.gz') for vcf_out in vcf_outs):
+        raise click.BadParameter('an index can only be written for BGZF output ending on ".gz"', param_hint='--index')
+    if (streaming or pipelined) and processes > 1:
+        raise click.UsageError('--streaming, --sort_memory or --pipelined can not be combined with --processes')
+    if cache_dir is not None and (streaming or processes > 1 or regions is not None):
+        raise click.UsageError('--cache_dir can not be combined with --streaming, --sort_memory, --processes or regions')
+    if streaming and dedup_key not in STREAMING_KEYS:
+        raise click.BadParameter(f'"{dedup_key}" can not be used with --streaming', param_hint='--dedup_key')
+
+
+@contextmanager
+def _sorted_inputs(hint):
+    # Inputs that turn out not to be sorted are reported as an error of the command, with how to work around it
+    try:
+        yield
+    except VCFNotSortedError as error:
+        raise click.ClickException(f'{error}. {hint}')
 
 
 @client.command()
-@click.option('--vcf_file1', required=True, type=click.Path())
-@click.option('--vcf_file2', required=True, type=click.Path())
+@click.option('--vcf_file1', required=False, type=click.Path())
+@click.option('--vcf_file2', required=False, type=click.Path())
+@click.option('--vcf_file', multiple=True, type=click.Path(), help='Additional input VCF file. Can be repeated.')
 @click.option('--vcf_out', required=True, type=click.Path())
 @click.option('--ann_vcf1', required=False)
 @click.option('--ann_vcf2', required=False)
+@click.option('--ann_vcf', multiple=True, help='Annotation for each --vcf_file, in the same order.')
+@click.option('--streaming', is_flag=True, help='Merge coordinate-sorted inputs without loading them into memory.')
+@click.option('--sort_memory', type=click.IntRange(min=1),
+              help='Sort unsorted inputs on disk, holding at most this many MB of records in memory. Implies --streaming.')
+@click.option('--pipelined', is_flag=True,
+              help='Decompress the inputs and compress the output in background threads, overlapping with parsing and merging.')
+@click.option('--dedup_key', default='row', show_default=True, type=click.Choice(list(KEYS)),
+              help='What makes two records duplicates: the full row, the position, the position and alleles, or the normalized alleles.')
+@click.option('--dedup_keep', default='first', show_default=True, type=click.Choice(list(POLICIES)),
+              help='Which of the duplicates to keep: the first input, the highest QUAL, or a PASS record.')
+@click.option('--processes', default=1, show_default=True, type=click.IntRange(min=1),
+              help='Merge the chromosomes in this many worker processes.')
+@click.option('--index', type=click.Choice(INDEX_FORMATS), help='Write a tabix (tbi) or CSI index next to a BGZF compressed --vcf_out.')
+@click.option('--region', multiple=True, help='Only merge records overlapping chr, chr:start or chr:start-end. Can be repeated.')
+@click.option('--regions_file', type=click.Path(exists=True), help='Only merge records overlapping the regions in this BED file.')
+@click.option('--cache_dir', type=click.Path(file_okay=False),
+              help='Keep the parsed inputs in this directory, and read unchanged inputs from it in later runs.')
+@click.option('--cache_size', default=CACHE_SIZE >> 20, show_default=True, type=click.IntRange(min=1),
+              help='Size of the --cache_dir in MB. The least recently used inputs are removed beyond it.')
+@click.pass_context
+def merge_vcfs(ctx, vcf_file1, vcf_file2, vcf_file, vcf_out, ann_vcf1=None, ann_vcf2=None, ann_vcf=(), streaming=False,
+               sort_memory=None, pipelined=False, dedup_key='row', dedup_keep='first', processes=1, index=None, region=(), regions_file=None,
+               cache_dir=None, cache_size=CACHE_SIZE >> 20):
+    fnames, annotations = _collect_inputs(vcf_file1, vcf_file2, vcf_file, ann_vcf1, ann_vcf2, ann_vcf)
+    streaming = streaming or sort_memory is not None
+    regions = None
+    if region or regions_file is not None:
+        regions = [parse_region(r) for r in region]
+        if regions_file is not None:
+            regions.extend(read_regions_file(regions_file))
+    _check_merge_options([vcf_out], index, streaming, dedup_key, cache_dir, pipelined, processes, regions)
+    with _sorted_inputs('Unsorted inputs can be merged with --sort_memory.'):
+        run_merge(fnames, vcf_out, annotations, key=dedup_key, keep=dedup_keep, index=index, regions=regions,
+                  streaming=streaming, sort_memory=sort_memory << 20 if sort_memory is not None else None, pipelined=pipelined,
+                  processes=processes, cache=VCFCache(cache_dir, cache_size << 20) if cache_dir is not None else None,
+                  stats=ctx.obj['stats'])
+
+
+@client.command()
+@click.option('--manifest', required=True, type=click.Path(exists=True, dir_okay=False),
+              help='Tab separated file with a header and the columns sample, vcf_out, vcf_file and optionally ann_vcf. '
+                   'vcf_file and ann_vcf list the inputs and their annotations, separated by commas.')
+@click.option('--summary', default='-', show_default=True, type=click.File('w'),
+              help='Write the records read and written, time and peak RSS of every sample to this tab separated file.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, type=click.IntRange(min=1),
+              help='Merge this many samples at the same time, each in its own process.')
+@click.option('--memory_per_worker', type=click.IntRange(min=1),
+              help='Limit the address space of every worker to this many MB. A merge that needs more fails.')
+@click.option('--streaming', is_flag=True, help='Merge coordinate-sorted inputs without loading them into memory.')
+@click.option('--sort_memory', type=click.IntRange(min=1),
+              help='Sort unsorted inputs on disk, holding at most this many MB of records in memory. Implies --streaming.')
+@click.option('--dedup_key', default='row', show_default=True, type=click.Choice(list(KEYS)))
+@click.option('--dedup_keep', default='first', show_default=True, type=click.Choice(list(POLICIES)))
+@click.option('--index', type=click.Choice(INDEX_FORMATS), help='Write a tabix (tbi) or CSI index next to every output.')
+@click.option('--cache_dir', type=click.Path(file_okay=False), help='Keep the parsed inputs in this directory, shared by the workers.')
+@click.option('--cache_size', default=CACHE_SIZE >> 20, show_default=True, type=click.IntRange(min=1))
+@click.pass_context
+def merge_batch(ctx, manifest, summary, workers, memory_per_worker=None, streaming=False, sort_memory=None, dedup_key='row',
+                dedup_keep='first', index=None, cache_dir=None, cache_size=CACHE_SIZE >> 20):
+    try:
+        jobs = read_manifest(manifest)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint='--manifest')
+    streaming = streaming or sort_memory is not None
+    _check_merge_options([job.fname_out for job in jobs], index, streaming, dedup_key, cache_dir)
+    options = {'key': dedup_key, 'keep': dedup_keep, 'index': index, 'streaming': streaming,
+               'sort_memory': sort_memory << 20 if sort_memory is not None else None,
+               'cache': VCFCache(cache_dir, cache_size << 20) if cache_dir is not None else None}
+    logging.info(f'Merging {len(jobs)} samples with {workers} workers')
+    with ctx.obj['stats'].stage('merge_batch') as stage:
+        results = run_batch(jobs, options, workers, memory_per_worker << 20 if memory_per_worker is not None else None)
+        stage.records = sum(result.get('records_in', 0) for result in results)
+    write_summary(summary, results)
+    failed = [result['sample'] for result in results if result['status'] != 'ok']
+    if failed:
+        raise click.ClickException(f'{len(failed)} of {len(results)} merges failed: {", ".join(failed)}')
+
+
+@client.command()
+@click.option('--vcf_file', required=True, multiple=True, type=click.Path(), help='Coordinate-sorted input VCF file, one per caller. Can be repeated.')
+@click.option('--ann_vcf', multiple=True, help='Caller name for each --vcf_file, in the same order. Defaults to the file name.')
+@click.option('--tol', default=50, show_default=True, type=int, help='Maximum distance between calls that are considered the same variant.')
+@click.option('--out_prefix', required=True, help='Writes <out_prefix>.matched.vcf, <out_prefix>.discordant.vcf and <out_prefix>.specific.vcf')
+@click.pass_context
+def match_vcfs(ctx, vcf_file, ann_vcf, tol, out_prefix):
+    if ann_vcf and len(ann_vcf) != len(vcf_file):
+        raise click.BadParameter('--ann_vcf must be given once for every --vcf_file', param_hint='--ann_vcf')
+    logging.info(f'Matching VCFs: {", ".join(vcf_file)}')
+    with _sorted_inputs('The inputs have to be sorted first.'), ctx.obj['stats'].stage('match') as stage:
+        counts = match_vcf_files(vcf_file, out_prefix, annotations=ann_vcf or None, tol=tol)
+        stage.bytes = sum(map(file_size, vcf_file))
+    for kind, n in counts.items():
+        logging.info(f'{n} {kind} sets')
+
+
+@client.command()
+@click.option('--vcf_file1', required=True, type=click.Path())
+@click.option('--vcf_file2', required=True, type=click.Path())
+@click.option('--key', type=click.Choice(list(FINGERPRINTS)), default='site', show_default=True,
+              help='Compare the records on CHROM, POS, REF and ALT (site) or on the whole record (row).')
+@click.option('--out_prefix', help='Writes <out_prefix>.shared.vcf, <out_prefix>.first_only.vcf and <out_prefix>.second_only.vcf')
+@click.option('--streaming', is_flag=True, help='Compare coordinate-sorted inputs record by record instead of loading them into memory.')
 @click.pass_context
-def merge_vcfs(ctx, vcf_file1, vcf_file2, vcf_out, ann_vcf1=None, ann_vcf2=None):
-    logging.info(f'Reading file: {vcf_file1}')
-    vcf1 = parse_vcf_file(read_vcf(vcf_file1))
-    logging.info(f'Reading file: {vcf_file2}')
-    vcf2 = parse_vcf_file(read_vcf(vcf_file2))
-    if ann_vcf1 is not None:
-        vcf1 = vcf1.annotate(ann_vcf1)
-    if ann_vcf2 is not None:
-        vcf2 = vcf2.annotate(ann_vcf2)
-
-    logging.info('Merging VCFs...')
-    vcf = vcf1 + vcf2
-    n1 = len(vcf)
-    vcf = vcf.remove_true_duplicates()
-    n2 = len(vcf)
-    logging.info(f'{n1-n2} duplicates removed')
-    vcf.to_file(vcf_out)
+def diff(ctx, vcf_file1, vcf_file2, key, out_prefix, streaming):
+    logging.info(f'Comparing {vcf_file1} and {vcf_file2}')
+    with _sorted_inputs('Unsorted inputs can be compared without --streaming.'), ctx.obj['stats'].stage('diff') as stage:
+        counts = diff_vcf_files(vcf_file1, vcf_file2, prefix=out_prefix, key=key, streaming=streaming)
+        stage.records = sum(counts.values())
+        stage.bytes = file_size(vcf_file1) + file_size(vcf_file2)
+    for kind, n in counts.items():
+        click.echo(f'{kind}\t{n}')
 
 
 def run():
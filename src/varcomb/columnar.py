@@ -0,0 +1,344 @@
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Deque, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from varcomb.core import VCF, Info, VCFrow, fingerprint
+from varcomb.header import ANNOTATION_INFO, POS_BITS, Header
+from varcomb.index import PositionIndex
+from varcomb.parsers import _parse_vcf_line
+from varcomb.utilities import read_vcf_blocks
+from varcomb.writer import VCFWriter
+
+# Record lines (from_stream) or bytes (from_file) parsed as one chunk, and chunks handed out ahead to every worker process
+CHUNK_LINES = 100_000
+CHUNK_BYTES = 16 << 20
+CHUNKS_PER_PROCESS = 2
+
+# The per row arrays; the buffer and the contig names make up the rest of a ColumnarVCF
+COLUMNS = ('chrom_codes', 'positions', 'starts', 'ends', 'ref_starts', 'alt_starts', 'alt_ends')
+
+
+class ColumnarVCF:
+    __slots__ = ('header', 'contigs', 'chrom_codes', 'positions', 'starts', 'ends', 'ref_starts', 'alt_starts', 'alt_ends', 'buffer',
+                 '_fingerprints', '_index')
+
+    def __init__(self, header: Optional[List[str]] = None):
+        self.header = header
+        self.contigs: List[str] = []
+        self.chrom_codes = array('I')
+        self.positions = array('q')
+        # Byte offsets of each row in the shared buffer, and of REF/ALT within the row
+        self.starts = array('Q')
+        self.ends = array('Q')
+        self.ref_starts = array('I')
+        self.alt_starts = array('I')
+        self.alt_ends = array('I')
+        self.buffer = b''
+        self._fingerprints: Optional[array] = None
+        self._index: Optional[PositionIndex] = None
+
+    @classmethod
+    def from_stream(cls, stream: Iterable[str], processes: int = 1) -> 'ColumnarVCF':
+        # The records are parsed in chunks of lines. With more than one process the chunks are parsed
+        # by a pool of workers, which send back the arrays and the buffer of their chunk
+        header: List[str] = []
+        return cls._from_chunks(_chunks(stream, header), header, processes)
+
+    @classmethod
+    def from_file(cls, fname: str, processes: int = 1) -> 'ColumnarVCF':
+        # As from_stream, but the chunks are cut from the decompressed bytes at the last line break,
+        # so the lines are only split by the process that parses them
+        header: List[str] = []
+        return cls._from_chunks(_byte_chunks(read_vcf_blocks(fname), header), header, processes)
+
+    @classmethod
+    def _from_chunks(cls, chunks: Iterable[bytes], header: List[str], processes: int) -> 'ColumnarVCF':
+        if processes > 1:
+            parts = list(_parse_chunks_parallel(chunks, processes))
+        else:
+            parts = [_parse_chunk(chunk) for chunk in chunks]
+        return cls.concat(parts, header=header)
+
+    @classmethod
+    def concat(cls, parts: Sequence['ColumnarVCF'], header: Optional[List[str]] = None) -> 'ColumnarVCF':
+        vcf = cls(header=header)
+        codes: Dict[str, int] = {}
+        shift = 0
+        for part in parts:
+            remap = []
+            for contig in part.contigs:
+                code = codes.get(contig)
+                if code is None:
+                    code = codes[contig] = len(vcf.contigs)
+                    vcf.contigs.append(contig)
+                remap.append(code)
+            if remap == list(range(len(remap))):
+                vcf.chrom_codes.extend(part.chrom_codes)
+            else:
+                vcf.chrom_codes.extend(map(remap.__getitem__, part.chrom_codes))
+            if shift:
+                vcf.starts.extend(map(shift.__add__, part.starts))
+                vcf.ends.extend(map(shift.__add__, part.ends))
+            else:
+                vcf.starts.extend(part.starts)
+                vcf.ends.extend(part.ends)
+            for column in ('positions', 'ref_starts', 'alt_starts', 'alt_ends'):
+                getattr(vcf, column).extend(getattr(part, column))
+            shift += len(part.buffer) + 1
+        vcf.buffer = b'\n'.join(part.buffer for part in parts)
+        return vcf
+
+    @classmethod
+    def from_vcf(cls, vcf: VCF) -> 'ColumnarVCF':
+        columnar = cls.from_stream(row._format_row() for row in vcf.rows)
+        columnar.header = vcf.header
+        return columnar
+
+    def to_vcf(self) -> VCF:
+        return VCF(list(self), header=self.header)
+
+    def _take(self, indexes: Iterable[int]) -> 'ColumnarVCF':
+        vcf = ColumnarVCF(header=self.header)
+        vcf.contigs = self.contigs
+        vcf.buffer = self.buffer
+        indexes = list(indexes)
+        for column in COLUMNS:
+            old, new = getattr(self, column), getattr(vcf, column)
+            new.extend(old[i] for i in indexes)
+        if self._fingerprints is not None:
+            vcf._fingerprints = array('Q', (self._fingerprints[i] for i in indexes))
+        return vcf
+
+    def __len__(self):
+        return len(self.positions)
+
+    def __getitem__(self, x: int) -> VCFrow:
+        return _parse_vcf_line(self.line(x))
+
+    def __iter__(self) -> Iterator[VCFrow]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def __add__(self, other):
+        return ColumnarVCF.concat([self, other], header=Header.merge(self.header, other.header))
+
+    def raw(self, x: int) -> bytes:
+        return self.buffer[self.starts[x]:self.ends[x]]
+
+    def line(self, x: int) -> str:
+        return self.raw(x).decode()
+
+    def chrom(self, x: int) -> str:
+        return self.contigs[self.chrom_codes[x]]
+
+    def ref(self, x: int) -> str:
+        start = self.starts[x]
+        return self.buffer[start + self.ref_starts[x]:start + self.alt_starts[x] - 1].decode()
+
+    def alt(self, x: int) -> str:
+        start = self.starts[x]
+        return self.buffer[start + self.alt_starts[x]:start + self.alt_ends[x]].decode()
+
+    def fingerprints(self) -> array:
+        # The site fingerprints of VCFrow.site_fingerprint, computed once
+        if self._fingerprints is None:
+            self._fingerprints = array('Q', (fingerprint(f'{self.chrom(i)}\t{self.positions[i]}\t{self.ref(i).upper()}\t{self.alt(i).upper()}')
+                                             for i in range(len(self))))
+        return self._fingerprints
+
+    def _contig_ranks(self) -> List[int]:
+        # Contigs declared in the header keep their declared order
+        contig_key = Header(self.header or []).contig_key
+        order = sorted(range(len(self.contigs)), key=lambda code: contig_key(self.contigs[code]))
+        ranks = [0] * len(order)
+        for rank, code in enumerate(order):
+            ranks[code] = rank
+        return ranks
+
+    def sort_keys(self) -> List[int]:
+        ranks = self._contig_ranks()
+        return [ranks[code] << POS_BITS | pos for code, pos in zip(self.chrom_codes, self.positions)]
+
+    def sort(self) -> 'ColumnarVCF':
+        keys = self.sort_keys()
+        return self._take(sorted(range(len(self)), key=keys.__getitem__))
+
+    @property
+    def index(self) -> PositionIndex:
+        # Sorted positions per contig code, built on first use
+        if self._index is None or self._index.size != len(self):
+            self._index = PositionIndex.from_columns(self.chrom_codes, self.positions)
+        return self._index
+
+    def get_from_chrom(self, chrom: str) -> 'ColumnarVCF':
+        if chrom not in self.contigs:
+            return self._take([])
+        return self._take(self.index.chrom(self.contigs.index(chrom)))
+
+    def get_near_location(self, chrom: str, pos: int, tol: int = 50) -> 'ColumnarVCF':
+        if chrom not in self.contigs:
+            return self._take([])
+        return self._take(self.index.window(self.contigs.index(chrom), pos, tol))
+
+    def remove_true_duplicates(self) -> 'ColumnarVCF':
+        seen = set()
+        keep = []
+        for i in range(len(self)):
+            raw = self.raw(i)
+            if raw not in seen:
+                seen.add(raw)
+                keep.append(i)
+        return self._take(keep).sort()
+
+    def remove_loc_dup(self) -> 'ColumnarVCF':
+        seen = set()
+        keep = []
+        for i, loc in enumerate(zip(self.chrom_codes, self.positions)):
+            if loc not in seen:
+                seen.add(loc)
+                keep.append(i)
+        return self._take(keep).sort()
+
+    def deduplicate(self, key: str = 'row', keep: str = 'first'):
+        # Other keys and policies look into the rows, so they go through VCF
+        if keep == 'first' and key == 'row':
+            return self.remove_true_duplicates()
+        if keep == 'first' and key == 'loc':
+            return self.remove_loc_dup()
+        return self.to_vcf().deduplicate(key=key, keep=keep)
+
+    def annotate(self, value: str) -> 'ColumnarVCF':
+        # Adds Annotation=value to the INFO column of every row, as VCF.annotate does. The columns before INFO
+        # keep their offsets, so only the row offsets change
+        annotation = f'Annotation={value}'.encode()
+        vcf = ColumnarVCF(header=Header(self.header or []).add(ANNOTATION_INFO))
+        vcf.contigs = self.contigs
+        for column in ('chrom_codes', 'positions', 'ref_starts', 'alt_starts', 'alt_ends'):
+            getattr(vcf, column).extend(getattr(self, column))
+        lines = []
+        offset = 0
+        for i in range(len(self)):
+            fields = self.raw(i).split(b'\t', 8)
+            info = fields[7]
+            if info in (b'', b'.'):
+                fields[7] = annotation
+            elif info.startswith(b'Annotation=') or b';Annotation=' in info:
+                parsed = Info(info.decode())
+                parsed['Annotation'] = value
+                fields[7] = str(parsed).encode()
+            else:
+                fields[7] = info + b';' + annotation
+            line = b'\t'.join(fields)
+            vcf.starts.append(offset)
+            vcf.ends.append(offset + len(line))
+            offset += len(line) + 1
+            lines.append(line)
+        vcf.buffer = b'\n'.join(lines)
+        return vcf.sort()
+
+    def to_file(self, fname, index: Optional[str] = None, background: bool = False):
+        with VCFWriter(fname, header=self.header, index=index, background=background) as writer:
+            writer.write_lines(self.line(i) for i in range(len(self)))
+
+
+def _chunks(stream: Iterable[str], header: List[str]) -> Iterator[bytes]:
+    # Header lines are collected on the way, so the header is complete once the chunks are consumed
+    lines: List[str] = []
+    for line in stream:
+        if line.startswith('#'):
+            header.append(line)
+            continue
+        lines.append(line)
+        if len(lines) == CHUNK_LINES:
+            yield '\n'.join(lines).encode()
+            lines = []
+    if lines:
+        yield '\n'.join(lines).encode()
+
+
+def _split_header(data: bytes, header: List[str]) -> Tuple[bytes, bool]:
+    # Moves the header lines at the start of data to header. Returns the records, and whether the header may go on
+    start = 0
+    while start < len(data):
+        if data[start] in b'\r\n':
+            start += 1
+        elif data[start] == ord('#'):
+            end = data.find(b'\n', start)
+            end = len(data) if end < 0 else end
+            header.append(data[start:end].rstrip(b'\r').decode())
+            start = end + 1
+        else:
+            return data[start:], False
+    return b'', True
+
+
+def _byte_chunks(blocks: Iterable[bytes], header: List[str]) -> Iterator[bytes]:
+    # Blocks are gathered until there are CHUNK_BYTES and cut after the last complete line. The rest is carried over
+    parts: List[bytes] = []
+    size = 0
+    in_header = True
+    for block in blocks:
+        parts.append(block)
+        size += len(block)
+        if size < CHUNK_BYTES:
+            continue
+        data = b''.join(parts)
+        cut = data.rfind(b'\n')
+        if cut < 0:
+            parts = [data]
+            continue
+        chunk, rest = data[:cut], data[cut + 1:]
+        parts, size = [rest], len(rest)
+        if in_header:
+            chunk, in_header = _split_header(chunk, header)
+        if chunk:
+            yield chunk
+    chunk = b''.join(parts).rstrip(b'\r\n')
+    if in_header:
+        chunk, _ = _split_header(chunk, header)
+    if chunk:
+        yield chunk
+
+
+def _parse_chunk(data: bytes) -> ColumnarVCF:
+    # The chunk becomes the buffer as it is, so only the columns are built here
+    vcf = ColumnarVCF()
+    codes: Dict[bytes, int] = {}
+    offset = 0
+    if b'\r' in data:
+        data = data.replace(b'\r\n', b'\n').rstrip(b'\r')
+    for line in data.split(b'\n'):
+        if not line:
+            # Empty lines stay in the buffer, but are no record
+            offset += 1
+            continue
+        chrom, pos, id_, ref, alt, _ = line.split(b'\t', 5)
+        code = codes.get(chrom)
+        if code is None:
+            code = codes[chrom] = len(vcf.contigs)
+            vcf.contigs.append(chrom.decode())
+        ref_start = len(chrom) + len(pos) + len(id_) + 3
+        alt_start = ref_start + len(ref) + 1
+        vcf.chrom_codes.append(code)
+        vcf.positions.append(int(pos))
+        vcf.starts.append(offset)
+        vcf.ends.append(offset + len(line))
+        vcf.ref_starts.append(ref_start)
+        vcf.alt_starts.append(alt_start)
+        vcf.alt_ends.append(alt_start + len(alt))
+        offset += len(line) + 1
+    vcf.buffer = data
+    return vcf
+
+
+def _parse_chunks_parallel(chunks: Iterable[bytes], processes: int) -> Iterator[ColumnarVCF]:
+    # Only a few chunks per worker are read ahead, and the parsed chunks come back in their input order
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending: Deque = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(_parse_chunk, chunk))
+            if len(pending) >= processes * CHUNKS_PER_PROCESS:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
@@ -1,15 +1,16 @@
-from dataclasses import dataclass
-from typing import List, Optional
+from collections import Counter
+from dataclasses import dataclass, field
+from hashlib import blake2b
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
+from varcomb.dedup import deduplicate
 from varcomb.exceptions import LocationShiftError
+from varcomb.header import ANNOTATION_INFO, Header, chrom_key, sort_rows
+from varcomb.index import PositionIndex
+from varcomb.writer import VCFWriter
 
-
-def as_int(x):
-    try:
-        xp = int(x)
-    except ValueError:
-        xp = x.upper()
-    return xp
+if TYPE_CHECKING:  # pragma: no cover
+    from varcomb.query import Query
 
 
 @dataclass
@@ -18,11 +19,6 @@ class Location:
     chrom: str
     pos: int
 
-    def _trim_chrom(self):
-        if self.chrom.lower().startswith('chr'):
-            return as_int(self.chrom[3:])
-        return as_int(self.chrom)
-
     def __sub__(self, other) -> Optional[int]:
         if self.chrom != other.chrom:
             return None
@@ -36,171 +32,386 @@ class Location:
     def __lt__(self, other):
         if self.chrom == other.chrom:
             return self.pos < other.pos
-        chrom1 = self._trim_chrom()
-        chrom2 = other._trim_chrom()
-        if isinstance(chrom1, str) and isinstance(chrom2, int):
-            return False
-        elif isinstance(chrom1, int) and isinstance(chrom2, str):
-            return True
-        # Both are int or str
-        return chrom1 < chrom2
+        return chrom_key(self.chrom) < chrom_key(other.chrom)
 
     def __hash__(self):
-        return hash(self.chrom) + hash(self.pos)
+        return hash((self.chrom, self.pos))
 
     def shift(self, shift: int):
         return self + shift
 
 
 class Info:
-    __slots__ = 'info'
-
-    def __init__(self, info):
-        self.info = info
-
-    def _convert_to_dict(self, info):
-        if isinstance(info, str):
-            self.info = dict()
-            if info != '':
-                for k in info.split(';'):
-                    if '=' in k:
-                        key, value = k.split('=')
-                        self.info[key] = value
-                    else:
-                        self.info[k] = True
+    __slots__ = '_raw', '_data', 'types'
+
+    def __init__(self, info: Union[str, Dict[str, Any]] = '', types: Optional[Dict[str, Callable[[str], Any]]] = None):
+        # The raw string is parsed on first use, and serialized again only after a modification
+        if isinstance(info, dict):
+            self._raw: Optional[str] = None
+            self._data: Optional[Dict[str, Any]] = dict(info)
+        else:
+            self._raw = info
+            self._data = None
+        self.types = types
+
+    def _parse(self) -> Dict[str, Any]:
+        if self._data is None:
+            data: Dict[str, Any] = {}
+            if self._raw and self._raw != '.':
+                for item in self._raw.split(';'):
+                    key, sep, value = item.partition('=')
+                    data[key] = value if sep else True
+            self._data = data
+        return self._data
+
+    def _find(self, key: str) -> Any:
+        # Look up a single key in the raw string without parsing all of it
+        raw = self._raw
+        end = len(key)
+        i = raw.find(key)
+        while i >= 0:
+            j = i + end
+            if i == 0 or raw[i - 1] == ';':
+                if j == len(raw) or raw[j] == ';':
+                    return True
+                if raw[j] == '=':
+                    k = raw.find(';', j)
+                    return raw[j + 1:k] if k >= 0 else raw[j + 1:]
+            i = raw.find(key, i + 1)
+        raise KeyError(key)
+
+    def _cast(self, key: str, value: Any) -> Any:
+        if self.types is None or not isinstance(value, str) or key not in self.types:
+            return value
+        try:
+            return self.types[key](value)
+        except ValueError:
+            # A value that does not match its header definition is kept as it is written
+            return value
 
     def __eq__(self, other):
-        return self.info == other.info
+        if isinstance(other, str):
+            return str(self) == other
+        if not isinstance(other, Info):
+            return NotImplemented
+        if self._data is None and other._data is None:
+            return self._raw == other._raw
+        return self._parse() == other._parse()
 
     def __len__(self):
-        if isinstance(self.info, str):
-            if ';' in self.info:
-                return self.info.count(';') + 1
-            return 0
-        return len(self.info)
+        if self._data is None:
+            if not self._raw or self._raw == '.':
+                return 0
+            return self._raw.count(';') + 1
+        return len(self._data)
+
+    def __contains__(self, key):
+        if self._data is None:
+            try:
+                self._find(key)
+            except KeyError:
+                return False
+            return True
+        return key in self._data
 
     def __getitem__(self, key):
-        self._convert_to_dict(self.info)
-        return self.info[key]
+        if self._data is None:
+            return self._cast(key, self._find(key))
+        return self._cast(key, self._data[key])
 
     def __setitem__(self, key, value):
-        if isinstance(self.info, str):
-            if ';' in self.info:
-                self.info += f';{key}={value}'
-            else:
-                self.info += f'{key}={value}'
-        else:
-            self.info[key] = value
+        if self._data is None:
+            raw = self._raw
+            if not raw or raw == '.':
+                self._raw = f'{key}={value}'
+                return
+            if key not in raw:
+                # Appending a new key, e.g. an annotation, does not need the rest of the field parsed
+                self._raw = f'{raw};{key}={value}'
+                return
+        self._parse()[key] = value
+        self._raw = None
+
+    def __delitem__(self, key):
+        del self._parse()[key]
+        self._raw = None
 
     def __str__(self):
-        if isinstance(self.info, str):
-            return self.info
-        else:
-            return ';'.join([f'{k}={v}' for k, v in self.info.items()])
+        if self._raw is None:
+            fields = [key if value is True else f'{key}={value}' for key, value in self._data.items()]
+            self._raw = ';'.join(fields) if fields else '.'
+        return self._raw
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
 
     def keys(self):
-        self._convert_to_dict(self.info)
-        return self.info.keys()
+        return self._parse().keys()
 
     def values(self):
-        self._convert_to_dict(self.info)
-        return self.info.values()
+        return [self._cast(key, value) for key, value in self._parse().items()]
+
+    def items(self):
+        return [(key, self._cast(key, value)) for key, value in self._parse().items()]
+
+
+def fingerprint(text: str) -> int:
+    # 64 bits: collisions are not to be expected below billions of distinct rows
+    return int.from_bytes(blake2b(text.encode(), digest_size=8).digest(), 'little')
+
+
+# Fields of a row that make up its hash
+HASHED_FIELDS = frozenset(('loc', 'id', 'ref', 'alt', 'qual', 'filter', 'format'))
 
 
-@dataclass
 class VCFrow:
-    __slots__ = 'loc', 'id', 'ref', 'alt', 'qual', 'filter', 'info', 'format', 'samples'
-    loc: Location
-    id: str
-    ref: str
-    alt: str
-    qual: str
-    filter: str
-    info: Info
-    format: str
-    samples: List[str]
+    __slots__ = 'loc', 'id', 'ref', 'alt', 'qual', 'filter', 'info', 'format', '_samples', '_raw_samples', '_hash'
+
+    def __init__(self, loc: Location, id: str, ref: str, alt: str, qual: str, filter: str, info: Info, format: str,
+                 samples: Union[str, List[str]] = ''):
+        # Assigned through the slots, bypassing __setattr__, which is only needed for later changes
+        _set_loc(self, loc)
+        _set_id(self, id)
+        _set_ref(self, ref)
+        _set_alt(self, alt)
+        _set_qual(self, qual)
+        _set_filter(self, filter)
+        _set_info(self, info)
+        _set_format(self, format)
+        # The sample columns are kept as the raw, tab separated string until they are accessed
+        if isinstance(samples, str):
+            _set_raw_samples(self, samples)
+            _set_samples(self, None)
+        else:
+            _set_raw_samples(self, None)
+            _set_samples(self, samples)
+        _set_hash(self, None)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        if name in HASHED_FIELDS:
+            object.__setattr__(self, '_hash', None)
+
+    @property
+    def samples(self) -> List[str]:
+        if self._samples is None:
+            raw = self._raw_samples
+            _set_samples(self, raw.split('\t') if raw else [])
+            _set_raw_samples(self, None)
+        return self._samples
+
+    @samples.setter
+    def samples(self, samples: List[str]):
+        _set_samples(self, samples)
+        _set_raw_samples(self, None)
+
+    def _split_samples(self) -> List[str]:
+        if self._samples is not None:
+            return self._samples
+        return self._raw_samples.split('\t') if self._raw_samples else []
+
+    def __eq__(self, other):
+        if not isinstance(other, VCFrow):
+            return NotImplemented
+        if (self.loc, self.id, self.ref, self.alt, self.qual, self.filter, self.format) != \
+                (other.loc, other.id, other.ref, other.alt, other.qual, other.filter, other.format):
+            return False
+        if self.info != other.info:
+            return False
+        if self._raw_samples is not None and other._raw_samples is not None:
+            return self._raw_samples == other._raw_samples
+        return self._split_samples() == other._split_samples()
 
     def __lt__(self, other) -> bool:
         return self.loc < other.loc
 
     def __hash__(self):
-        return hash((self.loc, self.id, self.ref, self.alt, self.qual, self.filter, self.format))
+        if self._hash is None:
+            _set_hash(self, hash((self.loc, self.id, self.ref, self.alt, self.qual, self.filter, self.format)))
+        return self._hash
+
+    def __repr__(self):
+        return (f'VCFrow(loc={self.loc!r}, id={self.id!r}, ref={self.ref!r}, alt={self.alt!r}, qual={self.qual!r}, '
+                f'filter={self.filter!r}, info={self.info!r}, format={self.format!r}, samples={self._split_samples()!r})')
+
+    def site_fingerprint(self) -> int:
+        return fingerprint(f'{self.loc.chrom}\t{self.loc.pos}\t{self.ref.upper()}\t{self.alt.upper()}')
+
+    def row_fingerprint(self) -> int:
+        return fingerprint(self._format_row())
 
     def _format_row(self):
         res = [self.loc.chrom, self.loc.pos, self.id, self.ref, self.alt, self.qual, self.filter, str(self.info), self.format]
-        return '\t'.join(map(str, res + self.samples))
+        if self._samples is not None:
+            res.extend(self._samples)
+        elif self._raw_samples:
+            res.append(self._raw_samples)
+        return '\t'.join(map(str, res))
+
+
+# What set operations and diffs compare rows on: the site (CHROM, POS, REF and ALT) or the whole row
+FINGERPRINTS: Dict[str, Callable[[VCFrow], int]] = {
+    'site': VCFrow.site_fingerprint,
+    'row': VCFrow.row_fingerprint,
+}
+
+
+def fingerprint_func(key: str) -> Callable[[VCFrow], int]:
+    if key not in FINGERPRINTS:
+        raise ValueError(f'Unknown fingerprint key "{key}". Choose from: {", ".join(FINGERPRINTS)}')
+    return FINGERPRINTS[key]
+
+
+# Setters of the slots of VCFrow that bypass its __setattr__, which only has to catch later changes of hashed fields
+_set_loc = VCFrow.loc.__set__
+_set_id = VCFrow.id.__set__
+_set_ref = VCFrow.ref.__set__
+_set_alt = VCFrow.alt.__set__
+_set_qual = VCFrow.qual.__set__
+_set_filter = VCFrow.filter.__set__
+_set_info = VCFrow.info.__set__
+_set_format = VCFrow.format.__set__
+_set_samples = VCFrow._samples.__set__
+_set_raw_samples = VCFrow._raw_samples.__set__
+_set_hash = VCFrow._hash.__set__
 
 
 @dataclass
 class VCF:
     rows: List[VCFrow]
-    header: Optional[List[str]] = None
+    header: Optional[Header] = None
+    _index: Optional[PositionIndex] = field(default=None, init=False, repr=False)
+    # The list of rows the index was built from
+    _index_rows: Optional[List[VCFrow]] = field(default=None, init=False, repr=False)
+
+    def __post_init__(self):
+        self.header = Header.from_lines(self.header)
 
-    def __str__(self):  # pragma: no cover
-        o = ''
-        for row in self.rows:
-            o += row._format_row() + '\n'
-        return o
+    def __str__(self):
+        return ''.join(f'{row._format_row()}\n' for row in self.rows)
 
     def __len__(self):
         return len(self.rows)
 
     def __add__(self, other):
-        # TODO: Merge headers
-        return VCF(self.rows + other.rows, header=self.header)
+        return VCF(self.rows + other.rows, header=Header.merge(self.header, other.header))
 
     def __getitem__(self, x: int) -> VCFrow:
         return self.rows[x]
 
     def __eq__(self, other):
-        for row in self.rows:
-            if row not in other.rows:
-                return False
-        return True
+        # The same rows, in any order
+        if not isinstance(other, VCF):
+            return NotImplemented
+        if len(self.rows) != len(other.rows):
+            return False
+        return Counter(map(VCFrow.row_fingerprint, self.rows)) == Counter(map(VCFrow.row_fingerprint, other.rows))
+
+    @property
+    def index(self) -> PositionIndex:
+        # Built again when rows is replaced or grows or shrinks. Rows that are replaced or changed in place
+        # (e.g. rows[0] = row or row.loc = loc) need invalidate_index()
+        rows = self.rows
+        if self._index is None or self._index_rows is not rows or self._index.size != len(rows):
+            self._index = PositionIndex(rows)
+            self._index_rows = rows
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
+
+    def _select(self, indexes: List[int]):
+        return VCF([self.rows[i] for i in indexes], header=self.header)
 
     def get_from_chrom(self, chrom):
-        return VCF([row for row in self.rows if row.loc.chrom == chrom], header=self.header)
+        return self._select(self.index.chrom(chrom))
+
+    def get_range(self, chrom, start, end):
+        return self._select(self.index.range(chrom, start, end))
 
     def get_near_location(self, chrom, pos, tol=50):
-        rows = []
-        for row in self.get_from_chrom(chrom):
-            if (pos - tol < row.loc.pos) and (row.loc.pos < pos + tol):
-                rows.append(row)
-        return VCF(rows, header=self.header)
+        return self._select(self.index.window(chrom, pos, tol))
+
+    def get_near_locations(self, sites: Iterable[Tuple[str, int]], tol=50) -> List['VCF']:
+        index = self.index
+        return [self._select(index.window(chrom, pos, tol)) for chrom, pos in sites]
+
+    def sort(self):
+        # Contigs are ordered as declared in the header, if there is one
+        return VCF(sort_rows(self.rows, self.header), header=self.header)
+
+    def deduplicate(self, key: str = 'row', keep: str = 'first'):
+        return VCF(deduplicate(self.rows, key=key, keep=keep, header=self.header), header=self.header)
 
     def remove_true_duplicates(self):
-        return VCF(sorted(list(set(self.rows))), header=self.header)
+        return self.deduplicate(key='row')
 
     def remove_loc_dup(self):
-        rows: List[VCFrow] = [row for row in self.rows]
-        completed = False
-        while not completed:
-            for row in rows:
-                mask = [row.loc == r.loc for r in rows]
-                if sum(mask) > 1:
-                    mask[mask.index(True)] = False
-                    rows = [row for row, m in zip(rows, mask) if not m]
-                    break
-                if sum(mask) == 1:
-                    completed = True
-            else:
-                break
-        return VCF(sorted(list(set(rows))), header=self.header)
-
-    def to_file(self, fname):
-        header = '\n'.join(self.header) if self.header is not None else ''
-        rows = []
-        for row in self.rows:
-            rows.append(row._format_row())
-
-        rows = '\n'.join(rows)
-        data = f'{header}\n{rows}'
-        with open(fname.replace('.gz', ''), 'w') as f:
-            f.write(data)
+        return self.deduplicate(key='loc')
+
+    def lazy(self, is_sorted: bool = False) -> 'Query':
+        # Query imports VCF, so it is only imported once it is used
+        from varcomb.query import Query
+        return Query.from_rows(self.rows, self.header, is_sorted=is_sorted)
+
+    def fingerprints(self, key: str = 'site') -> Set[int]:
+        return set(map(fingerprint_func(key), self.rows))
+
+    def intersection(self, other: 'VCF', key: str = 'site'):
+        fingerprints = other.fingerprints(key)
+        func = fingerprint_func(key)
+        return VCF([row for row in self.rows if func(row) in fingerprints], header=self.header)
+
+    def difference(self, other: 'VCF', key: str = 'site'):
+        fingerprints = other.fingerprints(key)
+        func = fingerprint_func(key)
+        return VCF([row for row in self.rows if func(row) not in fingerprints], header=self.header)
+
+    def union(self, other: 'VCF', key: str = 'site'):
+        return (self + other.difference(self, key=key)).sort()
+
+    def diff(self, other: 'VCF', key: str = 'site') -> 'VCFDiff':
+        # Rows are paired one to one, so a row repeated twice in self and once in other is shared once
+        func = fingerprint_func(key)
+        first, second = list(map(func, self.rows)), list(map(func, other.rows))
+        shared, first_only = _pair(self.rows, first, Counter(second))
+        _, second_only = _pair(other.rows, second, Counter(first))
+        return VCFDiff(shared=VCF(shared, header=self.header), first_only=VCF(first_only, header=self.header),
+                       second_only=VCF(second_only, header=other.header))
+
+    def to_file(self, fname, index: Optional[str] = None, background: bool = False):
+        with VCFWriter(fname, header=self.header, index=index, background=background) as writer:
+            writer.write_rows(self.rows)
 
     def annotate(self, value: str):
         rows: List[VCFrow] = [row for row in self.rows]
         for i, row in enumerate(rows):
             row.info['Annotation'] = value
             rows[i] = row
-        return VCF(sorted(rows), header=self.header)
+        header = self.header.add(ANNOTATION_INFO) if self.header is not None else None
+        return VCF(rows, header=header).sort()
+
+
+@dataclass
+class VCFDiff:
+    # Shared rows are the ones of the first VCF
+    shared: VCF
+    first_only: VCF
+    second_only: VCF
+
+    def counts(self) -> Dict[str, int]:
+        return {'shared': len(self.shared), 'first_only': len(self.first_only), 'second_only': len(self.second_only)}
+
+
+def _pair(rows: List[VCFrow], fingerprints: List[int], remaining: Counter) -> Tuple[List[VCFrow], List[VCFrow]]:
+    paired, unpaired = [], []
+    for row, fp in zip(rows, fingerprints):
+        if remaining[fp] > 0:
+            remaining[fp] -= 1
+            paired.append(row)
+        else:
+            unpaired.append(row)
+    return paired, unpaired
@@ -0,0 +1,85 @@
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Iterable, Iterator, List, Optional
+
+from varcomb.header import Header, sort_rows
+
+if TYPE_CHECKING:  # pragma: no cover
+    from varcomb.core import VCFrow
+
+
+def _normalized_allele(row: 'VCFrow') -> Hashable:
+    pos, ref, alt = row.loc.pos, row.ref, row.alt
+    if ',' not in alt:
+        while len(ref) > 1 and len(alt) > 1 and ref[-1] == alt[-1]:
+            ref, alt = ref[:-1], alt[:-1]
+        while len(ref) > 1 and len(alt) > 1 and ref[0] == alt[0]:
+            ref, alt = ref[1:], alt[1:]
+            pos += 1
+    return row.loc.chrom, pos, ref.upper(), alt.upper()
+
+
+def _qual(row: 'VCFrow') -> float:
+    try:
+        return float(row.qual)
+    except ValueError:
+        return float('-inf')
+
+
+KEYS: Dict[str, Callable[['VCFrow'], Hashable]] = {
+    'row': lambda row: row,
+    'loc': lambda row: row.loc,
+    'allele': lambda row: (row.loc, row.ref, row.alt),
+    'normalized': _normalized_allele,
+}
+
+# Whether a new row should replace the one already kept for the same key
+POLICIES: Dict[str, Optional[Callable[['VCFrow', 'VCFrow'], bool]]] = {
+    'first': None,
+    'qual': lambda new, old: _qual(new) > _qual(old),
+    'pass': lambda new, old: new.filter == 'PASS' and old.filter != 'PASS',
+}
+
+# Keys for which duplicates always share a position, so a sorted stream can be deduplicated per position
+STREAMING_KEYS = ('row', 'loc', 'allele')
+
+
+def _lookup(key: str, keep: str):
+    if key not in KEYS:
+        raise ValueError(f'Unknown deduplication key "{key}". Choose from: {", ".join(KEYS)}')
+    if keep not in POLICIES:
+        raise ValueError(f'Unknown deduplication policy "{keep}". Choose from: {", ".join(POLICIES)}')
+    return KEYS[key], POLICIES[keep]
+
+
+def _add(group: dict, row: 'VCFrow', keyfunc, better) -> None:
+    k = keyfunc(row)
+    current = group.get(k)
+    if current is None or (better is not None and better(row, current)):
+        group[k] = row
+
+
+def deduplicate(rows: Iterable['VCFrow'], key: str = 'row', keep: str = 'first',
+                header: Optional[Header] = None) -> List['VCFrow']:
+    keyfunc, better = _lookup(key, keep)
+    kept: dict = {}
+    for row in rows:
+        _add(kept, row, keyfunc, better)
+    return sort_rows(kept.values(), header)
+
+
+def _deduplicate_sorted(rows: Iterable['VCFrow'], keyfunc, better) -> Iterator['VCFrow']:
+    loc = None
+    group: dict = {}
+    for row in rows:
+        if row.loc != loc:
+            yield from group.values()
+            group = {}
+            loc = row.loc
+        _add(group, row, keyfunc, better)
+    yield from group.values()
+
+
+def deduplicate_sorted(rows: Iterable['VCFrow'], key: str = 'row', keep: str = 'first') -> Iterator['VCFrow']:
+    keyfunc, better = _lookup(key, keep)
+    if key not in STREAMING_KEYS:
+        raise ValueError(f'Deduplication key "{key}" is not supported on streams. Choose from: {", ".join(STREAMING_KEYS)}')
+    return _deduplicate_sorted(rows, keyfunc, better)
@@ -0,0 +1,65 @@
+import heapq
+from collections import Counter
+from contextlib import ExitStack
+from itertools import groupby
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from varcomb.core import Location, VCFrow, fingerprint_func
+from varcomb.match import _tag
+from varcomb.merge import merge_order, open_sorted
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+from varcomb.writer import VCFWriter
+
+KINDS = ('shared', 'first_only', 'second_only')
+
+
+def diff_sorted(first: Iterable[VCFrow], second: Iterable[VCFrow], key: str = 'site',
+                order: Optional[Callable[[Location], Any]] = None) -> Iterator[Tuple[str, VCFrow]]:
+    # Both inputs are sorted, so only the rows at one position are held in memory.
+    # Rows are paired one to one, as in VCF.diff; shared rows are the ones of the first input.
+    func = fingerprint_func(key)
+    loc_key = (lambda call: call[1].loc) if order is None else (lambda call: order(call[1].loc))
+    calls = heapq.merge(_tag(first, 0), _tag(second, 1), key=loc_key)
+    for _, group in groupby(calls, key=lambda call: call[1].loc):
+        rows: Tuple[List[Tuple[int, VCFrow]], List[Tuple[int, VCFrow]]] = ([], [])
+        for caller, row in group:
+            rows[caller].append((func(row), row))
+        remaining = Counter(fp for fp, _ in rows[1])
+        for fp, row in rows[0]:
+            if remaining[fp] > 0:
+                remaining[fp] -= 1
+                yield 'shared', row
+            else:
+                yield 'first_only', row
+        remaining = Counter(fp for fp, _ in rows[0])
+        for fp, row in rows[1]:
+            if remaining[fp] > 0:
+                remaining[fp] -= 1
+            else:
+                yield 'second_only', row
+
+
+def diff_vcf_files(fname1: str, fname2: str, prefix: Optional[str] = None, key: str = 'site',
+                   streaming: bool = False) -> Dict[str, int]:
+    if streaming:
+        inputs, header = open_sorted([fname1, fname2])
+        headers = [vcf.header for vcf in inputs]
+        results: Iterable[Tuple[str, VCFrow]] = diff_sorted(inputs[0], inputs[1], key=key, order=merge_order(header))
+    else:
+        vcf1, vcf2 = parse_vcf_file(read_vcf(fname1)), parse_vcf_file(read_vcf(fname2))
+        headers = [vcf1.header, vcf2.header]
+        diff = vcf1.diff(vcf2, key=key)
+        results = ((kind, row) for kind in KINDS for row in getattr(diff, kind).rows)
+    counts = {kind: 0 for kind in KINDS}
+    writers: Dict[str, VCFWriter] = {}
+    with ExitStack() as stack:
+        if prefix is not None:
+            writers = {kind: stack.enter_context(VCFWriter(f'{prefix}.{kind}.vcf',
+                                                           header=headers[1] if kind == 'second_only' else headers[0]))
+                       for kind in KINDS}
+        for kind, row in results:
+            counts[kind] += 1
+            if writers:
+                writers[kind].write_row(row)
+    return counts
@@ -8,3 +8,7 @@ class LocationDifferentChromosomeError(Exception):
 
 class VCFFileNotSupported(Exception):
     pass
+
+
+class VCFNotSortedError(Exception):
+    pass
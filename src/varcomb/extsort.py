@@ -0,0 +1,85 @@
+import heapq
+import tempfile
+from typing import IO, Callable, Iterable, Iterator, List, Optional, Tuple
+
+from varcomb.header import Header
+
+# Default memory budget for the records held before a sorted run is spilled to disk
+SORT_MEMORY = 512 << 20
+# Rough per-line overhead of a str in a list, on top of its characters
+LINE_OVERHEAD = 64
+# Most runs merged at once; more runs are first merged into larger ones to bound the open files
+MERGE_FANIN = 128
+
+LineKey = Callable[[str], Tuple[tuple, int]]
+
+
+def line_key(header: Header) -> LineKey:
+    contig_key = header.contig_key
+
+    def key(line: str) -> Tuple[tuple, int]:
+        chrom, pos, _ = line.split('\t', 2)
+        return contig_key(chrom), int(pos)
+    return key
+
+
+def _spill(lines: List[str], key: LineKey, directory: Optional[str]) -> IO[str]:
+    lines.sort(key=key)
+    run = tempfile.TemporaryFile('w+', dir=directory, prefix='varcomb')
+    run.write('\n'.join(lines))
+    run.write('\n')
+    run.seek(0)
+    return run
+
+
+def _read_run(run: IO[str]) -> Iterator[str]:
+    with run:
+        for line in run:
+            yield line.rstrip('\n')
+
+
+def _merge_runs(runs: List[IO[str]], key: LineKey, directory: Optional[str]) -> Iterator[str]:
+    # heapq.merge is stable, and merged runs stay in front, so records with the same position keep their input order
+    while len(runs) > MERGE_FANIN:
+        merged = tempfile.TemporaryFile('w+', dir=directory, prefix='varcomb')
+        merged.writelines(f'{line}\n' for line in heapq.merge(*map(_read_run, runs[:MERGE_FANIN]), key=key))
+        merged.seek(0)
+        runs = [merged] + runs[MERGE_FANIN:]
+    return heapq.merge(*map(_read_run, runs), key=key)
+
+
+def sort_vcf_lines(lines: Iterable[str], max_memory: int = SORT_MEMORY, directory: Optional[str] = None,
+                   order: Optional[Header] = None) -> Iterator[str]:
+    # Header lines first, then the records sorted by contig and position, in sorted runs on disk if they do not fit.
+    # Contigs are sorted in the order of the header of the lines, or in the one of order when it is given.
+    header: List[str] = []
+    records: List[str] = []
+    runs: List[IO[str]] = []
+    key: Optional[LineKey] = None
+    size = 0
+    try:
+        for line in lines:
+            if line.startswith('#'):
+                header.append(line)
+                continue
+            if key is None:
+                key = line_key(order if order is not None else Header(header))
+            records.append(line)
+            size += len(line) + LINE_OVERHEAD
+            if size >= max_memory:
+                runs.append(_spill(records, key, directory))
+                records, size = [], 0
+        yield from header
+        if key is None:
+            return
+        if not runs:
+            records.sort(key=key)
+            yield from records
+            return
+        if records:
+            runs.append(_spill(records, key, directory))
+        del records
+        yield from _merge_runs(runs, key, directory)
+    finally:
+        for run in runs:
+            run.close()
@@ -0,0 +1,173 @@
+import re
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:  # pragma: no cover
+    from varcomb.core import VCFrow
+
+INFO_TYPES: Dict[str, Callable[[str], Any]] = {'Integer': int, 'Float': float, 'Flag': bool}
+META_FIELD = re.compile(r'(\w+)=("(?:[^"\\]|\\.)*"|[^,>]*)')
+# Meta lines that define an ID, and are merged by that ID
+STRUCTURED = ('INFO', 'FORMAT', 'FILTER', 'ALT', 'contig')
+
+ANNOTATION_INFO = '##INFO=<ID=Annotation,Number=1,Type=String,Description="Input annotation added by varcomb">'
+
+
+def parse_meta_line(line: str) -> Dict[str, str]:
+    # The key=value pairs of a structured meta line, e.g. ##INFO=<ID=DP,Number=1,Type=Integer,...>
+    body = line[line.index('<') + 1:line.rindex('>')]
+    return {key: value for key, value in META_FIELD.findall(body)}
+
+
+def _missing(cast: Callable[[str], Any]) -> Callable[[str], Any]:
+    return lambda value: None if value == '.' else cast(value)
+
+
+def _listed(cast: Callable[[str], Any]) -> Callable[[str], Any]:
+    return lambda value: [cast(x) for x in value.split(',')]
+
+
+def info_types(header: Iterable[str]) -> Dict[str, Callable[[str], Any]]:
+    # Casts for the INFO values declared with a numeric type in the ##INFO lines
+    types = {}
+    for line in header:
+        if not line.startswith('##INFO=<'):
+            continue
+        meta = parse_meta_line(line)
+        if 'ID' not in meta or meta.get('Type') not in INFO_TYPES or meta['Type'] == 'Flag':
+            continue
+        cast = _missing(INFO_TYPES[meta['Type']])
+        types[meta['ID']] = cast if meta.get('Number') in ('0', '1') else _listed(cast)
+    return types
+
+
+def _structured(line: str) -> Optional[Tuple[str, str]]:
+    if not line.startswith('##') or '=<' not in line:
+        return None
+    kind = line[2:line.index('=<')]
+    if kind not in STRUCTURED:
+        return None
+    return kind, parse_meta_line(line).get('ID', '')
+
+
+# Bits of the integer sort keys taken by the position, see sort_rows
+POS_BITS = 32
+
+
+@lru_cache(maxsize=None)
+def chrom_key(chrom: str) -> Tuple[int, Union[int, str]]:
+    # Numbered chromosomes first, then the rest by name. Cached, as there are only a handful of contigs
+    name = chrom[3:] if chrom.lower().startswith('chr') else chrom
+    try:
+        return 0, int(name)
+    except ValueError:
+        return 1, name.upper()
+
+
+class Header:
+    __slots__ = 'lines', 'definitions', 'contigs', 'contig_rank', '_keys'
+
+    def __init__(self, lines: Iterable[str] = ()):
+        self.lines: List[str] = list(lines)
+        self.definitions: Dict[str, Dict[str, str]] = {kind: {} for kind in STRUCTURED}
+        for line in self.lines:
+            structured = _structured(line)
+            if structured is not None:
+                self.definitions[structured[0]].setdefault(structured[1], line)
+        self.contigs: List[str] = list(self.definitions['contig'])
+        self.contig_rank: Dict[str, int] = {contig: rank for rank, contig in enumerate(self.contigs)}
+        self._keys: Dict[str, tuple] = {}
+
+    @classmethod
+    def from_lines(cls, lines: Union[None, str, Iterable[str], 'Header']) -> Optional['Header']:
+        if lines is None or isinstance(lines, Header):
+            return lines
+        if isinstance(lines, str):
+            return cls([lines])
+        return cls(lines)
+
+    @classmethod
+    def merge(cls, *headers: Union[None, Iterable[str], 'Header']) -> Optional['Header']:
+        merged: Optional[Header] = None
+        for header in headers:
+            header = cls.from_lines(header)
+            if header is None:
+                continue
+            if merged is None:
+                merged = header
+                continue
+            for kind in STRUCTURED:
+                for id_, line in header.definitions[kind].items():
+                    if id_ not in merged.definitions[kind]:
+                        merged = merged.add(line)
+        return merged
+
+    def add(self, line: str) -> 'Header':
+        structured = _structured(line)
+        if structured is not None and structured[1] in self.definitions[structured[0]]:
+            return self
+        # Next to the lines of the same kind, or else at the end of the meta lines
+        prefix = f'##{structured[0]}=<' if structured is not None else None
+        meta_end, kind_end = 0, None
+        for i, existing in enumerate(self.lines):
+            if existing.startswith('##'):
+                meta_end = i + 1
+                if prefix is not None and existing.startswith(prefix):
+                    kind_end = i + 1
+        lines = list(self.lines)
+        lines.insert(kind_end if kind_end is not None else meta_end, line)
+        return Header(lines)
+
+    def add_info(self, id_: str, number: str, type_: str, description: str) -> 'Header':
+        return self.add(f'##INFO=<ID={id_},Number={number},Type={type_},Description="{description}">')
+
+    @property
+    def info_types(self) -> Dict[str, Callable[[str], Any]]:
+        return info_types(self.definitions['INFO'].values())
+
+    @property
+    def samples(self) -> List[str]:
+        for line in self.lines:
+            if line.startswith('#CHROM'):
+                return line.split('\t')[9:]
+        return []
+
+    def contig_key(self, chrom: str) -> tuple:
+        # Contigs declared in the header sort in their declared order, before any that are not declared
+        key = self._keys.get(chrom)
+        if key is None:
+            rank = self.contig_rank.get(chrom)
+            key = self._keys[chrom] = (rank, ()) if rank is not None else (len(self.contigs), chrom_key(chrom))
+        return key
+
+    def location_key(self, loc) -> tuple:
+        return self.contig_key(loc.chrom), loc.pos
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.lines)
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, x):
+        return self.lines[x]
+
+    def __eq__(self, other):
+        if isinstance(other, Header):
+            return self.lines == other.lines
+        if isinstance(other, list):
+            return self.lines == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f'Header({self.lines!r})'
+
+
+def sort_rows(rows: Iterable['VCFrow'], header: Optional[Header] = None) -> List['VCFrow']:
+    # Sort on one integer per row, the rank of its contig shifted above the position
+    rows = list(rows)
+    contig_key = header.contig_key if header is not None else chrom_key
+    chroms = sorted({row.loc.chrom for row in rows}, key=contig_key)
+    ranks = {chrom: rank << POS_BITS for rank, chrom in enumerate(chroms)}
+    rows.sort(key=lambda row: ranks[row.loc.chrom] | row.loc.pos)
+    return rows
@@ -0,0 +1,50 @@
+from bisect import bisect_left, bisect_right
+from typing import TYPE_CHECKING, Dict, Hashable, Iterable, List, Sequence, Tuple
+
+if TYPE_CHECKING:  # pragma: no cover
+    from varcomb.core import VCFrow
+
+
+class PositionIndex:
+    __slots__ = 'size', '_chroms'
+
+    def __init__(self, rows: Sequence['VCFrow']):
+        self._build([row.loc.chrom for row in rows], [row.loc.pos for row in rows])
+
+    @classmethod
+    def from_columns(cls, chroms: Iterable[Hashable], positions: Sequence[int]) -> 'PositionIndex':
+        # Rows given as a column of chromosomes, or of any other key of a chromosome, and one of positions
+        index = cls.__new__(cls)
+        index._build(chroms, positions)
+        return index
+
+    def _build(self, chroms: Iterable[Hashable], positions: Sequence[int]):
+        by_chrom: Dict[Hashable, List[int]] = {}
+        for i, chrom in enumerate(chroms):
+            by_chrom.setdefault(chrom, []).append(i)
+        # Per chromosome: row indexes in input order, and sorted positions with their row indexes
+        self._chroms: Dict[Hashable, Tuple[List[int], List[int], List[int]]] = {}
+        for chrom, indexes in by_chrom.items():
+            order = sorted(indexes, key=positions.__getitem__)
+            self._chroms[chrom] = (indexes, [positions[i] for i in order], order)
+        self.size = len(positions)
+
+    def chrom(self, chrom: Hashable) -> List[int]:
+        if chrom not in self._chroms:
+            return []
+        return self._chroms[chrom][0]
+
+    def _slice(self, chrom: Hashable, lo: int, hi: int) -> List[int]:
+        return sorted(self._chroms[chrom][2][lo:hi])
+
+    def range(self, chrom: Hashable, start: int, end: int) -> List[int]:
+        if chrom not in self._chroms:
+            return []
+        positions = self._chroms[chrom][1]
+        return self._slice(chrom, bisect_left(positions, start), bisect_right(positions, end))
+
+    def window(self, chrom: Hashable, pos: int, tol: int) -> List[int]:
+        if chrom not in self._chroms:
+            return []
+        positions = self._chroms[chrom][1]
+        return self._slice(chrom, bisect_right(positions, pos - tol), bisect_left(positions, pos + tol))
@@ -0,0 +1,113 @@
+import heapq
+from contextlib import ExitStack
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from varcomb.core import VCF, Location, VCFrow
+from varcomb.header import Header, sort_rows
+from varcomb.merge import merge_order, open_sorted
+from varcomb.writer import VCFWriter
+
+Call = Tuple[int, VCFrow]
+
+KINDS = ('matched', 'discordant', 'specific')
+MATCH_INFO = '##INFO=<ID=MatchId,Number=1,Type=Integer,Description="Calls of the same variant share a match id">'
+
+
+@dataclass
+class Match:
+    kind: str
+    calls: List[Call]
+
+    @property
+    def callers(self) -> List[int]:
+        return sorted({caller for caller, _ in self.calls})
+
+
+def _tag(rows: Iterable[VCFrow], caller: int) -> Iterator[Call]:
+    for row in rows:
+        yield caller, row
+
+
+def _chains(calls: Iterable[Call], tol: int) -> Iterator[List[Call]]:
+    # Calls are sorted by location; a chain breaks when the gap to the previous call exceeds tol
+    chain: List[Call] = []
+    for call in calls:
+        if chain:
+            last = chain[-1][1].loc
+            if call[1].loc.chrom != last.chrom or call[1].loc.pos - last.pos > tol:
+                yield chain
+                chain = []
+        chain.append(call)
+    if chain:
+        yield chain
+
+
+def _classify(cluster: List[Call], tol: int) -> List[Match]:
+    if len({caller for caller, _ in cluster}) == 1:
+        return [Match('specific', [call]) for call in cluster]
+    alleles: Dict[Tuple[str, str], List[Call]] = {}
+    for call in cluster:
+        row = call[1]
+        alleles.setdefault((row.ref.upper(), row.alt.upper()), []).append(call)
+    matches = []
+    unmatched: List[Call] = []
+    for calls in alleles.values():
+        for chain in _chains(calls, tol):
+            if len({caller for caller, _ in chain}) > 1:
+                matches.append(Match('matched', chain))
+            else:
+                unmatched.extend(chain)
+    if len({caller for caller, _ in unmatched}) > 1:
+        matches.append(Match('discordant', sorted(unmatched, key=lambda call: call[1].loc)))
+    else:
+        matches.extend(Match('specific', [call]) for call in unmatched)
+    return matches
+
+
+def _match_clusters(streams: Sequence[Iterable[VCFrow]], tol: int,
+                    order: Optional[Callable[[Location], Any]] = None) -> Iterator[List[Match]]:
+    call_key = (lambda call: call[1].loc) if order is None else (lambda call: order(call[1].loc))
+    calls = heapq.merge(*[_tag(rows, caller) for caller, rows in enumerate(streams)], key=call_key)
+    for cluster in _chains(calls, tol):
+        yield _classify(cluster, tol)
+
+
+def sweep_match(streams: Sequence[Iterable[VCFrow]], tol: int = 50,
+                order: Optional[Callable[[Location], Any]] = None) -> Iterator[Match]:
+    for matches in _match_clusters(streams, tol, order):
+        yield from matches
+
+
+def match_vcfs(vcfs: Sequence[VCF], tol: int = 50) -> Dict[str, List[Match]]:
+    result: Dict[str, List[Match]] = {kind: [] for kind in KINDS}
+    header = Header.merge(*(vcf.header for vcf in vcfs))
+    for match in sweep_match([sort_rows(vcf.rows, header) for vcf in vcfs], tol=tol, order=merge_order(header)):
+        result[match.kind].append(match)
+    return result
+
+
+def match_vcf_files(fnames: Sequence[str], prefix: str, annotations: Optional[Sequence[Optional[str]]] = None,
+                    tol: int = 50) -> Dict[str, int]:
+    if annotations is None:
+        annotations = [None] * len(fnames)
+    inputs, header = open_sorted(fnames, [annotation if annotation is not None else fname
+                                          for fname, annotation in zip(fnames, annotations)])
+    order = merge_order(header)
+    counts = {kind: 0 for kind in KINDS}
+    if header is not None:
+        header = header.add(MATCH_INFO)
+    with ExitStack() as stack:
+        writers = {kind: stack.enter_context(VCFWriter(f'{prefix}.{kind}.vcf', header=header)) for kind in KINDS}
+        n = 0
+        for matches in _match_clusters(inputs, tol, order):
+            rows: Dict[str, List[VCFrow]] = {kind: [] for kind in KINDS}
+            for match in matches:
+                n += 1
+                counts[match.kind] += 1
+                for _, row in match.calls:
+                    row.info['MatchId'] = n
+                    rows[match.kind].append(row)
+            for kind in KINDS:
+                writers[kind].write_rows(sort_rows(rows[kind], header))
+    return counts
@@ -0,0 +1,285 @@
+import heapq
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from operator import attrgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from varcomb.cache import VCFCache
+from varcomb.core import Location, VCFrow
+from varcomb.dedup import deduplicate, deduplicate_sorted
+from varcomb.exceptions import VCFNotSortedError
+from varcomb.extsort import sort_vcf_lines
+from varcomb.header import ANNOTATION_INFO, Header, chrom_key
+from varcomb.parsers import VCFReader, parse_vcf_file
+from varcomb.prefetch import prefetch
+from varcomb.stats import Stats, file_size
+from varcomb.tabix import TabixIndex
+from varcomb.utilities import MAX_POS, Region, load_index, merge_regions, read_vcf, read_vcf_header, read_vcf_regions
+from varcomb.writer import VCFWriter, write_vcf
+
+# Number of buffered lines after which the partitions are flushed to disk
+PARTITION_BUFFER = 100_000
+
+# Where a worker reads one chromosome of one input from: a file, and the regions to fetch from its index
+Source = Tuple[str, Optional[List[Region]]]
+
+
+def _read(fname: str, regions: Optional[List[Region]] = None) -> Iterator[str]:
+    if regions is None:
+        return read_vcf(fname)
+    return read_vcf_regions(fname, regions)
+
+
+def merged_header(headers: Iterable[Optional[List[str]]], annotations: Sequence[Optional[str]]) -> Optional[Header]:
+    header = Header.merge(*headers)
+    if header is not None and any(annotation is not None for annotation in annotations):
+        header = header.add(ANNOTATION_INFO)
+    return header
+
+
+class _SortedInput:
+    __slots__ = 'fname', 'annotation', 'order', 'n', '_reader'
+
+    def __init__(self, fname: str, annotation: Optional[str] = None, regions: Optional[List[Region]] = None,
+                 sort_memory: Optional[int] = None, pipelined: bool = False, sort_order: Optional[Header] = None):
+        self.fname = fname
+        self.annotation = annotation
+        # Sort key of a location, by default the order of Location itself
+        self.order: Optional[Callable[[Location], Any]] = None
+        self.n = 0
+        lines = _read(fname, regions)
+        if pipelined:
+            # Decompress in a background thread while the merge parses the lines read so far
+            lines = prefetch(lines)
+        if sort_memory is not None:
+            # Unsorted inputs are sorted on disk first, holding at most sort_memory bytes of records each.
+            # They are merged in the contig order of the merged header, so they have to be sorted in that order too.
+            lines = sort_vcf_lines(lines, sort_memory, order=sort_order)
+        self._reader = VCFReader(lines)
+
+    @property
+    def header(self) -> List[str]:
+        return self._reader.header
+
+    def __iter__(self) -> Iterator[VCFrow]:
+        order = self.order
+        previous, previous_key = None, None
+        for row in self._reader:
+            key = row.loc if order is None else order(row.loc)
+            if previous is not None and key < previous_key:
+                raise VCFNotSortedError(f'{self.fname} is not sorted: {row.loc} comes after {previous}')
+            previous, previous_key = row.loc, key
+            if self.annotation is not None:
+                row.info['Annotation'] = self.annotation
+            self.n += 1
+            yield row
+
+
+def merge_order(header: Optional[Header]) -> Optional[Callable[[Location], Any]]:
+    # Inputs with ##contig lines are sorted in the declared contig order
+    return header.location_key if header is not None and header.contigs else None
+
+
+def open_sorted(fnames: Sequence[str], annotations: Optional[Sequence[Optional[str]]] = None,
+                regions: Optional[List[Region]] = None, sort_memory: Optional[int] = None,
+                pipelined: bool = False) -> Tuple[List[_SortedInput], Optional[Header]]:
+    # Opens coordinate-sorted inputs that are read in the contig order of their merged header
+    if annotations is None:
+        annotations = [None] * len(fnames)
+    # The headers of inputs that are sorted on disk are read up front, so they are all sorted in the merged order
+    sort_order = Header.merge(*map(read_vcf_header, fnames)) if sort_memory is not None else None
+    if sort_memory is not None:
+        # Every input is sorted before the merge starts, and keeps its records in memory if they fit its budget,
+        # so the budget is shared by the inputs
+        sort_memory = max(sort_memory // max(len(fnames), 1), 1)
+    inputs = [_SortedInput(fname, annotation, regions, sort_memory, pipelined, sort_order)
+              for fname, annotation in zip(fnames, annotations)]
+    header = merged_header((vcf.header for vcf in inputs), annotations)
+    order = merge_order(header)
+    for vcf in inputs:
+        vcf.order = order
+    return inputs, header
+
+
+def merge_sorted(*streams: Iterable[VCFrow], key: str = 'row', keep: str = 'first',
+                 order: Optional[Callable[[Location], Any]] = None) -> Iterator[VCFrow]:
+    merge_key = attrgetter('loc') if order is None else (lambda row: order(row.loc))
+    return deduplicate_sorted(heapq.merge(*streams, key=merge_key), key=key, keep=keep)
+
+
+def merge_vcf_files(fnames: Sequence[str], fname_out: str,
+                    annotations: Optional[Sequence[Optional[str]]] = None,
+                    key: str = 'row', keep: str = 'first', index: Optional[str] = None,
+                    regions: Optional[List[Region]] = None, sort_memory: Optional[int] = None,
+                    pipelined: bool = False) -> Tuple[int, int]:
+    inputs, header = open_sorted(fnames, annotations, regions, sort_memory, pipelined)
+    with VCFWriter(fname_out, header=header, index=index, background=pipelined) as writer:
+        n_out = writer.write_rows(merge_sorted(*inputs, key=key, keep=keep, order=merge_order(header)))
+    return sum(vcf.n for vcf in inputs), n_out
+
+
+def _partition(lines: Iterable[str], directory: str) -> Tuple[List[str], Dict[str, Source]]:
+    header: List[str] = []
+    paths: Dict[str, str] = {}
+    buffers: Dict[str, List[str]] = {}
+    n = 0
+
+    def flush():
+        for chrom, lines in buffers.items():
+            if lines:
+                with open(paths[chrom], 'a') as f:
+                    f.write('\n'.join(lines) + '\n')
+                lines.clear()
+
+    for line in lines:
+        if line.startswith('#'):
+            header.append(line)
+            continue
+        chrom = line[:line.index('\t')]
+        if chrom not in paths:
+            paths[chrom] = os.path.join(directory, f'{len(paths)}.vcf')
+            buffers[chrom] = []
+        buffers[chrom].append(line)
+        n += 1
+        if n % PARTITION_BUFFER == 0:
+            flush()
+    flush()
+    return header, {chrom: (path, None) for chrom, path in paths.items()}
+
+
+def _partition_indexed(fname: str, index: TabixIndex, regions: Optional[List[Region]]) -> Tuple[List[str], Dict[str, Source]]:
+    # Indexed inputs are not split up front; the workers read their chromosome straight from the index
+    if regions is None:
+        regions = [(chrom, 1, MAX_POS) for chrom in index.names]
+    sources: Dict[str, Source] = {}
+    for region in regions:
+        if region[0] in index.names:
+            sources.setdefault(region[0], (fname, []))[1].append(region)
+    return read_vcf_header(fname), sources
+
+
+def _merge_partition(sources: Sequence[Optional[Source]], annotations: Sequence[Optional[str]], fname_out: str,
+                     key: str, keep: str) -> Tuple[int, int]:
+    rows: List[VCFrow] = []
+    for source, annotation in zip(sources, annotations):
+        if source is None:
+            continue
+        vcf = parse_vcf_file(_read(*source))
+        if annotation is not None:
+            vcf = vcf.annotate(annotation)
+        rows.extend(vcf.rows)
+    with VCFWriter(fname_out) as writer:
+        return len(rows), writer.write_rows(deduplicate(rows, key=key, keep=keep))
+
+
+def merge_vcf_files_parallel(fnames: Sequence[str], fname_out: str,
+                             annotations: Optional[Sequence[Optional[str]]] = None,
+                             key: str = 'row', keep: str = 'first', processes: int = 2,
+                             index: Optional[str] = None, regions: Optional[List[Region]] = None) -> Tuple[int, int]:
+    if annotations is None:
+        annotations = [None] * len(fnames)
+    if regions is not None:
+        regions = merge_regions(regions)
+    with tempfile.TemporaryDirectory(prefix='varcomb') as directory:
+        headers, partitions = [], []
+        for i, fname in enumerate(fnames):
+            tabix = load_index(fname)
+            if tabix is not None:
+                header, sources = _partition_indexed(fname, tabix, regions)
+            else:
+                os.mkdir(os.path.join(directory, str(i)))
+                header, sources = _partition(_read(fname, regions), os.path.join(directory, str(i)))
+            headers.append(header)
+            partitions.append(sources)
+        header = merged_header(headers, annotations)
+        chroms = sorted({chrom for sources in partitions for chrom in sources},
+                        key=header.contig_key if header is not None else chrom_key)
+        outputs = [os.path.join(directory, f'{chrom_index}.out.vcf') for chrom_index in range(len(chroms))]
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            futures = [executor.submit(_merge_partition, [sources.get(chrom) for sources in partitions], annotations,
+                                       output, key, keep)
+                       for chrom, output in zip(chroms, outputs)]
+            counts = [future.result() for future in futures]
+        write_vcf(fname_out, header, (line for output in outputs for line in read_vcf(output)), index=index)
+    return sum(n_in for n_in, _ in counts), sum(n_out for _, n_out in counts)
+
+
+def run_merge(fnames: Sequence[str], fname_out: str, annotations: Optional[Sequence[Optional[str]]] = None,
+              key: str = 'row', keep: str = 'first', index: Optional[str] = None, regions: Optional[List[Region]] = None,
+              streaming: bool = False, sort_memory: Optional[int] = None, pipelined: bool = False, processes: int = 1,
+              cache: Optional[VCFCache] = None, stats: Optional[Stats] = None) -> Tuple[int, int]:
+    # What merge-vcfs runs: in worker processes, streaming, or in memory. Returns the records read and written
+    if annotations is None:
+        annotations = [None] * len(fnames)
+    if stats is None:
+        stats = Stats()
+    if processes > 1:
+        logging.info(f'Merging VCFs per chromosome with {processes} processes: {", ".join(fnames)}')
+        with stats.stage('merge_parallel') as stage:
+            n1, n2 = merge_vcf_files_parallel(fnames, fname_out, annotations, key=key, keep=keep,
+                                              processes=processes, index=index, regions=regions)
+            stage.records, stage.bytes = n1, sum(map(file_size, fnames))
+        logging.info(f'{n1-n2} duplicates removed')
+        return n1, n2
+    if streaming or sort_memory is not None:
+        logging.info(f'Merging VCFs (streaming): {", ".join(fnames)}')
+        # Reading, merging and writing are interleaved, so they are measured as one stage
+        with stats.stage('merge_streaming') as stage:
+            n1, n2 = merge_vcf_files(fnames, fname_out, annotations, key=key, keep=keep, index=index,
+                                     regions=regions, sort_memory=sort_memory, pipelined=pipelined)
+            stage.records, stage.bytes = n1, sum(map(file_size, fnames))
+        logging.info(f'{n1-n2} duplicates removed')
+        return n1, n2
+
+    streams: List[Optional[Iterable[str]]] = [None] * len(fnames)
+    if cache is None:
+        streams = [_read(fname, regions) for fname in fnames]
+        if pipelined:
+            # The next inputs are decompressed while the current one is parsed
+            streams = [prefetch(stream) for stream in streams]
+    vcfs: list = []
+    n1 = 0
+    for fname, annotation, stream in zip(fnames, annotations, streams):
+        logging.info(f'Reading file: {fname}')
+        with stats.stage(f'read {fname}') as stage:
+            vcf = parse_vcf_file(stream) if cache is None else cache.get(fname)
+            stage.records, stage.bytes = len(vcf), file_size(fname)
+        n1 += len(vcf)
+        vcfs.append(vcf)
+
+    logging.info('Merging VCFs...')
+    if cache is None:
+        # Annotation and concatenation are only recorded, and run in the deduplication pass, which sorts the
+        # rows once. They are measured as the one stage they run in.
+        queries = [vcf.lazy() if annotation is None else vcf.lazy().annotate(annotation)
+                   for vcf, annotation in zip(vcfs, annotations)]
+        query = queries[0].concat(*queries[1:])
+        name = 'merge+deduplicate' if all(annotation is None for annotation in annotations) else 'annotate+merge+deduplicate'
+        with stats.stage(name) as stage:
+            vcf = query.deduplicate(key=key, keep=keep).collect()
+            n2 = len(vcf)
+            stage.records = n1
+    else:
+        # Inputs from the cache are ColumnarVCF, which annotates, merges and deduplicates right away
+        for i, (fname, annotation) in enumerate(zip(fnames, annotations)):
+            if annotation is not None:
+                with stats.stage(f'annotate {fname}') as stage:
+                    vcfs[i] = vcfs[i].annotate(annotation)
+                    stage.records = len(vcfs[i])
+        with stats.stage('merge') as stage:
+            vcf = vcfs[0]
+            for other in vcfs[1:]:
+                vcf = vcf + other
+            stage.records = n1
+        with stats.stage('deduplicate') as stage:
+            vcf = vcf.deduplicate(key=key, keep=keep)
+            n2 = len(vcf)
+            stage.records = n1
+    logging.info(f'{n1-n2} duplicates removed')
+    with stats.stage('write') as stage:
+        vcf.to_file(fname_out, index=index, background=pipelined)
+        stage.records = n2
+    stage.bytes = file_size(fname_out)
+    return n1, n2
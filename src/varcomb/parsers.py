@@ -1,16 +1,47 @@
-from typing import List
+from sys import intern
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
 
 from varcomb.core import VCF, Info, Location, VCFrow
+from varcomb.header import Header, info_types
 
 
-def _parse_vcf_line(line: str) -> VCFrow:
-    elements = line.split('\t')
-    loc = Location(chrom=elements[0], pos=int(elements[1]))
+def _parse_vcf_line(line: str, types: Optional[Dict[str, Callable[[str], Any]]] = None) -> VCFrow:
+    # The sample columns stay one string. CHROM, FILTER and FORMAT take few distinct values, so every row
+    # shares one copy of them (single characters like "." are shared by Python already)
+    elements = line.split('\t', 9)
+    loc = Location(chrom=intern(elements[0]), pos=int(elements[1]))
     return VCFrow(loc=loc, id=elements[2], ref=elements[3], alt=elements[4],
-                  qual=elements[5], filter=elements[6], info=Info(elements[7]),
-                  format=elements[8], samples=elements[9:])
+                  qual=elements[5], filter=intern(elements[6]), info=Info(elements[7], types),
+                  format=intern(elements[8]), samples=elements[9] if len(elements) > 9 else '')
 
 
-def parse_vcf_file(stream: List[str]) -> VCF:
-    return VCF(rows=[_parse_vcf_line(row) for row in stream if not row.startswith('#')],
-               header=[row for row in stream if row.startswith('#')])
+class VCFReader:
+    __slots__ = 'header', 'types', '_lines', '_first'
+
+    def __init__(self, stream: Iterable[str]):
+        self.header: List[str] = []
+        self._lines = iter(stream)
+        self._first: Optional[str] = None
+        for line in self._lines:
+            if not line.startswith('#'):
+                self._first = line
+                break
+            self.header.append(line)
+        # Shared by the INFO fields of all rows
+        self.types = info_types(self.header) or None
+
+    def __iter__(self) -> Iterator[VCFrow]:
+        types = self.types
+        if self._first is not None:
+            line, self._first = self._first, None
+            yield _parse_vcf_line(line, types)
+        for line in self._lines:
+            if line.startswith('#'):
+                self.header.append(line)
+                continue
+            yield _parse_vcf_line(line, types)
+
+
+def parse_vcf_file(stream: Iterable[str]) -> VCF:
+    reader = VCFReader(stream)
+    return VCF(rows=list(reader), header=Header(reader.header))
@@ -0,0 +1,101 @@
+import queue
+import threading
+from itertools import islice
+from typing import Any, Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+
+# Batches held in a queue between two stages, and items per batch
+QUEUE_SIZE = 16
+BATCH_SIZE = 1024
+
+_DONE = object()
+
+
+class _Failure:
+    __slots__ = 'error'
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def _put(q: queue.Queue, item: Any, stop: threading.Event) -> bool:
+    # Block while the queue is full, unless the consumer has gone away
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _produce(iterable: Iterable[T], q: queue.Queue, stop: threading.Event, batch: int):
+    try:
+        items = iter(iterable)
+        while True:
+            chunk = list(islice(items, batch))
+            if not chunk:
+                break
+            if not _put(q, chunk, stop):
+                return
+        _put(q, _DONE, stop)
+    except BaseException as e:
+        _put(q, _Failure(e), stop)
+
+
+def _consume(q: queue.Queue, stop: threading.Event) -> Iterator[T]:
+    try:
+        while True:
+            chunk = q.get()
+            if chunk is _DONE:
+                return
+            if isinstance(chunk, _Failure):
+                raise chunk.error
+            yield from chunk
+    finally:
+        stop.set()
+
+
+def prefetch(iterable: Iterable[T], size: int = QUEUE_SIZE, batch: int = BATCH_SIZE) -> Iterator[T]:
+    # Iterate in a background thread, e.g. decompressing a file, while the caller works on earlier items.
+    # The thread starts right away, and stops once the returned iterator is exhausted or closed.
+    q: queue.Queue = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    threading.Thread(target=_produce, args=(iterable, q, stop, batch), daemon=True).start()
+    return _consume(q, stop)
+
+
+class BackgroundHandle:
+    __slots__ = '_handle', '_queue', '_thread', '_errors'
+
+    def __init__(self, handle, size: int = QUEUE_SIZE):
+        # Writes to a file handle, e.g. compressing BGZF blocks, in a background thread
+        self._handle = handle
+        self._queue: queue.Queue = queue.Queue(maxsize=size)
+        self._errors: List[BaseException] = []
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            data = self._queue.get()
+            if data is _DONE:
+                return
+            if not self._errors:
+                try:
+                    self._handle.write(data)
+                except BaseException as e:
+                    self._errors.append(e)
+
+    def write(self, data):
+        if self._errors:
+            raise self._errors[0]
+        self._queue.put(data)
+
+    def close(self):
+        self._queue.put(_DONE)
+        self._thread.join()
+        self._handle.close()
+        if self._errors:
+            raise self._errors[0]
@@ -0,0 +1,111 @@
+import heapq
+from itertools import chain
+from operator import attrgetter
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from varcomb.core import VCF, VCFrow
+from varcomb.dedup import STREAMING_KEYS, deduplicate, deduplicate_sorted
+from varcomb.header import ANNOTATION_INFO, Header, sort_rows
+from varcomb.writer import VCFWriter
+
+# A row-wise step returns the row, or None to drop it
+Step = Callable[[VCFrow], Optional[VCFrow]]
+
+
+def _apply(rows: Iterable[VCFrow], steps: Tuple[Step, ...]) -> Iterator[VCFrow]:
+    for row in rows:
+        for step in steps:
+            row = step(row)
+            if row is None:
+                break
+        else:
+            yield row
+
+
+class Query:
+    # A recorded pipeline of VCF transformations, run when it is iterated, collected or written.
+    # Row-wise steps (annotate, filter, region) are applied together in one pass over the rows, and only
+    # sort and deduplicate need all rows at once. A sort of rows that are known to be sorted is dropped,
+    # and concatenated sorted inputs are merged instead of sorted again.
+    __slots__ = 'header', 'is_sorted', '_source', '_steps', '_parts'
+
+    def __init__(self, source: Callable[[], Iterable[VCFrow]], header: Optional[Header] = None, is_sorted: bool = False,
+                 steps: Tuple[Step, ...] = (), parts: Optional[List['Query']] = None):
+        self.header = header
+        self.is_sorted = is_sorted
+        self._source = source
+        self._steps = steps
+        # The inputs of a concatenation, when all of them are sorted
+        self._parts = parts
+
+    @classmethod
+    def from_rows(cls, rows: Sequence[VCFrow], header=None, is_sorted: bool = False) -> 'Query':
+        return cls(lambda: rows, Header.from_lines(header), is_sorted)
+
+    def _step(self, step: Step, header: Optional[Header] = None) -> 'Query':
+        return Query(self._source, header if header is not None else self.header, self.is_sorted,
+                     self._steps + (step,), self._parts)
+
+    def __iter__(self) -> Iterator[VCFrow]:
+        rows = self._source()
+        if not self._steps:
+            return iter(rows)
+        return _apply(rows, self._steps)
+
+    def _order(self) -> Callable[[VCFrow], Any]:
+        if self.header is not None and self.header.contigs:
+            location_key = self.header.location_key
+            return lambda row: location_key(row.loc)
+        return attrgetter('loc')
+
+    def _merged(self) -> Iterator[VCFrow]:
+        # The sorted parts of a concatenation, merged into one sorted stream
+        assert self._parts is not None
+        rows = heapq.merge(*self._parts, key=self._order())
+        return _apply(rows, self._steps) if self._steps else rows
+
+    def annotate(self, value: str) -> 'Query':
+        # Rows are annotated in place, as VCF.annotate does
+        def annotate(row: VCFrow) -> VCFrow:
+            row.info['Annotation'] = value
+            return row
+        return self._step(annotate, self.header.add(ANNOTATION_INFO) if self.header is not None else None)
+
+    def filter(self, predicate: Callable[[VCFrow], bool]) -> 'Query':
+        return self._step(lambda row: row if predicate(row) else None)
+
+    def region(self, chrom: str, start: int = 1, end: Optional[int] = None) -> 'Query':
+        def region(row: VCFrow) -> Optional[VCFrow]:
+            loc = row.loc
+            if loc.chrom != chrom or loc.pos < start or (end is not None and loc.pos > end):
+                return None
+            return row
+        return self._step(region)
+
+    def concat(self, *others: 'Query') -> 'Query':
+        queries = (self,) + others
+        header = Header.merge(*(query.header for query in queries))
+        parts = list(queries) if all(query.is_sorted for query in queries) else None
+        return Query(lambda: chain.from_iterable(queries), header, parts=parts)
+
+    def sort(self) -> 'Query':
+        if self.is_sorted:
+            return self
+        if self._parts is not None:
+            return Query(self._merged, self.header, is_sorted=True)
+        return Query(lambda: sort_rows(self, self.header), self.header, is_sorted=True)
+
+    def deduplicate(self, key: str = 'row', keep: str = 'first') -> 'Query':
+        # Sorted rows are deduplicated on the fly, one position at a time
+        if key in STREAMING_KEYS and self.is_sorted:
+            return Query(lambda: deduplicate_sorted(self, key=key, keep=keep), self.header, is_sorted=True)
+        if key in STREAMING_KEYS and self._parts is not None:
+            return Query(lambda: deduplicate_sorted(self._merged(), key=key, keep=keep), self.header, is_sorted=True)
+        return Query(lambda: deduplicate(self, key=key, keep=keep, header=self.header), self.header, is_sorted=True)
+
+    def collect(self) -> VCF:
+        return VCF(list(self), header=self.header)
+
+    def to_file(self, fname, index: Optional[str] = None, background: bool = False) -> int:
+        with VCFWriter(fname, header=self.header, index=index, background=background) as writer:
+            return writer.write_rows(self)
@@ -0,0 +1,99 @@
+import json
+import logging
+import os
+import resource
+import sys
+import time
+from contextlib import contextmanager
+from typing import IO, Any, Dict, Iterator, List, Optional
+
+# ru_maxrss is in kilobytes on Linux, and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+
+
+def peak_rss(who: int = resource.RUSAGE_SELF) -> int:
+    return resource.getrusage(who).ru_maxrss * RSS_UNIT
+
+
+def children_cpu_time() -> float:
+    # User and system time of the child processes that have finished and been waited for
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def file_size(fname: str) -> int:
+    try:
+        return os.path.getsize(fname)
+    except OSError:
+        return 0
+
+
+class Stage:
+    __slots__ = 'name', 'records', 'bytes', 'wall', 'cpu', 'cpu_children', 'peak_rss', 'peak_rss_children'
+
+    def __init__(self, name: str):
+        self.name = name
+        # Set by the code running the stage: what it read or wrote
+        self.records = 0
+        self.bytes = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.cpu_children = 0.0
+        self.peak_rss = 0
+        self.peak_rss_children = 0
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'wall': self.wall,
+            'cpu': self.cpu,
+            'cpu_children': self.cpu_children,
+            'peak_rss': self.peak_rss,
+            'peak_rss_children': self.peak_rss_children,
+            'records': self.records,
+            'bytes': self.bytes,
+            'records_per_sec': self.records / self.wall if self.wall else None,
+            'bytes_per_sec': self.bytes / self.wall if self.wall else None,
+        }
+
+
+class Stats:
+    __slots__ = 'command', 'stages', '_start'
+
+    def __init__(self, command: Optional[str] = None):
+        self.command = command
+        self.stages: List[Stage] = []
+        self._start = time.perf_counter(), time.process_time(), children_cpu_time()
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[Stage]:
+        # Wall and CPU time of the stage, and the peak RSS of the process so far when it ends.
+        # CPU time and RSS of worker processes only count once the workers have finished; their CPU time is
+        # included in cpu, and also reported on its own as cpu_children.
+        stage = Stage(name)
+        wall, cpu, cpu_children = time.perf_counter(), time.process_time(), children_cpu_time()
+        try:
+            yield stage
+        finally:
+            stage.wall = time.perf_counter() - wall
+            stage.cpu_children = children_cpu_time() - cpu_children
+            stage.cpu = time.process_time() - cpu + stage.cpu_children
+            stage.peak_rss = peak_rss()
+            stage.peak_rss_children = peak_rss(resource.RUSAGE_CHILDREN)
+            self.stages.append(stage)
+            logging.info(f'{name}: {stage.wall:.2f}s wall, {stage.cpu:.2f}s CPU, {stage.records} records')
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            'command': self.command,
+            'wall': time.perf_counter() - self._start[0],
+            'cpu': time.process_time() - self._start[1] + children_cpu_time() - self._start[2],
+            'cpu_children': children_cpu_time() - self._start[2],
+            'peak_rss': peak_rss(),
+            'peak_rss_children': peak_rss(resource.RUSAGE_CHILDREN),
+            'stages': [stage.to_dict() for stage in self.stages],
+        }
+
+    def dump(self, f: IO[str]):
+        json.dump(self.to_dict(), f, indent=2)
+        f.write('\n')
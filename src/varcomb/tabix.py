@@ -0,0 +1,266 @@
+import gzip
+import struct
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from varcomb.bgzf import BgzfReader, BgzfWriter
+from varcomb.exceptions import VCFNotSortedError
+
+# Tabix header fields for VCF: format, sequence column, begin column, end column, comment character, skipped lines
+TABIX_VCF = (2, 1, 2, 0, ord('#'), 0)
+INDEX_FORMATS = ('tbi', 'csi')
+
+
+def bin_first(level: int) -> int:
+    return ((1 << (3 * level)) - 1) // 7
+
+
+def reg2bin(beg: int, end: int, min_shift: int = 14, depth: int = 5) -> int:
+    end -= 1
+    shift = min_shift
+    for level in range(depth, 0, -1):
+        if beg >> shift == end >> shift:
+            return bin_first(level) + (beg >> shift)
+        shift += 3
+    return 0
+
+
+def reg2bins(beg: int, end: int, min_shift: int = 14, depth: int = 5) -> List[int]:
+    end -= 1
+    bins = []
+    shift = min_shift + 3 * depth
+    for level in range(depth + 1):
+        first = bin_first(level)
+        bins.extend(range(first + (beg >> shift), first + (end >> shift) + 1))
+        shift -= 3
+    return bins
+
+
+def _bin_level(bin_: int, depth: int) -> int:
+    for level in range(depth, -1, -1):
+        if bin_ >= bin_first(level):
+            return level
+    return 0  # pragma: no cover
+
+
+def record_span(line: str) -> Tuple[str, int, int]:
+    # 0-based, half-open interval covered by a VCF record, using INFO/END when present
+    chrom, pos, _, ref, _, _, _, info = line.split('\t', 8)[:8]
+    beg = int(pos) - 1
+    end = beg + len(ref)
+    for field in info.split(';'):
+        if field.startswith('END='):
+            end = int(field[4:])
+            break
+    return chrom, beg, max(end, beg + 1)
+
+
+class _Reference:
+    __slots__ = 'bins', 'linear', 'last_beg'
+
+    def __init__(self):
+        self.bins: Dict[int, List[List[int]]] = {}
+        self.linear: List[Optional[int]] = []
+        self.last_beg = 0
+
+
+class IndexBuilder:
+    __slots__ = 'fmt', 'min_shift', 'depth', 'names', '_refs', '_current'
+
+    def __init__(self, fmt: str = 'tbi', min_shift: int = 14, depth: Optional[int] = None):
+        if fmt not in INDEX_FORMATS:
+            raise ValueError(f'Unknown index format "{fmt}". Choose from: {", ".join(INDEX_FORMATS)}')
+        if fmt == 'tbi' and (min_shift != 14 or depth not in (None, 5)):
+            raise ValueError('Tabix indexes always use min_shift=14 and depth=5')
+        self.fmt = fmt
+        self.min_shift = min_shift
+        # CSI defaults to one more level than tabix, covering positions up to 4Gb
+        self.depth = depth if depth is not None else (5 if fmt == 'tbi' else 6)
+        self.names: List[str] = []
+        self._refs: List[_Reference] = []
+        self._current: Optional[str] = None
+
+    def add(self, chrom: str, beg: int, end: int, start: int, stop: int):
+        if chrom != self._current:
+            if chrom in self.names:
+                raise VCFNotSortedError(f'Can not index unsorted records: {chrom} appears in more than one block')
+            self.names.append(chrom)
+            self._refs.append(_Reference())
+            self._current = chrom
+        ref = self._refs[-1]
+        if beg < ref.last_beg:
+            raise VCFNotSortedError(f'Can not index unsorted records: {chrom}:{beg + 1} comes after {chrom}:{ref.last_beg + 1}')
+        if end > 1 << (self.min_shift + 3 * self.depth):
+            raise ValueError(f'{chrom}:{end} is too large for a {self.fmt} index, use csi')
+        ref.last_beg = beg
+
+        chunks = ref.bins.setdefault(reg2bin(beg, end, self.min_shift, self.depth), [])
+        if chunks and chunks[-1][1] == start:
+            chunks[-1][1] = stop
+        else:
+            chunks.append([start, stop])
+
+        last_window = (end - 1) >> self.min_shift
+        if last_window >= len(ref.linear):
+            ref.linear.extend([None] * (last_window + 1 - len(ref.linear)))
+        for window in range(beg >> self.min_shift, last_window + 1):
+            if ref.linear[window] is None:
+                ref.linear[window] = start
+
+    def add_line(self, line: str, start: int, stop: int):
+        self.add(*record_span(line), start, stop)
+
+    def _linear(self, ref: _Reference) -> List[int]:
+        first = min(chunks[0][0] for chunks in ref.bins.values())
+        linear = []
+        for offset in ref.linear:
+            first = offset if offset is not None else first
+            linear.append(first)
+        return linear
+
+    def _names(self) -> bytes:
+        names = b''.join(name.encode() + b'\0' for name in self.names)
+        return struct.pack(f'<{len(TABIX_VCF)}ii', *TABIX_VCF, len(names)) + names
+
+    def _pack_tbi(self) -> bytes:
+        data = [b'TBI\1', struct.pack('<i', len(self.names)), self._names()]
+        for ref in self._refs:
+            data.append(struct.pack('<i', len(ref.bins)))
+            for bin_, chunks in sorted(ref.bins.items()):
+                data.append(struct.pack('<Ii', bin_, len(chunks)))
+                data.extend(struct.pack('<QQ', *chunk) for chunk in chunks)
+            linear = self._linear(ref)
+            data.append(struct.pack(f'<i{len(linear)}Q', len(linear), *linear))
+        return b''.join(data)
+
+    def _pack_csi(self) -> bytes:
+        aux = self._names()
+        data = [b'CSI\1', struct.pack('<iii', self.min_shift, self.depth, len(aux)), aux, struct.pack('<i', len(self.names))]
+        for ref in self._refs:
+            linear = self._linear(ref)
+            data.append(struct.pack('<i', len(ref.bins)))
+            for bin_, chunks in sorted(ref.bins.items()):
+                # The smallest offset of a record overlapping the first window of the bin
+                level = _bin_level(bin_, self.depth)
+                window = (bin_ - bin_first(level)) << 3 * (self.depth - level)
+                loff = linear[window] if window < len(linear) else 0
+                data.append(struct.pack('<IQi', bin_, loff, len(chunks)))
+                data.extend(struct.pack('<QQ', *chunk) for chunk in chunks)
+        return b''.join(data)
+
+    def write(self, fname: str):
+        with BgzfWriter(fname) as f:
+            f.write(self._pack_tbi() if self.fmt == 'tbi' else self._pack_csi())
+
+
+def _unpack_names(data: bytes, offset: int) -> Tuple[Dict[str, int], int]:
+    offset += 4 * len(TABIX_VCF)
+    l_nm, = struct.unpack_from('<i', data, offset)
+    names = data[offset + 4:offset + 4 + l_nm].split(b'\0')[:-1]
+    return {name.decode(): i for i, name in enumerate(names)}, offset + 4 + l_nm
+
+
+class TabixIndex:
+    __slots__ = 'fmt', 'min_shift', 'depth', 'names', 'bins', 'offsets'
+
+    def __init__(self, fmt: str, min_shift: int, depth: int):
+        self.fmt = fmt
+        self.min_shift = min_shift
+        self.depth = depth
+        self.names: Dict[str, int] = {}
+        self.bins: List[Dict[int, List[Tuple[int, int]]]] = []
+        # tbi: the linear index per reference, csi: the smallest record offset per bin
+        self.offsets: List[Union[List[int], Dict[int, int]]] = []
+
+    @classmethod
+    def load(cls, fname: str, names: Optional[List[str]] = None) -> 'TabixIndex':
+        with gzip.open(fname, 'rb') as f:
+            data = f.read()
+        if data[:4] == b'TBI\1':
+            index = cls('tbi', 14, 5)
+            n_ref, = struct.unpack_from('<i', data, 4)
+            index.names, offset = _unpack_names(data, 8)
+        elif data[:4] == b'CSI\1':
+            min_shift, depth, l_aux = struct.unpack_from('<3i', data, 4)
+            index = cls('csi', min_shift, depth)
+            if l_aux > 0:
+                index.names, _ = _unpack_names(data, 16)
+            elif names is not None:
+                index.names = {name: i for i, name in enumerate(names)}
+            else:
+                raise ValueError(f'{fname} does not contain sequence names')
+            n_ref, = struct.unpack_from('<i', data, 16 + l_aux)
+            offset = 20 + l_aux
+        else:
+            raise ValueError(f'{fname} is not a tabix or CSI index')
+        pseudo_bin = bin_first(index.depth + 1) + 1
+        for _ in range(n_ref):
+            bins: Dict[int, List[Tuple[int, int]]] = {}
+            loffs: Dict[int, int] = {}
+            n_bin, = struct.unpack_from('<i', data, offset)
+            offset += 4
+            for _ in range(n_bin):
+                if index.fmt == 'tbi':
+                    bin_, n_chunk = struct.unpack_from('<Ii', data, offset)
+                    offset += 8
+                else:
+                    bin_, loff, n_chunk = struct.unpack_from('<IQi', data, offset)
+                    offset += 16
+                    loffs[bin_] = loff
+                chunks = struct.unpack_from(f'<{2 * n_chunk}Q', data, offset)
+                offset += 16 * n_chunk
+                if bin_ != pseudo_bin:
+                    bins[bin_] = list(zip(chunks[::2], chunks[1::2]))
+            if index.fmt == 'tbi':
+                n_intv, = struct.unpack_from('<i', data, offset)
+                index.offsets.append(list(struct.unpack_from(f'<{n_intv}Q', data, offset + 4)))
+                offset += 4 + 8 * n_intv
+            else:
+                index.offsets.append(loffs)
+            index.bins.append(bins)
+        return index
+
+    def _min_offset(self, ref: int, beg: int) -> int:
+        offsets = self.offsets[ref]
+        if isinstance(offsets, list):
+            if not offsets:
+                return 0
+            return offsets[min(beg >> self.min_shift, len(offsets) - 1)]
+        bin_ = reg2bin(beg, beg + 1, self.min_shift, self.depth)
+        while bin_ > 0 and bin_ not in offsets:
+            bin_ = (bin_ - 1) >> 3
+        return offsets.get(bin_, 0)
+
+    def chunks(self, chrom: str, beg: int, end: int) -> List[Tuple[int, int]]:
+        # Sorted and merged chunks of virtual offsets that may hold records overlapping [beg, end)
+        if chrom not in self.names:
+            return []
+        ref = self.names[chrom]
+        end = min(end, 1 << (self.min_shift + 3 * self.depth))
+        if beg >= end:
+            return []
+        min_offset = self._min_offset(ref, beg)
+        bins = self.bins[ref]
+        chunks = sorted(chunk for bin_ in reg2bins(beg, end, self.min_shift, self.depth)
+                        for chunk in bins.get(bin_, []) if chunk[1] > min_offset)
+        merged: List[Tuple[int, int]] = []
+        for start, stop in chunks:
+            if merged and start <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(stop, merged[-1][1]))
+            else:
+                merged.append((start, stop))
+        return merged
+
+    def fetch(self, reader: BgzfReader, chrom: str, beg: int, end: int) -> Iterator[Tuple[int, str]]:
+        # Records overlapping [beg, end) with their virtual offset
+        for start, stop in self.chunks(chrom, beg, end):
+            reader.seek(start)
+            while reader.tell() < stop:
+                offset = reader.tell()
+                line = reader.readline().decode().rstrip('\n')
+                if not line:
+                    break
+                record_chrom, record_beg, record_end = record_span(line)
+                if record_chrom != chrom or record_beg >= end:
+                    break
+                if record_end > beg:
+                    yield offset, line
@@ -1,13 +1,203 @@
 import gzip
+import mmap
+import os
+from bisect import bisect_right
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Deque, Dict, Generator, Iterable, Iterator, List, Optional, Tuple
 
+from varcomb.bgzf import HEADER, BgzfReader, inflate_block, is_bgzf, scan_blocks
 from varcomb.exceptions import VCFFileNotSupported
+from varcomb.header import chrom_key
+from varcomb.tabix import TabixIndex, record_span
 
+# A region is a chromosome with a 1-based, inclusive start and end
+Region = Tuple[str, int, int]
+MAX_POS = 1 << 62
 
-def read_vcf(fname):
+# Threads inflating the blocks of BGZF inputs, and blocks in flight per thread
+DECOMPRESS_THREADS = min(4, os.cpu_count() or 1)
+BLOCKS_PER_THREAD = 4
+# Bytes read at once by read_vcf_blocks from inputs that are not BGZF compressed
+READ_BYTES = 1 << 20
+
+
+def _iter_lines(f: IO[str]) -> Iterator[str]:
+    with f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line:
+                yield line
+
+
+def _iter_blocks(f: IO[bytes]) -> Iterator[bytes]:
+    with f:
+        yield from iter(lambda: f.read(READ_BYTES), b'')
+
+
+def _iter_bgzf_blocks(fname: str, threads: int) -> Iterator[bytes]:
+    # The blocks are inflated on a thread pool (zlib releases the GIL), and yielded in order
+    with open(fname, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data, \
+            ThreadPoolExecutor(max_workers=threads) as executor:
+        pending: Deque = deque()
+        for start, end in scan_blocks(data):
+            pending.append(executor.submit(inflate_block, data, start, end))
+            if len(pending) < threads * BLOCKS_PER_THREAD:
+                continue
+            yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _iter_bgzf_lines(fname: str, threads: int) -> Iterator[str]:
+    rest = b''
+    for block in _iter_bgzf_blocks(fname, threads):
+        rest = yield from _block_lines(rest + block)
+    if rest:
+        yield from _block_lines(rest + b'\n')
+
+
+def _block_lines(block: bytes) -> Generator[str, None, bytes]:
+    # Yields the complete lines, and returns what is left of a line continuing in the next block
+    cut = block.rfind(b'\n')
+    if cut < 0:
+        return block
+    if b'\r' in block:
+        block = block.replace(b'\r\n', b'\n')
+        cut = block.rfind(b'\n')
+    for line in block[:cut].decode().split('\n'):
+        if line:
+            yield line
+    return block[cut + 1:]
+
+
+def read_vcf(fname: str, threads: int = DECOMPRESS_THREADS) -> Iterator[str]:
     if fname.endswith('.vcf'):
-        with open(fname, 'r') as f:
-            return [row for row in f.read().split('\n') if row]
+        return _iter_lines(open(fname, 'r'))
     elif fname.endswith('.vcf.gz'):
-        with gzip.open(fname, 'rb') as f:
-            return [row for row in f.read().decode().split('\n') if row]
+        with open(fname, 'rb') as f:
+            bgzf = is_bgzf(f.read(HEADER.size + 64))
+        if bgzf:
+            return _iter_bgzf_lines(fname, threads)
+        # Plain gzip files can not be split into blocks
+        return _iter_lines(gzip.open(fname, 'rt'))
     raise VCFFileNotSupported(f'{fname} does not end on ".vcf" or ".vcf.gz"')
+
+
+def read_vcf_blocks(fname: str, threads: int = DECOMPRESS_THREADS) -> Iterator[bytes]:
+    # The decompressed content as blocks of bytes, which end anywhere in a line. For readers that split the lines themselves
+    if fname.endswith('.vcf'):
+        return _iter_blocks(open(fname, 'rb'))
+    elif fname.endswith('.vcf.gz'):
+        with open(fname, 'rb') as f:
+            bgzf = is_bgzf(f.read(HEADER.size + 64))
+        if bgzf:
+            return _iter_bgzf_blocks(fname, threads)
+        return _iter_blocks(gzip.open(fname, 'rb'))
+    raise VCFFileNotSupported(f'{fname} does not end on ".vcf" or ".vcf.gz"')
+
+
+def parse_region(region: str) -> Region:
+    # chr1, chr1:100 or chr1:100-200, with optional thousands separators
+    chrom, _, span = region.rpartition(':')
+    if not chrom or not span.replace(',', '').replace('-', '').isdigit():
+        return region, 1, MAX_POS
+    start, _, end = span.replace(',', '').partition('-')
+    return chrom, int(start), int(end) if end else MAX_POS
+
+
+def read_regions_file(fname: str) -> List[Region]:
+    # BED intervals are 0-based and half-open
+    regions = []
+    with open(fname, 'r') as f:
+        for line in f:
+            if not line.strip() or line.startswith(('#', 'track', 'browser')):
+                continue
+            chrom, start, end = line.split('\t')[:3]
+            regions.append((chrom, int(start) + 1, int(end)))
+    return regions
+
+
+def merge_regions(regions: Iterable[Region]) -> List[Region]:
+    merged: List[Region] = []
+    for chrom, start, end in sorted(regions, key=lambda region: (chrom_key(region[0]), region[1])):
+        if merged and merged[-1][0] == chrom and start <= merged[-1][2] + 1:
+            merged[-1] = (chrom, merged[-1][1], max(end, merged[-1][2]))
+        else:
+            merged.append((chrom, start, end))
+    return merged
+
+
+def find_index(fname: str) -> Optional[str]:
+    if not fname.endswith('.gz'):
+        return None
+    for suffix in ('.tbi', '.csi'):
+        if os.path.exists(fname + suffix):
+            return fname + suffix
+    return None
+
+
+def _filter_regions(lines: Iterator[str], regions: List[Region]) -> Iterator[str]:
+    by_chrom: Dict[str, Tuple[List[int], List[int]]] = {}
+    for chrom, start, end in regions:
+        starts, ends = by_chrom.setdefault(chrom, ([], []))
+        starts.append(start - 1)
+        ends.append(end)
+    for line in lines:
+        if line.startswith('#'):
+            yield line
+            continue
+        chrom, beg, end = record_span(line)
+        if chrom not in by_chrom:
+            continue
+        starts, ends = by_chrom[chrom]
+        # Regions are merged, so only the last one starting before the record ends can overlap it
+        i = bisect_right(starts, end - 1) - 1
+        if i >= 0 and ends[i] > beg:
+            yield line
+
+
+def _fetch_regions(fname: str, index: TabixIndex, regions: List[Region]) -> Iterator[str]:
+    with BgzfReader(fname) as reader:
+        while True:
+            line = reader.readline().decode().rstrip('\n')
+            if not line.startswith('#'):
+                break
+            yield line
+        last: Dict[str, int] = {}
+        for chrom, start, end in regions:
+            for offset, line in index.fetch(reader, chrom, start - 1, end):
+                # A record overlapping two regions is only returned once
+                if offset > last.get(chrom, -1):
+                    last[chrom] = offset
+                    yield line
+
+
+def load_index(fname: str) -> Optional[TabixIndex]:
+    index = find_index(fname)
+    if index is None:
+        return None
+    names = None
+    if index.endswith('.csi'):
+        # CSI indexes made for VCF by bcftools refer to the ##contig lines instead of naming the sequences
+        names = [line[13:].split(',')[0].rstrip('>') for line in read_vcf_header(fname) if line.startswith('##contig=<ID=')]
+    return TabixIndex.load(index, names=names)
+
+
+def read_vcf_regions(fname: str, regions: Iterable[Region], index: Optional[TabixIndex] = None) -> Iterator[str]:
+    # Header lines and the records overlapping the regions, using the tabix/CSI index when there is one
+    regions = merge_regions(regions)
+    if index is None:
+        index = load_index(fname)
+    if index is None:
+        return _filter_regions(read_vcf(fname), regions)
+    return _fetch_regions(fname, index, regions)
+
+
+def read_vcf_header(fname: str) -> List[str]:
+    header = []
+    for line in read_vcf(fname):
+        if not line.startswith('#'):
+            break
+        header.append(line)
+    return header
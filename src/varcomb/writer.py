@@ -0,0 +1,92 @@
+import os
+from itertools import islice
+from typing import TYPE_CHECKING, Iterable, List, Optional
+
+from varcomb.bgzf import BgzfWriter
+from varcomb.prefetch import BackgroundHandle
+from varcomb.tabix import IndexBuilder
+
+if TYPE_CHECKING:  # pragma: no cover
+    from varcomb.core import VCFrow
+
+# Bytes buffered by plain text output, and lines joined per write call
+BUFFER_SIZE = 1 << 20
+BATCH_SIZE = 1024
+
+
+class VCFWriter:
+    __slots__ = 'fname', 'index', 'n', '_handle', '_builder'
+
+    def __init__(self, fname: str, header: Optional[List[str]] = None, index: Optional[str] = None,
+                 background: bool = False):
+        # Files ending on .gz are written as BGZF, and can be indexed with a .tbi or .csi index on the way
+        compressed = fname.endswith('.gz')
+        if index is not None and not compressed:
+            raise ValueError(f'Only BGZF compressed files can be indexed, {fname} does not end on ".gz"')
+        self.fname = fname
+        self.index = index
+        self.n = 0
+        self._builder = IndexBuilder(index) if index is not None else None
+        self._handle = BgzfWriter(fname) if compressed else open(fname, 'w', buffering=BUFFER_SIZE)
+        if background and index is None:
+            # Compression and writing overlap with producing the lines; an index needs the offsets right away
+            self._handle = BackgroundHandle(self._handle)
+        if header:
+            self._handle.write('\n'.join(header) + '\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is not None:
+            self.discard()
+        else:
+            self.close()
+
+    def write_line(self, line: str):
+        if self._builder is not None:
+            start = self._handle.tell()
+            self._handle.write(f'{line}\n')
+            self._builder.add_line(line, start, self._handle.tell())
+        else:
+            self._handle.write(f'{line}\n')
+        self.n += 1
+
+    def write_lines(self, lines: Iterable[str]) -> int:
+        n = self.n
+        if self._builder is not None:
+            for line in lines:
+                self.write_line(line)
+            return self.n - n
+        lines = iter(lines)
+        while True:
+            batch = list(islice(lines, BATCH_SIZE))
+            if not batch:
+                return self.n - n
+            self._handle.write('\n'.join(batch) + '\n')
+            self.n += len(batch)
+
+    def write_row(self, row: 'VCFrow'):
+        self.write_line(row._format_row())
+
+    def write_rows(self, rows: Iterable['VCFrow']) -> int:
+        return self.write_lines(row._format_row() for row in rows)
+
+    def close(self):
+        self._handle.close()
+        if self._builder is not None:
+            self._builder.write(f'{self.fname}.{self.index}')
+
+    def discard(self):
+        # After a failure the output is removed, so a truncated file (with a valid BGZF EOF marker) is never left behind
+        self._builder = None
+        try:
+            self._handle.close()
+        finally:
+            if os.path.exists(self.fname):
+                os.unlink(self.fname)
+
+
+def write_vcf(fname: str, header: Optional[List[str]], lines: Iterable[str], index: Optional[str] = None) -> int:
+    with VCFWriter(fname, header=header, index=index) as writer:
+        return writer.write_lines(lines)
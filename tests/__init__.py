@@ -0,0 +1,26 @@
+import os
+import tempfile
+import unittest
+
+HEADER = ['##fileformat=VCFv4.2', '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1']
+
+
+def vcf_row(chrom, pos, ref='A', alt='G', qual='.', info='.'):
+    # A record line with one sample
+    return '\t'.join([chrom, str(pos), '.', ref, alt, qual, 'PASS', info, 'GT', '0/1'])
+
+
+class TempDirTestCase(unittest.TestCase):
+    # Test cases that write their files to a temporary directory, which is removed afterwards
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def path(self, name):
+        return os.path.join(self.tmpdir.name, name)
+
+    def write_vcf(self, name, lines):
+        fname = self.path(name)
+        with open(fname, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return fname
@@ -0,0 +1,105 @@
+import csv
+import os
+from unittest import mock
+
+from click.testing import CliRunner
+
+from tests import HEADER, TempDirTestCase, vcf_row
+from varcomb.batch import Job, read_manifest, run_batch
+from varcomb.client import client
+from varcomb.utilities import read_vcf
+
+
+def _merge_or_die(fnames, fname_out, annotations, **options):
+    if fname_out.endswith('B.vcf'):
+        os._exit(1)
+    return 1, 1
+
+
+class TestBatch(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = HEADER
+        rows = {(chrom, pos): vcf_row(chrom, pos, ref, alt, info='DP=1')
+                for chrom, pos, ref, alt in [('chr1', 5, 'A', 'G'), ('chr1', 9, 'C', 'T'), ('chr2', 3, 'G', 'A'),
+                                             ('chr1', 7, 'T', 'C')]}
+        self.a1 = self.write_vcf('a1.vcf', self.header + [rows['chr1', 5], rows['chr1', 9]])
+        self.a2 = self.write_vcf('a2.vcf', self.header + [rows['chr1', 5], rows['chr2', 3]])
+        self.b1 = self.write_vcf('b1.vcf', self.header + [rows['chr1', 7]])
+
+    def _manifest(self, lines):
+        return self.write_vcf('manifest.tsv', ['\t'.join(line) for line in lines])
+
+    def test_read_manifest(self):
+        fname = self._manifest([('sample', 'vcf_file', 'ann_vcf', 'vcf_out'),
+                                ('# comment',),
+                                ('A', f'{self.a1},{self.a2}', 'X,Y', 'a.vcf'),
+                                ('B', self.b1, '', 'b.vcf')])
+        self.assertEqual(read_manifest(fname), [Job('A', [self.a1, self.a2], ['X', 'Y'], 'a.vcf'),
+                                                Job('B', [self.b1], [None], 'b.vcf')])
+
+    def test_read_manifest_errors(self):
+        manifests = [[('sample', 'vcf_file'), ('A', self.a1)],
+                     [('sample', 'vcf_file', 'vcf_out'), ('A', '', 'a.vcf')],
+                     [('sample', 'vcf_file', 'ann_vcf', 'vcf_out'), ('A', f'{self.a1},{self.a2}', 'X', 'a.vcf')],
+                     [('sample', 'vcf_file', 'vcf_out'), ('A', self.a1, 'a.vcf'), ('A', self.a2, 'b.vcf')],
+                     [('sample', 'vcf_file', 'vcf_out'), ('A', self.a1)]]
+        for lines in manifests:
+            with self.assertRaises(ValueError):
+                read_manifest(self._manifest(lines))
+
+    def test_merge_batch(self):
+        out_a, out_b = self.path('a.vcf'), self.path('b.vcf')
+        manifest = self._manifest([('sample', 'vcf_file', 'ann_vcf', 'vcf_out'),
+                                   ('A', f'{self.a1},{self.a2}', 'X,Y', out_a),
+                                   ('B', f'{self.b1},{self.b1}', '', out_b)])
+        summary = self.path('summary.tsv')
+        result = CliRunner().invoke(client, ['merge-batch', '--manifest', manifest, '--summary', summary,
+                                             '--workers', '2', '--dedup_key', 'loc'], catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0, result.output)
+        with open(summary) as f:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+        self.assertEqual([(row['sample'], row['status'], row['records_in'], row['records_out'], row['duplicates'])
+                          for row in rows], [('A', 'ok', '4', '3', '1'), ('B', 'ok', '2', '1', '1')])
+        records = [line.split('\t') for line in read_vcf(out_a) if not line.startswith('#')]
+        self.assertEqual([(record[0], record[1], record[7]) for record in records],
+                         [('chr1', '5', 'DP=1;Annotation=X'), ('chr1', '9', 'DP=1;Annotation=X'),
+                          ('chr2', '3', 'DP=1;Annotation=Y')])
+
+    def test_merge_batch_failure(self):
+        out_a, out_b = self.path('a.vcf'), self.path('b.vcf')
+        manifest = self._manifest([('sample', 'vcf_file', 'vcf_out'),
+                                   ('A', self.path('missing.vcf'), out_a),
+                                   ('B', self.b1, out_b)])
+        summary = self.path('summary.tsv')
+        result = CliRunner().invoke(client, ['merge-batch', '--manifest', manifest, '--summary', summary,
+                                             '--workers', '1', '--memory_per_worker', '4096'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('1 of 2 merges failed: A', result.output)
+        with open(summary) as f:
+            rows = list(csv.DictReader(f, delimiter='\t'))
+        self.assertEqual([(row['sample'], row['status']) for row in rows], [('A', 'failed'), ('B', 'ok')])
+        self.assertIn('missing.vcf', rows[0]['error'])
+        self.assertTrue(os.path.exists(out_b))
+
+    def test_merge_batch_short_row(self):
+        manifest = self._manifest([('sample', 'vcf_file', 'vcf_out'), ('A', self.a1)])
+        result = CliRunner().invoke(client, ['merge-batch', '--manifest', manifest])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('fewer columns than the header', result.output)
+
+    def test_run_batch_worker_dies(self):
+        # Only the job that kills its worker fails; the others run to the end, in a new pool if need be
+        jobs = [Job(sample, [self.b1], [None], self.path(f'{sample}.vcf')) for sample in ('A', 'B', 'C', 'D')]
+        for workers in (1, 2):
+            with mock.patch('varcomb.batch.run_merge', _merge_or_die):
+                results = run_batch(jobs, {}, workers)
+            self.assertEqual([(result['sample'], result['status']) for result in results],
+                             [('A', 'ok'), ('B', 'failed'), ('C', 'ok'), ('D', 'ok')])
+            self.assertEqual(results[1]['error'], 'worker process died')
+
+    def test_merge_batch_index_needs_gz(self):
+        manifest = self._manifest([('sample', 'vcf_file', 'vcf_out'), ('A', self.a1, self.path('a.vcf'))])
+        result = CliRunner().invoke(client, ['merge-batch', '--manifest', manifest, '--index', 'tbi'])
+        self.assertEqual(result.exit_code, 2)
+        self.assertIn('--index', result.output)
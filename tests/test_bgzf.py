@@ -0,0 +1,210 @@
+import gzip
+import os
+import struct
+import zlib
+
+from tests import TempDirTestCase, vcf_row
+from varcomb.bgzf import BLOCK_SIZE, EOF, BgzfWriter
+from varcomb.merge import merge_vcf_files, merge_vcf_files_parallel
+from varcomb.parsers import parse_vcf_file
+from varcomb.tabix import IndexBuilder, reg2bin, reg2bins
+from varcomb.utilities import MAX_POS, parse_region, read_regions_file, read_vcf, read_vcf_regions
+
+
+def _blocks(fname):
+    with open(fname, 'rb') as f:
+        data = f.read()
+    blocks, offset = {}, 0
+    while offset < len(data):
+        bsize = struct.unpack_from('<H', data, offset + 16)[0] + 1
+        blocks[offset] = zlib.decompress(data[offset + 18:offset + bsize - 8], -15)
+        offset += bsize
+    return blocks
+
+
+class TestBgzf(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fname = self.path('test.vcf.gz')
+
+    def test_bgzf_writer(self):
+        data = os.urandom(BLOCK_SIZE * 2).hex()
+        with BgzfWriter(self.fname) as f:
+            f.write(data[:10])
+            self.assertEqual(f.tell(), 10)
+            f.write(data[10:])
+        with gzip.open(self.fname, 'rt') as f:
+            self.assertEqual(f.read(), data)
+        with open(self.fname, 'rb') as f:
+            self.assertTrue(f.read().endswith(EOF))
+        blocks = _blocks(self.fname)
+        self.assertEqual(len(blocks), 5)
+        self.assertTrue(all(len(block) <= BLOCK_SIZE for block in blocks.values()))
+
+    def test_read_vcf_threads(self):
+        # Lines span block boundaries, and use both line endings
+        lines = ['##fileformat=VCFv4.2'] + [vcf_row('chr1', pos, info=f'N={"x" * (pos % 97)}') for pos in range(1, 5000)]
+        with BgzfWriter(self.fname) as f:
+            f.write('\r\n'.join(lines[:2000]) + '\r\n')
+            f.write('\n\n'.join(lines[2000:]))
+        self.assertGreater(len(_blocks(self.fname)), 3)
+        for threads in (1, 3):
+            self.assertEqual(list(read_vcf(self.fname, threads=threads)), lines)
+        with gzip.open(self.fname, 'wt') as f:
+            f.write('\n'.join(lines) + '\n')
+        self.assertEqual(list(read_vcf(self.fname)), lines)
+
+    def test_read_vcf_corrupt(self):
+        with BgzfWriter(self.fname) as f:
+            f.write('\n'.join(vcf_row('chr1', pos) for pos in range(1, 100)))
+        with open(self.fname, 'r+b') as f:
+            f.seek(-len(EOF) - 8, os.SEEK_END)
+            f.write(b'\0\0\0\0')
+        with self.assertRaises(ValueError):
+            list(read_vcf(self.fname))
+
+    def test_reg2bin(self):
+        self.assertEqual(reg2bin(0, 1), 4681)
+        self.assertEqual(reg2bin(1 << 14, (1 << 14) + 1), 4682)
+        self.assertEqual(reg2bin(0, 1 << 15), 585)
+        self.assertEqual(reg2bin(0, 1 << 29), 0)
+        self.assertIn(reg2bin(100000, 100100), reg2bins(99000, 100050))
+        self.assertEqual(reg2bin(0, 1, depth=6), 37449)
+
+
+class TestIndex(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fname = self.path('test.vcf.gz')
+        self.header = ['##fileformat=VCFv4.2']
+        self.rows = [vcf_row('chr1', pos) for pos in range(1, 200000, 50)]
+        self.rows += [vcf_row('chr2', 100, info='SVTYPE=DEL;END=70000'), vcf_row('chr2', 100000)]
+
+    def _check_chunks(self, blocks, chunks, line):
+        # The record must be one of the lines inside one of the chunks
+        data, starts = b'', {}
+        for coffset, block in sorted(blocks.items()):
+            starts[coffset] = len(data)
+            data += block
+        for start, stop in chunks:
+            text = data[starts[start >> 16] + (start & 0xffff):starts[stop >> 16] + (stop & 0xffff)].decode()
+            if line in text.split('\n'):
+                return True
+        return False
+
+    def test_tabix_index(self):
+        vcf = parse_vcf_file(self.header + self.rows)
+        vcf.to_file(self.fname, index='tbi')
+        self.assertEqual(list(read_vcf(self.fname)), self.header + self.rows)
+        with gzip.open(self.fname + '.tbi', 'rb') as f:
+            data = f.read()
+        magic, n_ref, fmt, col_seq, col_beg, col_end, meta, skip, l_nm = struct.unpack_from('<4s8i', data)
+        self.assertEqual((magic, n_ref, fmt, col_seq, col_beg, col_end, meta, skip), (b'TBI\1', 2, 2, 1, 2, 0, ord('#'), 0))
+        self.assertEqual(data[36:36 + l_nm], b'chr1\0chr2\0')
+
+        offset, blocks = 36 + l_nm, _blocks(self.fname)
+        refs = []
+        for _ in range(n_ref):
+            bins = {}
+            n_bin, = struct.unpack_from('<i', data, offset)
+            offset += 4
+            for _ in range(n_bin):
+                bin_, n_chunk = struct.unpack_from('<Ii', data, offset)
+                bins[bin_] = [struct.unpack_from('<QQ', data, offset + 8 + 16 * i) for i in range(n_chunk)]
+                offset += 8 + 16 * n_chunk
+            n_intv, = struct.unpack_from('<i', data, offset)
+            linear = struct.unpack_from(f'<{n_intv}Q', data, offset + 4)
+            offset += 4 + 8 * n_intv
+            refs.append((bins, linear))
+        self.assertEqual(offset, len(data))
+        self.assertEqual(len(refs[0][1]), (199951 >> 14) + 1)
+        self.assertEqual(len(refs[1][1]), (100000 >> 14) + 1)
+        self.assertEqual(refs[1][1][2], refs[1][1][0])
+
+        for line in self.rows[::97] + self.rows[-2:]:
+            chrom, pos = line.split('\t')[:2]
+            bins = refs[int(chrom[-1]) - 1][0]
+            chunks = [chunk for bin_ in reg2bins(int(pos) - 1, int(pos)) for chunk in bins.get(bin_, [])]
+            self.assertTrue(self._check_chunks(blocks, chunks, line), line)
+
+    def test_csi_index(self):
+        vcf = parse_vcf_file(self.header + self.rows)
+        vcf.to_file(self.fname, index='csi')
+        with gzip.open(self.fname + '.csi', 'rb') as f:
+            data = f.read()
+        magic, min_shift, depth, l_aux = struct.unpack_from('<4s3i', data)
+        self.assertEqual((magic, min_shift, depth), (b'CSI\1', 14, 6))
+        n_ref, = struct.unpack_from('<i', data, 16 + l_aux)
+        self.assertEqual(n_ref, 2)
+
+    def test_index_requires_sorted_and_compressed(self):
+        with self.assertRaises(ValueError):
+            parse_vcf_file(self.rows).to_file(self.fname[:-3], index='tbi')
+        builder = IndexBuilder()
+        builder.add_line(vcf_row('chr1', 100), 0, 10)
+        with self.assertRaises(Exception):
+            builder.add_line(vcf_row('chr1', 50), 10, 20)
+
+
+class TestRegions(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fname = self.path('test.vcf.gz')
+        self.header = ['##fileformat=VCFv4.2', '##contig=<ID=chr1>', '##contig=<ID=chr2>', '##contig=<ID=chr10>']
+        self.rows = [vcf_row('chr1', pos) for pos in range(1, 300000, 37)]
+        self.rows += [vcf_row('chr2', 100, info='SVTYPE=DEL;END=70000'), vcf_row('chr2', 100000), vcf_row('chr10', 5)]
+        self.regions = [('chr1', 1000, 2000), ('chr1', 1500, 40000), ('chr1', 250000, 250100),
+                        ('chr2', 50000, 60000), ('chr2', 99999, 99999), ('chr10', 1, 10), ('chrX', 1, 10)]
+        with open(self.fname[:-3], 'w') as f:
+            f.write('\n'.join(self.header + self.rows) + '\n')
+
+    def _expected(self):
+        return list(read_vcf_regions(self.fname[:-3], self.regions))
+
+    def test_parse_region(self):
+        self.assertEqual(parse_region('chr1:1,000-2,000'), ('chr1', 1000, 2000))
+        self.assertEqual(parse_region('chr1:1000'), ('chr1', 1000, MAX_POS))
+        self.assertEqual(parse_region('chrX'), ('chrX', 1, MAX_POS))
+
+    def test_read_regions_file(self):
+        fname = self.path('regions.bed')
+        with open(fname, 'w') as f:
+            f.write('track name=panel\nchr1\t999\t2000\tgene1\nchr2\t0\t10\n')
+        self.assertEqual(read_regions_file(fname), [('chr1', 1000, 2000), ('chr2', 1, 10)])
+
+    def test_read_vcf_regions_without_index(self):
+        lines = self._expected()
+        self.assertEqual(lines[:len(self.header)], self.header)
+        records = lines[len(self.header):]
+        self.assertEqual(len(records), len(range(1000, 40001)[::37]) + 3 + 1 + 1)
+        self.assertIn(self.rows[-3], records)
+        self.assertNotIn(self.rows[-2], records)
+
+    def test_read_vcf_regions_with_index(self):
+        expected = self._expected()
+        for fmt in ('tbi', 'csi'):
+            parse_vcf_file(read_vcf(self.fname[:-3])).to_file(self.fname, index=fmt)
+            self.assertEqual(list(read_vcf_regions(self.fname, self.regions)), expected)
+            os.remove(f'{self.fname}.{fmt}')
+
+    def test_read_vcf_regions_with_csi_without_names(self):
+        vcf = parse_vcf_file(read_vcf(self.fname[:-3]))
+        vcf.to_file(self.fname, index='csi')
+        with gzip.open(self.fname + '.csi', 'rb') as f:
+            data = f.read()
+        l_aux, = struct.unpack_from('<i', data, 12)
+        with BgzfWriter(self.fname + '.csi') as f:
+            f.write(data[:12] + struct.pack('<i', 0) + data[16 + l_aux:])
+        self.assertEqual(list(read_vcf_regions(self.fname, self.regions)), self._expected())
+
+    def test_read_vcf_regions_in_merges(self):
+        parse_vcf_file(read_vcf(self.fname[:-3])).to_file(self.fname, index='tbi')
+        expected = parse_vcf_file(self._expected())
+        for fnames in ([self.fname, self.fname[:-3]], [self.fname, self.fname]):
+            fname_out = self.path('out.vcf')
+            merge_vcf_files(fnames, fname_out, regions=self.regions)
+            self.assertEqual(parse_vcf_file(read_vcf(fname_out)).rows, expected.rows)
+            merge_vcf_files_parallel(fnames, fname_out, regions=self.regions)
+            self.assertEqual(parse_vcf_file(read_vcf(fname_out)).rows, expected.rows)
+        merge_vcf_files_parallel([self.fname, self.fname], fname_out)
+        self.assertEqual(parse_vcf_file(read_vcf(fname_out)).rows, parse_vcf_file(self.rows).rows)
@@ -0,0 +1,81 @@
+import os
+
+from click.testing import CliRunner
+
+from tests import HEADER, TempDirTestCase, vcf_row
+from varcomb.cache import VCFCache, content_digest
+from varcomb.client import client
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+
+
+
+class TestVCFCache(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.directory = self.path('cache')
+        self.header = HEADER[:1] + ['##contig=<ID=chr2>', '##contig=<ID=chr1>'] + HEADER[1:]
+        self.rows = [vcf_row('chr1', 5, 'A', 'G', info='DP=3'), vcf_row('chr2', 9, 'C', 'T'),
+                     vcf_row('chr1', 5, 'A', 'G', info='DP=3')]
+        self.fname = self._write('in.vcf', self.rows)
+
+    def _write(self, name, rows):
+        return self.write_vcf(name, self.header + rows)
+
+    def test_cache_roundtrip(self):
+        cache = VCFCache(self.directory)
+        parsed = cache.get(self.fname)
+        self.assertEqual(len(cache.entries()), 1)
+        cached = cache.get(self.fname)
+        self.assertEqual(cached.header, self.header)
+        self.assertEqual([cached.line(i) for i in range(len(cached))], self.rows)
+        self.assertEqual(list(cached.fingerprints()), list(parsed.fingerprints()))
+        self.assertEqual(list(cached.fingerprints()), [row.site_fingerprint() for row in parse_vcf_file(self.rows).rows])
+        self.assertEqual(cached.to_vcf(), parse_vcf_file(self.header + self.rows))
+        # The header of the entry keeps the contig order
+        self.assertEqual([cached.sort().line(i) for i in range(3)], [self.rows[1], self.rows[0], self.rows[2]])
+
+    def test_cache_content_changed(self):
+        cache = VCFCache(self.directory)
+        cache.get(self.fname)
+        self.assertIsNone(cache.load(cache.entry(self.fname), '0' * 32))
+        stat = os.stat(self.fname)
+        self._write('in.vcf', [vcf_row('chr1', 5, 'A', 'T', info='DP=3')] + self.rows[1:])
+        os.utime(self.fname, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(cache.get(self.fname).alt(0), 'T')
+
+    def test_cache_eviction(self):
+        cache = VCFCache(self.directory)
+        fnames = [self._write(f'{i}.vcf', self.rows[:i + 1]) for i in range(3)]
+        for fname in fnames:
+            cache.get(fname)
+        entries = {entry.path: entry.stat().st_size for entry in cache.entries()}
+        self.assertEqual(len(entries), 3)
+        # Reading the first input again makes the second one the least recently used
+        self.assertIsNotNone(cache.load(cache.entry(fnames[0]), content_digest(fnames[0])))
+        os.utime(cache.entry(fnames[1]), ns=(0, 0))
+        cache.evict(sum(entries.values()) - 1)
+        self.assertEqual(sorted(entry.path for entry in cache.entries()),
+                         sorted([cache.entry(fnames[0]), cache.entry(fnames[2])]))
+        small = VCFCache(self.path('small'), max_size=1)
+        small.get(self.fname)
+        self.assertEqual(small.entries(), [])
+
+    def test_merge_with_cache(self):
+        other = self._write('other.vcf', [vcf_row('chr1', 5, 'A', 'G', info='DP=3'),
+                                          vcf_row('chr1', 7, 'G', 'A', info='Annotation=old')])
+        outputs = []
+        for cache in (False, True, True):
+            out = self.path(f'out{len(outputs)}.vcf')
+            args = ['merge-vcfs', '--vcf_file', self.fname, '--ann_vcf', 'A', '--vcf_file', other, '--ann_vcf', 'B',
+                    '--vcf_out', out]
+            if cache:
+                args += ['--cache_dir', self.directory]
+            result = CliRunner().invoke(client, args, catch_exceptions=False)
+            self.assertEqual(result.exit_code, 0, result.output)
+            outputs.append(list(read_vcf(out)))
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+        result = CliRunner().invoke(client, ['merge-vcfs', '--vcf_file', self.fname, '--vcf_out', 'out.vcf',
+                                             '--cache_dir', self.directory, '--streaming'])
+        self.assertNotEqual(result.exit_code, 0)
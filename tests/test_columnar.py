@@ -0,0 +1,107 @@
+import gzip
+from unittest import mock
+
+from tests import TempDirTestCase
+from varcomb.columnar import ColumnarVCF
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+from varcomb.writer import VCFWriter
+
+
+class TestColumnarVCF(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.header = ['##fileformat=VCFv4.2']
+        self.rows = [
+            '\t'.join(['chr2', '21', 'id1', 'G', 'A', '.', 'PASS', 'DP=1', 'GT', '0/1']),
+            '\t'.join(['chr16', '50', 'id2', 'T', 'ATTGC', '.', 'PASS', 'DP=2', 'GT', '0/1']),
+            '\t'.join(['chrX', '7', 'id3', 'C', 'G', '.', 'PASS', 'DP=3', 'GT', '0/1']),
+            '\t'.join(['chr2', '12', 'id4', 'CA', 'C', '.', 'PASS', 'DP=4', 'GT', '0/1'])]
+        self.vcf = ColumnarVCF.from_stream(self.header + self.rows)
+
+    def test_columnar_vcf(self):
+        self.assertEqual(len(self.vcf), 4)
+        self.assertEqual(self.vcf.header, self.header)
+        self.assertEqual(self.vcf.contigs, ['chr2', 'chr16', 'chrX'])
+        self.assertEqual(list(self.vcf.positions), [21, 50, 7, 12])
+        self.assertEqual(self.vcf.chrom(1), 'chr16')
+        self.assertEqual(self.vcf.ref(1), 'T')
+        self.assertEqual(self.vcf.alt(1), 'ATTGC')
+        self.assertEqual(self.vcf.line(3), self.rows[3])
+        self.assertEqual(self.vcf.to_vcf(), parse_vcf_file(self.rows))
+
+    def test_columnar_chunks(self):
+        with mock.patch('varcomb.columnar.CHUNK_LINES', 3):
+            for processes in (1, 2):
+                vcf = ColumnarVCF.from_stream(self.header + self.rows + self.rows, processes=processes)
+                self.assertEqual(vcf.header, self.header)
+                self.assertEqual(vcf.contigs, ['chr2', 'chr16', 'chrX'])
+                self.assertEqual([vcf.line(i) for i in range(len(vcf))], self.rows + self.rows)
+                self.assertEqual([vcf.alt(i) for i in range(len(vcf))], ['A', 'ATTGC', 'G', 'C'] * 2)
+
+    def test_columnar_from_file(self):
+        fnames = [self.write_vcf('in.vcf', self.header + self.rows + self.rows), self.path('crlf.vcf'),
+                  self.path('in.vcf.gz'), self.path('gzip.vcf.gz')]
+        with open(fnames[1], 'wb') as f:
+            f.write('\r\n'.join(self.header + [''] + self.rows + [''] + self.rows).encode())
+        with VCFWriter(fnames[2], header=self.header) as writer:
+            writer.write_lines(self.rows + self.rows)
+        with gzip.open(fnames[3], 'wt') as f:
+            f.write('\n'.join(self.header + self.rows + self.rows) + '\n')
+        # Blocks and chunks that end in the middle of lines
+        with mock.patch('varcomb.columnar.CHUNK_BYTES', 70), mock.patch('varcomb.utilities.READ_BYTES', 29):
+            for fname in fnames:
+                for processes in (1, 2):
+                    vcf = ColumnarVCF.from_file(fname, processes=processes)
+                    self.assertEqual(vcf.header, self.header, fname)
+                    self.assertEqual([vcf.line(i) for i in range(len(vcf))], self.rows + self.rows, fname)
+                    self.assertEqual([vcf.alt(i) for i in range(len(vcf))], ['A', 'ATTGC', 'G', 'C'] * 2)
+
+    def test_columnar_roundtrip_vcf(self):
+        vcf = parse_vcf_file(self.header + self.rows)
+        columnar = ColumnarVCF.from_vcf(vcf)
+        self.assertEqual(columnar.to_vcf(), vcf)
+
+    def test_columnar_sort(self):
+        vcf = self.vcf.sort()
+        self.assertEqual([vcf.line(i) for i in range(len(vcf))],
+                         [self.rows[3], self.rows[0], self.rows[1], self.rows[2]])
+        self.assertEqual(vcf.to_vcf().rows, sorted(parse_vcf_file(self.rows).rows))
+
+    def test_columnar_get_from_chrom(self):
+        vcf = self.vcf.get_from_chrom('chr2')
+        self.assertEqual([row.id for row in vcf], ['id1', 'id4'])
+        self.assertEqual(len(self.vcf.get_from_chrom('chr3')), 0)
+        index = self.vcf.index
+        self.vcf.get_near_location('chrX', 7)
+        self.assertIs(self.vcf.index, index)
+
+    def test_columnar_get_near_location(self):
+        self.assertEqual([row.id for row in self.vcf.get_near_location('chr2', 15, tol=10)], ['id1', 'id4'])
+        self.assertEqual([row.id for row in self.vcf.get_near_location('chr2', 20, tol=8)], ['id1'])
+        self.assertEqual(len(self.vcf.get_near_location('chr2', 15, tol=5)), 1)
+        self.assertEqual(len(self.vcf.get_near_location('chr16', 15, tol=5)), 0)
+
+    def test_columnar_add_and_remove_duplicates(self):
+        other = ColumnarVCF.from_stream([self.rows[2], '\t'.join(['chr1', '5', '.', 'A', 'G', '.', 'PASS', '.', 'GT', '0/1'])])
+        vcf = self.vcf + other
+        self.assertEqual(len(vcf), 6)
+        self.assertEqual(vcf.contigs, ['chr2', 'chr16', 'chrX', 'chr1'])
+        self.assertEqual(vcf.chrom(5), 'chr1')
+        self.assertEqual(vcf.line(4), self.rows[2])
+        dedup = vcf.remove_true_duplicates()
+        self.assertEqual(len(dedup), 5)
+        self.assertEqual(dedup.chrom(0), 'chr1')
+        self.assertEqual(dedup.to_vcf(), (self.vcf.to_vcf() + other.to_vcf()).remove_true_duplicates())
+
+    def test_columnar_remove_loc_dup(self):
+        other = ColumnarVCF.from_stream(['\t'.join(['chr2', '21', '.', 'G', 'T', '.', 'PASS', '.', 'GT', '0/1'])])
+        vcf = (self.vcf + other).remove_loc_dup()
+        self.assertEqual(len(vcf), 4)
+        self.assertEqual(vcf.alt(1), 'A')
+
+    def test_columnar_to_file(self):
+        fname = self.path('test.vcf')
+        self.vcf.to_file(fname)
+        self.assertEqual(list(read_vcf(fname)), self.header + self.rows)
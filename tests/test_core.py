@@ -1,7 +1,9 @@
+import pickle
 import unittest
 
 from varcomb.core import VCF, Info, Location, VCFrow
 from varcomb.exceptions import LocationShiftError
+from varcomb.header import sort_rows
 
 
 class TestCoreLocation(unittest.TestCase):
@@ -63,6 +65,18 @@ class TestCoreLocation(unittest.TestCase):
         loc2 = Location(chrom='4', pos=1001)
         self.assertEqual(loc2 > loc1, False)
 
+    def test_location_hash(self):
+        self.assertNotEqual(hash(Location('chr1', 2)), hash(Location('chr2', 1)))
+        self.assertEqual(hash(Location('chr1', 2)), hash(Location('chr1', 2)))
+
+    def test_sort_rows(self):
+        chroms = ['chrX', 'chr10', 'chr2', 'chr1', 'chrM', 'chr2']
+        rows = [VCFrow(Location(chrom, 100 - i), '.', 'A', 'G', '.', 'PASS', Info(''), 'GT', ['0/1'])
+                for i, chrom in enumerate(chroms)]
+        self.assertEqual(sort_rows(rows), sorted(rows))
+        self.assertEqual([(row.loc.chrom, row.loc.pos) for row in sort_rows(rows)],
+                         [('chr1', 97), ('chr2', 95), ('chr2', 98), ('chr10', 99), ('chrM', 96), ('chrX', 100)])
+
 
 class TestCoreInfo(unittest.TestCase):
 
@@ -100,6 +114,61 @@ class TestCoreInfo(unittest.TestCase):
         self.assertEqual(info['field1'], True)
         self.assertEqual(info['field2'], True)
 
+    def test_infofield_single_and_empty(self):
+        self.assertEqual(len(Info('DP=10')), 1)
+        self.assertEqual(len(Info('')), 0)
+        self.assertEqual(len(Info('.')), 0)
+        info = Info('.')
+        info['k1'] = 'v1'
+        self.assertEqual(str(info), 'k1=v1')
+
+    def test_infofield_value_with_equals(self):
+        info = Info('k1=a=b;k2=v2')
+        self.assertEqual(info['k1'], 'a=b')
+        self.assertEqual(dict(info.items()), {'k1': 'a=b', 'k2': 'v2'})
+
+    def test_infofield_lazy_lookup(self):
+        info = Info('DPX=1;DP=10;XDP=3;FLAG')
+        self.assertEqual(info['DP'], '10')
+        self.assertEqual(info['FLAG'], True)
+        self.assertIn('XDP', info)
+        self.assertNotIn('D', info)
+        self.assertEqual(info.get('missing', 'default'), 'default')
+        with self.assertRaises(KeyError):
+            info['missing']
+        self.assertIsNone(info._data)
+
+    def test_infofield_serialize_only_when_modified(self):
+        info = Info('k1=v1;FLAG')
+        info['k2'] = 'v2'
+        self.assertIsNone(info._data)
+        self.assertEqual(str(info), 'k1=v1;FLAG;k2=v2')
+        info['k1'] = 'v3'
+        self.assertEqual(str(info), 'k1=v3;FLAG;k2=v2')
+        del info['k2']
+        self.assertEqual(str(info), 'k1=v3;FLAG')
+        self.assertEqual(info, Info('k1=v3;FLAG'))
+
+    def test_infofield_types(self):
+        types = {'DP': int, 'AF': lambda value: [float(x) for x in value.split(',')]}
+        info = Info('DP=10;AF=0.5,0.25;NAME=x', types)
+        self.assertEqual(info['DP'], 10)
+        self.assertEqual(info['AF'], [0.5, 0.25])
+        self.assertEqual(info['NAME'], 'x')
+        self.assertEqual(list(info.values()), [10, [0.5, 0.25], 'x'])
+        self.assertEqual(str(info), 'DP=10;AF=0.5,0.25;NAME=x')
+
+    def test_infofield_types_mismatch(self):
+        # Values that do not match their type are returned as written
+        for raw in ('DP=high', 'DP=10,12'):
+            info = Info(raw, {'DP': int})
+            self.assertIn('DP', info)
+            self.assertNotIn('AF', info)
+            self.assertEqual(info['DP'], raw[3:])
+            self.assertEqual(info.get('DP'), raw[3:])
+            info._parse()
+            self.assertIn('DP', info)
+
 
 class TestCoreVCFrow(unittest.TestCase):
 
@@ -127,6 +196,27 @@ class TestCoreVCFrow(unittest.TestCase):
         expected = '\t'.join(map(str, row + self.vcfrow.samples))
         self.assertEqual(actual, expected)
 
+    def test_raw_samples(self):
+        vcfrow = VCFrow(loc=self.loc, id='1234', ref='A', alt='G', qual='.', filter='PASS',
+                        info='info', format='format', samples='sample1\tsample2')
+        self.assertEqual(vcfrow, self.vcfrow)
+        self.assertEqual(vcfrow._format_row(), self.vcfrow._format_row())
+        self.assertEqual(vcfrow.samples, ['sample1', 'sample2'])
+        vcfrow.samples.append('sample3')
+        self.assertTrue(vcfrow._format_row().endswith('sample2\tsample3'))
+        self.assertEqual(VCFrow(loc=self.loc, id='1234', ref='A', alt='G', qual='.', filter='PASS',
+                                info='info', format='format').samples, [])
+
+    def test_hash_follows_changes(self):
+        before = hash(self.vcfrow)
+        self.assertEqual(hash(self.vcfrow), before)
+        self.vcfrow.ref = 'T'
+        self.assertNotEqual(hash(self.vcfrow), before)
+        self.vcfrow.ref = 'A'
+        self.assertEqual(hash(self.vcfrow), before)
+        with self.assertRaises(AttributeError):
+            self.vcfrow.other = 1
+
 
 class TestCoreVCF(unittest.TestCase):
 
@@ -175,3 +265,35 @@ class TestCoreVCF(unittest.TestCase):
         self.assertEqual(len(vcf1), 1)
         self.assertEqual(len(vcf2), 0)
         self.assertEqual(len(vcf3), 0)
+
+    def test_get_range(self):
+        vcf = self.vcf + self.vcf
+        self.assertEqual(len(vcf.get_range('chr2', 21, 21)), 2)
+        self.assertEqual(len(vcf.get_range('chr2', 22, 100)), 0)
+        self.assertEqual(len(vcf.get_range('chr3', 0, 100)), 0)
+
+    def test_get_near_locations(self):
+        vcfs = self.vcf.get_near_locations([('chr16', 55), ('chr2', 20), ('chr2', 55)], tol=10)
+        self.assertEqual([len(vcf) for vcf in vcfs], [1, 1, 0])
+        self.assertEqual(vcfs[1][0], self.vcfrow1)
+
+    def test_index_is_reused_and_invalidated(self):
+        index = self.vcf.index
+        self.assertIs(self.vcf.index, index)
+        self.vcf.rows.append(VCFrow(loc=Location(chrom='chr2', pos=25), id='id3', ref='G', alt='A', qual='.',
+                                    filter='PASS', info=Info(''), format='format', samples=[]))
+        self.assertIsNot(self.vcf.index, index)
+        self.assertEqual(len(self.vcf.get_near_location('chr2', 23, tol=5)), 2)
+        index = self.vcf.index
+        self.vcf.invalidate_index()
+        self.assertIsNot(self.vcf.index, index)
+        # Replacing a row in place needs invalidate_index(); replacing all of them does not
+        self.vcf.rows[0] = VCFrow(loc=Location(chrom='chr2', pos=100), id='id4', ref='G', alt='A', qual='.',
+                                  filter='PASS', info=Info(''), format='format', samples=[])
+        self.vcf.invalidate_index()
+        self.assertEqual([row.id for row in self.vcf.get_near_location('chr2', 100, tol=5)], ['id4'])
+        self.vcf.rows = self.vcf.rows[:1]
+        self.assertEqual(len(self.vcf.get_from_chrom('chr2')), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(self.vcf)).get_from_chrom('chr2').rows, self.vcf.rows)
+        rows = list(self.vcf.rows)
+        self.assertIs(VCF(rows).rows, rows)
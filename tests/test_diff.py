@@ -0,0 +1,84 @@
+import os
+import unittest
+
+from click.testing import CliRunner
+
+from tests import HEADER, TempDirTestCase, vcf_row
+from varcomb.client import client
+from varcomb.diff import diff_sorted, diff_vcf_files
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+
+
+
+class TestDiff(unittest.TestCase):
+    def setUp(self):
+        self.first = [vcf_row('chr1', 100, 'A', 'G'), vcf_row('chr1', 100, 'A', 'T'), vcf_row('chr1', 500, 'C', 'T', '30'),
+                      vcf_row('chr2', 100, 'T', 'C'), vcf_row('chr2', 100, 'T', 'C')]
+        self.second = [vcf_row('chr1', 100, 'A', 'T'), vcf_row('chr1', 500, 'c', 't', '50'), vcf_row('chr2', 100, 'T', 'C'),
+                       vcf_row('chr3', 7, 'G', 'A')]
+        self.vcf1, self.vcf2 = parse_vcf_file(self.first), parse_vcf_file(self.second)
+
+    def test_eq(self):
+        self.assertEqual(self.vcf1, parse_vcf_file(list(reversed(self.first))))
+        self.assertNotEqual(self.vcf1, parse_vcf_file(self.first[:-1]))
+        self.assertNotEqual(parse_vcf_file(self.first[:-1]), self.vcf1)
+        self.assertNotEqual(self.vcf1, parse_vcf_file(self.first[:-1] + [self.first[0]]))
+
+    def test_set_operations(self):
+        self.assertEqual([row.alt for row in self.vcf1.intersection(self.vcf2).rows], ['T', 'T', 'C', 'C'])
+        self.assertEqual([row.alt for row in self.vcf1.intersection(self.vcf2, key='row').rows], ['T', 'C', 'C'])
+        self.assertEqual([row.alt for row in self.vcf1.difference(self.vcf2).rows], ['G'])
+        self.assertEqual([row.alt for row in self.vcf2.difference(self.vcf1).rows], ['A'])
+        union = self.vcf1.union(self.vcf2)
+        self.assertEqual([(row.loc.chrom, row.alt) for row in union.rows],
+                         [('chr1', 'G'), ('chr1', 'T'), ('chr1', 'T'), ('chr2', 'C'), ('chr2', 'C'), ('chr3', 'A')])
+        with self.assertRaises(ValueError):
+            self.vcf1.intersection(self.vcf2, key='loc')
+
+    def test_diff(self):
+        diff = self.vcf1.diff(self.vcf2)
+        self.assertEqual(diff.counts(), {'shared': 3, 'first_only': 2, 'second_only': 1})
+        self.assertEqual([row.alt for row in diff.first_only.rows], ['G', 'C'])
+        self.assertEqual(self.vcf1.diff(self.vcf2, key='row').counts(), {'shared': 2, 'first_only': 3, 'second_only': 2})
+        self.assertEqual(self.vcf1.diff(self.vcf1).counts(), {'shared': 5, 'first_only': 0, 'second_only': 0})
+
+    def test_diff_sorted(self):
+        for key in ('site', 'row'):
+            streamed = list(diff_sorted(sorted(self.vcf1.rows), sorted(self.vcf2.rows), key=key))
+            diff = self.vcf1.diff(self.vcf2, key=key)
+            for kind, vcf in diff.counts().items():
+                self.assertEqual(sum(1 for k, _ in streamed if k == kind), vcf)
+        self.assertEqual([kind for kind, _ in diff_sorted(sorted(self.vcf1.rows), sorted(self.vcf2.rows))],
+                         ['first_only', 'shared', 'shared', 'shared', 'first_only', 'second_only'])
+
+
+class TestDiffFiles(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = HEADER
+        self.fnames = [self.write_vcf(f'{i}.vcf', self.header + rows) for i, rows in
+                       enumerate([[vcf_row('chr1', 5, 'A', 'G'), vcf_row('chr2', 1, 'C', 'T')],
+                                  [vcf_row('chr1', 5, 'A', 'G'), vcf_row('chr10', 3, 'G', 'T')]])]
+
+    def test_diff_vcf_files(self):
+        prefix = self.path('diff')
+        for streaming in (False, True):
+            counts = diff_vcf_files(*self.fnames, prefix=prefix, streaming=streaming)
+            self.assertEqual(counts, {'shared': 1, 'first_only': 1, 'second_only': 1})
+            self.assertEqual(list(read_vcf(f'{prefix}.second_only.vcf')), self.header + [vcf_row('chr10', 3, 'G', 'T')])
+
+    def test_diff_command(self):
+        result = CliRunner().invoke(client, ['diff', '--vcf_file1', self.fnames[0], '--vcf_file2', self.fnames[1],
+                                             '--streaming'], catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0, result.output)
+        self.assertEqual(result.output, 'shared\t1\nfirst_only\t1\nsecond_only\t1\n')
+
+    def test_diff_command_not_sorted(self):
+        fname = self.write_vcf('unsorted.vcf', self.header + [vcf_row('chr2', 1, 'C', 'T'), vcf_row('chr1', 5, 'A', 'G')])
+        prefix = self.path('diff')
+        result = CliRunner().invoke(client, ['diff', '--vcf_file1', fname, '--vcf_file2', self.fnames[1],
+                                             '--out_prefix', prefix, '--streaming'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('without --streaming', result.output)
+        self.assertFalse(os.path.exists(f'{prefix}.shared.vcf'))
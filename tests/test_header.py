@@ -0,0 +1,65 @@
+import unittest
+
+from varcomb.core import VCF, Info, Location, VCFrow
+from varcomb.header import ANNOTATION_INFO, Header
+
+
+class TestHeader(unittest.TestCase):
+    def setUp(self):
+        self.lines = [
+            '##fileformat=VCFv4.2',
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Read depth">',
+            '##FILTER=<ID=LowQual,Description="Low quality">',
+            '##contig=<ID=chr2>',
+            '##contig=<ID=chr1>',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1']
+        self.header = Header(self.lines)
+
+    def test_header(self):
+        self.assertEqual(self.header, self.lines)
+        self.assertEqual(len(self.header), 6)
+        self.assertEqual(list(self.header.definitions['INFO']), ['DP'])
+        self.assertEqual(self.header.contigs, ['chr2', 'chr1'])
+        self.assertEqual(self.header.contig_rank, {'chr2': 0, 'chr1': 1})
+        self.assertEqual(self.header.samples, ['S1'])
+        self.assertEqual(self.header.info_types['DP']('3'), 3)
+
+    def test_add(self):
+        header = self.header.add_info('AF', 'A', 'Float', 'Allele frequency')
+        self.assertEqual(header[2], '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">')
+        self.assertEqual(len(self.header), 6)
+        self.assertIs(header.add(self.lines[1]), header)
+        header = Header(['##fileformat=VCFv4.2', self.lines[-1]]).add(ANNOTATION_INFO)
+        self.assertEqual(header.lines, ['##fileformat=VCFv4.2', ANNOTATION_INFO, self.lines[-1]])
+
+    def test_merge(self):
+        other = Header([
+            '##fileformat=VCFv4.2',
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">',
+            '##INFO=<ID=MQ,Number=1,Type=Float,Description="Mapping quality">',
+            '##contig=<ID=chr3>',
+            self.lines[-1]])
+        merged = Header.merge(self.header, None, other)
+        self.assertEqual(merged.definitions['INFO']['DP'], self.lines[1])
+        self.assertIn('MQ', merged.definitions['INFO'])
+        self.assertEqual(merged.contigs, ['chr2', 'chr1', 'chr3'])
+        self.assertEqual(merged[-1], self.lines[-1])
+        self.assertIsNone(Header.merge(None, None))
+
+    def test_contig_key(self):
+        chroms = ['chrX', 'chr10', 'chr1', 'chr3', 'chr2']
+        self.assertEqual(sorted(chroms, key=self.header.contig_key), ['chr2', 'chr1', 'chr3', 'chr10', 'chrX'])
+        self.assertEqual(sorted(chroms, key=Header().contig_key), ['chr1', 'chr2', 'chr3', 'chr10', 'chrX'])
+        self.assertLess(self.header.location_key(Location('chr2', 100)), self.header.location_key(Location('chr1', 1)))
+
+    def test_vcf_header(self):
+        row1 = VCFrow(Location('chr1', 5), '.', 'A', 'G', '.', 'PASS', Info(''), 'GT', ['0/1'])
+        row2 = VCFrow(Location('chr2', 5), '.', 'A', 'G', '.', 'PASS', Info(''), 'GT', ['0/1'])
+        vcf = VCF([row1, row2], header=self.lines)
+        self.assertIsInstance(vcf.header, Header)
+        self.assertEqual(vcf.sort().rows, [row2, row1])
+        annotated = vcf.annotate('first')
+        self.assertIn(ANNOTATION_INFO, annotated.header)
+        self.assertNotIn(ANNOTATION_INFO, vcf.header)
+        merged = VCF([], header=['##contig=<ID=chr3>']) + vcf
+        self.assertEqual(merged.header.contigs, ['chr3', 'chr2', 'chr1'])
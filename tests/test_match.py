@@ -0,0 +1,72 @@
+import os
+
+from click.testing import CliRunner
+
+from tests import TempDirTestCase, vcf_row
+from varcomb.client import client
+from varcomb.match import match_vcf_files, match_vcfs, sweep_match
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+
+
+class TestMatch(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.caller1 = [vcf_row('chr1', 100, 'A', 'G'), vcf_row('chr1', 500, 'C', 'T'), vcf_row('chr1', 900, 'G', 'A'),
+                        vcf_row('chr2', 100, 'T', 'C')]
+        self.caller2 = [vcf_row('chr1', 103, 'A', 'G'), vcf_row('chr1', 505, 'C', 'G'), vcf_row('chr2', 2000, 'A', 'C')]
+        self.caller3 = [vcf_row('chr1', 98, 'A', 'G')]
+        self.vcfs = [parse_vcf_file(rows) for rows in (self.caller1, self.caller2, self.caller3)]
+
+    def test_match_vcfs(self):
+        result = match_vcfs(self.vcfs, tol=10)
+        self.assertEqual(len(result['matched']), 1)
+        self.assertEqual(result['matched'][0].callers, [0, 1, 2])
+        self.assertEqual(len(result['discordant']), 1)
+        self.assertEqual(result['discordant'][0].callers, [0, 1])
+        self.assertEqual(len(result['specific']), 3)
+
+    def test_match_vcfs_tolerance(self):
+        result = match_vcfs(self.vcfs, tol=2)
+        self.assertEqual(len(result['matched']), 1)
+        self.assertEqual(result['matched'][0].callers, [0, 2])
+        self.assertEqual(len(result['discordant']), 0)
+        self.assertEqual(len(result['specific']), 6)
+
+    def test_match_every_call_once(self):
+        matches = list(sweep_match([sorted(vcf.rows) for vcf in self.vcfs], tol=10))
+        calls = [call for match in matches for call in match.calls]
+        self.assertEqual(len(calls), sum(len(vcf) for vcf in self.vcfs))
+
+    def test_match_vcf_files(self):
+        fnames = [self.write_vcf(f'{i}.vcf', rows) for i, rows in enumerate((self.caller1, self.caller2, self.caller3))]
+        prefix = self.path('out')
+        counts = match_vcf_files(fnames, prefix, annotations=['A', 'B', 'C'], tol=10)
+        self.assertEqual(counts, {'matched': 1, 'discordant': 1, 'specific': 3})
+        matched = parse_vcf_file(read_vcf(f'{prefix}.matched.vcf'))
+        self.assertEqual([row.info['Annotation'] for row in matched], ['C', 'A', 'B'])
+        self.assertEqual(len({row.info['MatchId'] for row in matched}), 1)
+        self.assertEqual(len(parse_vcf_file(read_vcf(f'{prefix}.specific.vcf'))), 3)
+
+    def test_match_contig_order(self):
+        # Sorted as in hg38, with chrM after chrX as declared in the header
+        header = ['##fileformat=VCFv4.2'] + [f'##contig=<ID={chrom}>' for chrom in ('chr1', 'chrX', 'chrY', 'chrM')]
+        caller1 = [vcf_row('chr1', 100, 'A', 'G'), vcf_row('chrX', 50, 'C', 'T'), vcf_row('chrM', 10, 'G', 'A')]
+        caller2 = [vcf_row('chrX', 52, 'C', 'T'), vcf_row('chrM', 10, 'G', 'A')]
+        fnames = [self.write_vcf(f'{i}.vcf', header + rows) for i, rows in enumerate((caller1, caller2))]
+        prefix = self.path('out')
+        counts = match_vcf_files(fnames, prefix, tol=10)
+        self.assertEqual(counts, {'matched': 2, 'discordant': 0, 'specific': 1})
+        matched = parse_vcf_file(read_vcf(f'{prefix}.matched.vcf'))
+        self.assertEqual([row.loc.chrom for row in matched], ['chrX', 'chrX', 'chrM', 'chrM'])
+        result = match_vcfs([parse_vcf_file(header + caller1), parse_vcf_file(header + caller2)], tol=10)
+        self.assertEqual(len(result['matched']), 2)
+
+    def test_match_command_not_sorted(self):
+        fnames = [self.write_vcf(f'{i}.vcf', rows) for i, rows in enumerate((self.caller1[::-1], self.caller2))]
+        prefix = self.path('out')
+        result = CliRunner().invoke(client, ['match-vcfs', '--vcf_file', fnames[0], '--vcf_file', fnames[1],
+                                             '--out_prefix', prefix])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('is not sorted', result.output)
+        self.assertFalse(os.path.exists(f'{prefix}.matched.vcf'))
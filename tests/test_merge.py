@@ -1,7 +1,19 @@
 import os
 import unittest
+from unittest import mock
 
+from click.testing import CliRunner
+
+from tests import HEADER, TempDirTestCase
+from varcomb.client import client
+from varcomb.core import VCF
+from varcomb.dedup import deduplicate_sorted
+from varcomb.exceptions import VCFNotSortedError
+from varcomb.extsort import LINE_OVERHEAD, _spill, sort_vcf_lines
+from varcomb.header import ANNOTATION_INFO, Header
+from varcomb.merge import merge_sorted, merge_vcf_files, merge_vcf_files_parallel
 from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
 
 
 class TestMergeVCF(unittest.TestCase):
@@ -73,3 +85,176 @@ class TestMergeAnnotate(unittest.TestCase):
         vcf = self.vcf1.annotate('vcf1') + self.vcf2.annotate('vcf2')
         self.assertEqual(list(vcf[0].info.values()), ['vcf1'])
         self.assertEqual(list(vcf[-1].info.values()), ['vcf2'])
+
+
+class TestMergeStreaming(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = HEADER
+        self.vcf_file1 = [
+            '\t'.join(['chr1', '16688', '.', 'G', 'A', '.', 'PASS', 'DP=1', 'GT', '0/1']),
+            '\t'.join(['chr1', '186478', '.', 'A', 'G', '.', 'PASS', 'DP=2', 'GT', '0/1']),
+            '\t'.join(['chr2', '42', '.', 'T', 'C', '.', 'PASS', 'DP=3', 'GT', '0/1'])]
+        self.vcf_file2 = [
+            '\t'.join(['chr1', '186478', '.', 'A', 'G', '.', 'PASS', 'DP=2', 'GT', '0/1']),
+            '\t'.join(['chr1', '186478', '.', 'A', 'T', '.', 'PASS', 'DP=2', 'GT', '0/1']),
+            '\t'.join(['chr10', '7', '.', 'C', 'G', '.', 'PASS', 'DP=4', 'GT', '0/1'])]
+
+    def test_merge_sorted(self):
+        vcf1 = parse_vcf_file(self.vcf_file1)
+        vcf2 = parse_vcf_file(self.vcf_file2)
+        rows = list(merge_sorted(vcf1.rows, vcf2.rows))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows, sorted(rows))
+        self.assertEqual(VCF(rows), (vcf1 + vcf2).remove_true_duplicates())
+
+    def test_merge_vcf_files(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1)
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file2)
+        fname3 = self.write_vcf('3.vcf', self.header + self.vcf_file1[:1])
+        fname_out = self.path('out.vcf')
+        n_in, n_out = merge_vcf_files([fname1, fname2, fname3], fname_out)
+        self.assertEqual((n_in, n_out), (7, 5))
+        merged = parse_vcf_file(read_vcf(fname_out))
+        self.assertEqual(merged.header, self.header)
+        self.assertEqual(merged, parse_vcf_file(self.vcf_file1 + self.vcf_file2).remove_true_duplicates())
+
+    def test_merge_vcf_files_annotate(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1)
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file1)
+        fname_out = self.path('out.vcf')
+        n_in, n_out = merge_vcf_files([fname1, fname2], fname_out, annotations=['FIRST', 'SECOND'])
+        self.assertEqual((n_in, n_out), (6, 6))
+        merged = parse_vcf_file(read_vcf(fname_out))
+        self.assertEqual([row.info['Annotation'] for row in merged[:2]], ['FIRST', 'SECOND'])
+        self.assertIn(ANNOTATION_INFO, merged.header)
+
+    def test_merge_vcf_files_contig_order(self):
+        # chr10 is declared before chr2, so the inputs are sorted that way
+        header = [self.header[0], '##contig=<ID=chr1>', '##contig=<ID=chr10>', '##contig=<ID=chr2>', self.header[1]]
+        fname1 = self.write_vcf('1.vcf', header + self.vcf_file2 + self.vcf_file1[2:])
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file1)
+        fname_out = self.path('out.vcf')
+        merge_vcf_files([fname1, fname2], fname_out)
+        merged = parse_vcf_file(read_vcf(fname_out))
+        self.assertEqual(merged.header.contigs, ['chr1', 'chr10', 'chr2'])
+        self.assertEqual([row.loc.chrom for row in merged], ['chr1', 'chr1', 'chr1', 'chr10', 'chr2'])
+        with self.assertRaises(VCFNotSortedError):
+            merge_vcf_files([self.write_vcf('3.vcf', header + self.vcf_file1[2:] + self.vcf_file2[2:])], fname_out)
+
+    def test_merge_vcf_files_parallel(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1[::-1])
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file2)
+        fname_out = self.path('out.vcf')
+        n_in, n_out = merge_vcf_files_parallel([fname1, fname2], fname_out, annotations=[None, 'SECOND'], processes=2)
+        self.assertEqual((n_in, n_out), (6, 6))
+        merged = parse_vcf_file(read_vcf(fname_out))
+        self.assertEqual(merged.header, [self.header[0], ANNOTATION_INFO, self.header[1]])
+        self.assertEqual([row.loc.chrom for row in merged], ['chr1', 'chr1', 'chr1', 'chr1', 'chr2', 'chr10'])
+        self.assertEqual(merged.rows, sorted(merged.rows))
+        n_in, n_out = merge_vcf_files_parallel([fname1, fname2], fname_out, processes=2)
+        self.assertEqual((n_in, n_out), (6, 5))
+
+    def test_merge_vcf_files_not_sorted(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1[::-1])
+        fname_out = self.path('out.vcf')
+        with self.assertRaises(VCFNotSortedError):
+            merge_vcf_files([fname1], fname_out)
+
+    def test_merge_command_not_sorted(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1[::-1])
+        fname_out = self.path('out.vcf.gz')
+        result = CliRunner().invoke(client, ['merge-vcfs', '--vcf_file', fname1, '--vcf_out', fname_out, '--streaming'])
+        self.assertEqual(result.exit_code, 1)
+        self.assertIn('is not sorted', result.output)
+        self.assertIn('--sort_memory', result.output)
+        self.assertFalse(os.path.exists(fname_out))
+
+    def test_merge_vcf_files_external_sort(self):
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1[::-1])
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file2[::-1])
+        fname_out = self.path('out.vcf')
+        n_in, n_out = merge_vcf_files([fname1, fname2], fname_out, sort_memory=1)
+        self.assertEqual((n_in, n_out), (6, 5))
+        merged = parse_vcf_file(read_vcf(fname_out))
+        self.assertEqual(merged.header, self.header)
+        self.assertEqual(merged.rows, parse_vcf_file(self.vcf_file1 + self.vcf_file2).remove_true_duplicates().rows)
+
+    def test_merge_vcf_files_external_sort_contig_order(self):
+        # Only the first input declares contigs; the second is sorted in that order as well
+        header = [self.header[0], '##contig=<ID=chr1>', '##contig=<ID=chrX>', '##contig=<ID=chrM>', self.header[1]]
+        rows = ['\t'.join([chrom, '5', '.', 'A', 'G', '.', 'PASS', 'DP=1', 'GT', '0/1']) for chrom in ('chrM', 'chrX', 'chr1')]
+        fname1 = self.write_vcf('1.vcf', header + rows[::-1])
+        fname2 = self.write_vcf('2.vcf', self.header + rows)
+        fname_out = self.path('out.vcf')
+        n_in, n_out = merge_vcf_files([fname1, fname2], fname_out, sort_memory=1)
+        self.assertEqual((n_in, n_out), (6, 3))
+        self.assertEqual([row.loc.chrom for row in parse_vcf_file(read_vcf(fname_out))], ['chr1', 'chrX', 'chrM'])
+
+    def test_merge_vcf_files_external_sort_budget(self):
+        # Each input fits the budget on its own, but the inputs are sorted before the merge, so they share it
+        fname1 = self.write_vcf('1.vcf', self.header + self.vcf_file1[::-1])
+        fname2 = self.write_vcf('2.vcf', self.header + self.vcf_file2[::-1])
+        fname_out = self.path('out.vcf')
+        budget = max(sum(len(line) + LINE_OVERHEAD for line in lines) for lines in (self.vcf_file1, self.vcf_file2)) + 1
+        with mock.patch('varcomb.extsort._spill', wraps=_spill) as spill:
+            for fname in (fname1, fname2):
+                merge_vcf_files([fname], fname_out, sort_memory=budget)
+            self.assertEqual(spill.call_count, 0)
+            n_in, n_out = merge_vcf_files([fname1, fname2], fname_out, sort_memory=budget)
+        self.assertGreater(spill.call_count, 0)
+        self.assertEqual((n_in, n_out), (6, 5))
+
+    def test_sort_vcf_lines(self):
+        lines = [f'chr{chrom}\t{pos}\t.\tA\tG\t.\tPASS\tN={i}' for i, (chrom, pos) in
+                 enumerate([(2, 5), (1, 9), (10, 1), (1, 9), (1, 3), (2, 1), ('X', 7), (1, 1)])]
+        expected = [lines[i] for i in (7, 4, 1, 3, 5, 0, 2, 6)]
+        self.assertEqual(list(sort_vcf_lines(self.header + lines)), self.header + expected)
+        # Every record in its own run, merged in several passes
+        with mock.patch('varcomb.extsort.MERGE_FANIN', 3):
+            self.assertEqual(list(sort_vcf_lines(self.header + lines, max_memory=1)), self.header + expected)
+        self.assertEqual(list(sort_vcf_lines(self.header)), self.header)
+        order = Header(['##contig=<ID=chrX>', '##contig=<ID=chr2>'])
+        self.assertEqual(list(sort_vcf_lines(self.header + lines, order=order)),
+                         self.header + [lines[i] for i in (6, 5, 0, 7, 4, 1, 3, 2)])
+
+
+class TestMergeDeduplicate(unittest.TestCase):
+    def setUp(self):
+        self.vcf_file = [
+            '\t'.join(['chr1', '100', '.', 'A', 'G', '10', 'LowQual', '.', 'GT', '0/1']),
+            '\t'.join(['chr1', '100', '.', 'A', 'G', '50', 'PASS', '.', 'GT', '0/1']),
+            '\t'.join(['chr1', '100', '.', 'A', 'T', '30', 'PASS', '.', 'GT', '0/1']),
+            '\t'.join(['chr1', '100', '.', 'ACT', 'AGT', '.', 'PASS', '.', 'GT', '0/1']),
+            '\t'.join(['chr1', '101', '.', 'C', 'G', '20', 'PASS', '.', 'GT', '0/1']),
+            '\t'.join(['chr1', '100', '.', 'A', 'G', '10', 'LowQual', '.', 'GT', '0/1'])]
+        self.vcf = parse_vcf_file(self.vcf_file)
+
+    def test_deduplicate_keys(self):
+        self.assertEqual(len(self.vcf.deduplicate(key='row')), 5)
+        self.assertEqual(len(self.vcf.deduplicate(key='allele')), 4)
+        self.assertEqual(len(self.vcf.deduplicate(key='normalized')), 3)
+        self.assertEqual(len(self.vcf.deduplicate(key='loc')), 2)
+
+    def test_deduplicate_policies(self):
+        self.assertEqual(self.vcf.deduplicate(key='loc', keep='first')[0].qual, '10')
+        self.assertEqual(self.vcf.deduplicate(key='loc', keep='qual')[0].qual, '50')
+        self.assertEqual(self.vcf.deduplicate(key='allele', keep='pass')[0].filter, 'PASS')
+
+    def test_deduplicate_is_sorted(self):
+        vcf = self.vcf.deduplicate(key='loc')
+        self.assertEqual([row.loc.pos for row in vcf], [100, 101])
+
+    def test_deduplicate_unknown_option(self):
+        with self.assertRaises(ValueError):
+            self.vcf.deduplicate(key='unknown')
+        with self.assertRaises(ValueError):
+            self.vcf.deduplicate(keep='unknown')
+
+    def test_deduplicate_sorted(self):
+        rows = sorted(self.vcf.rows)
+        for key in ('row', 'loc', 'allele'):
+            for keep in ('first', 'qual', 'pass'):
+                self.assertEqual(VCF(list(deduplicate_sorted(rows, key=key, keep=keep))), self.vcf.deduplicate(key=key, keep=keep))
+        with self.assertRaises(ValueError):
+            deduplicate_sorted(rows, key='normalized')
@@ -1,7 +1,11 @@
+import gzip
 import unittest
 
-from varcomb.core import VCF, Info, Location
-from varcomb.parsers import _parse_vcf_line, parse_vcf_file
+from tests import HEADER, TempDirTestCase
+from varcomb.core import VCF, Info, Location, VCFrow
+from varcomb.header import info_types, parse_meta_line
+from varcomb.parsers import VCFReader, _parse_vcf_line, parse_vcf_file
+from varcomb.utilities import read_vcf
 
 
 class TestParserVcfLine(unittest.TestCase):
@@ -19,6 +23,15 @@ class TestParserVcfLine(unittest.TestCase):
         self.assertEqual(vcfrow.format, 'GT:AD:AF:DP:F1R2:F2R1:SB')
         self.assertEqual(vcfrow.samples, ['0/0:180,4:0.026:184:99,1:80,3:165,15,0,4', '0/1:177,9:0.052:186:98,4:77,5:162,15,0,9'])
 
+    def test_parse_vcf_line_interns_repeated_fields(self):
+        line = '\t'.join(['chr1', '1', '.', 'G', 'A', '.', 'Low' + 'Qual', '.', 'GT:' + 'AD', '0/1:1,2'])
+        first, second = _parse_vcf_line(line), _parse_vcf_line(line)
+        self.assertIs(first.loc.chrom, second.loc.chrom)
+        self.assertIs(first.filter, second.filter)
+        self.assertIs(first.format, second.format)
+        self.assertEqual(first._format_row(), line)
+        self.assertEqual(_parse_vcf_line('\t'.join(['chr1', '1', '.', 'G', 'A', '.', '.', '.', '.'])).samples, [])
+
 
 class TestParserVcfFile(unittest.TestCase):
 
@@ -39,3 +52,76 @@ class TestParserVcfFile(unittest.TestCase):
         vcf = parse_vcf_file(header + self.vcf_file)
         self.assertEqual(len(vcf), len(self.vcf_file))
         self.assertEqual(len(vcf.header), len(header))
+
+
+class TestParserVCFReader(TempDirTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.header = HEADER
+        self.rows = [
+            '\t'.join(['chr1', '16688', '.', 'G', 'A', '.', 'PASS', 'DP=1', 'GT', '0/1']),
+            '\t'.join(['chr1', '186478', '.', 'A', 'G', '.', 'PASS', 'DP=2', 'GT', '0/1'])]
+
+    def test_reader_is_lazy(self):
+        consumed = []
+
+        def stream():
+            for line in self.header + self.rows:
+                consumed.append(line)
+                yield line
+
+        reader = VCFReader(stream())
+        self.assertEqual(reader.header, self.header)
+        self.assertEqual(len(consumed), len(self.header) + 1)
+        rows = iter(reader)
+        self.assertIsInstance(next(rows), VCFrow)
+        self.assertEqual(len(consumed), len(self.header) + 1)
+        self.assertEqual(next(rows), _parse_vcf_line(self.rows[1]))
+
+    def test_reader_without_rows(self):
+        reader = VCFReader(self.header)
+        self.assertEqual(reader.header, self.header)
+        self.assertEqual(list(reader), [])
+
+    def test_read_vcf_plain_and_gzip(self):
+        fname = self.write_vcf('test.vcf', self.header + self.rows)
+        with gzip.open(fname + '.gz', 'wt') as f:
+            f.write('\n'.join(self.header + self.rows) + '\n')
+        for name in (fname, fname + '.gz'):
+            vcf = parse_vcf_file(read_vcf(name))
+            self.assertEqual(vcf.header, self.header)
+            self.assertEqual(vcf, parse_vcf_file(self.rows))
+
+
+class TestParserInfoTypes(unittest.TestCase):
+
+    def setUp(self):
+        self.header = [
+            '##fileformat=VCFv4.2',
+            '##INFO=<ID=DP,Number=1,Type=Integer,Description="Approximate read depth, (reads with MQ=255)">',
+            '##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">',
+            '##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP membership">',
+            '##INFO=<ID=Annotation,Number=1,Type=String,Description="Annotation">',
+            '#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\tFORMAT\tS1']
+        self.rows = ['\t'.join(['chr1', '16688', '.', 'G', 'A,T', '.', 'PASS', 'DP=.;AF=0.1,0.2;DB;Annotation=x', 'GT', '0/1']),
+                     '\t'.join(['chr1', '16689', '.', 'G', 'A', '.', 'PASS', 'DP=14;AF=.', 'GT', '0/1'])]
+
+    def test_parse_meta_line(self):
+        meta = parse_meta_line(self.header[1])
+        self.assertEqual(meta['ID'], 'DP')
+        self.assertEqual(meta['Description'], '"Approximate read depth, (reads with MQ=255)"')
+
+    def test_info_types(self):
+        types = info_types(self.header)
+        self.assertEqual(sorted(types), ['AF', 'DP'])
+
+    def test_typed_info(self):
+        vcf = parse_vcf_file(self.header + self.rows)
+        self.assertIsNone(vcf[0].info['DP'])
+        self.assertEqual(vcf[0].info['AF'], [0.1, 0.2])
+        self.assertEqual(vcf[0].info['DB'], True)
+        self.assertEqual(vcf[0].info['Annotation'], 'x')
+        self.assertEqual(vcf[1].info['DP'], 14)
+        self.assertEqual(vcf[1].info['AF'], [None])
+        self.assertEqual(vcf[1]._format_row(), self.rows[1])
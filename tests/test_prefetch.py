@@ -0,0 +1,75 @@
+import io
+import threading
+import unittest
+
+from tests import TempDirTestCase, vcf_row
+from varcomb.merge import merge_vcf_files
+from varcomb.prefetch import BackgroundHandle, prefetch
+from varcomb.utilities import read_vcf
+from varcomb.writer import VCFWriter
+
+
+class TestPrefetch(unittest.TestCase):
+    def test_prefetch(self):
+        self.assertEqual(list(prefetch(range(10000), size=2, batch=7)), list(range(10000)))
+        self.assertEqual(list(prefetch([])), [])
+
+    def test_prefetch_error(self):
+        def failing():
+            yield 1
+            raise ValueError('broken input')
+        with self.assertRaises(ValueError):
+            list(prefetch(failing()))
+
+    def test_prefetch_close(self):
+        consumed = []
+
+        def numbers():
+            for i in range(100000):
+                consumed.append(i)
+                yield i
+        items = prefetch(numbers(), size=1, batch=10)
+        self.assertEqual(next(items), 0)
+        items.close()
+        for thread in threading.enumerate():
+            if thread is not threading.current_thread() and thread.daemon:
+                thread.join(timeout=1)
+        self.assertLess(len(consumed), 100)
+
+
+class TestBackgroundHandle(unittest.TestCase):
+    def test_write(self):
+        buffer = io.StringIO()
+        buffer.close = lambda: None
+        handle = BackgroundHandle(buffer, size=1)
+        for i in range(100):
+            handle.write(f'{i}\n')
+        handle.close()
+        self.assertEqual(buffer.getvalue(), ''.join(f'{i}\n' for i in range(100)))
+
+    def test_write_error(self):
+        class Broken:
+            def write(self, data):
+                raise OSError('disk full')
+
+            def close(self):
+                pass
+        handle = BackgroundHandle(Broken())
+        handle.write('data')
+        with self.assertRaises(OSError):
+            handle.close()
+
+
+class TestPipelinedMerge(TempDirTestCase):
+    def test_pipelined_merge(self):
+        header = ['##fileformat=VCFv4.2']
+        rows = [vcf_row('chr1', pos) for pos in range(1, 5000)]
+        fnames = []
+        for i, part in enumerate((rows[::2], rows[1::2])):
+            fname = self.path(f'{i}.vcf.gz')
+            with VCFWriter(fname, header=header) as writer:
+                writer.write_lines(part)
+            fnames.append(fname)
+        fname_out = self.path('out.vcf.gz')
+        self.assertEqual(merge_vcf_files(fnames, fname_out, pipelined=True), (len(rows), len(rows)))
+        self.assertEqual(list(read_vcf(fname_out)), header + rows)
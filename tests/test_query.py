@@ -0,0 +1,69 @@
+from tests import TempDirTestCase, vcf_row
+from varcomb.header import ANNOTATION_INFO
+from varcomb.parsers import parse_vcf_file
+from varcomb.utilities import read_vcf
+
+
+class TestQuery(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = ['##fileformat=VCFv4.2', '##contig=<ID=chr2>', '##contig=<ID=chr1>']
+        self.first = [vcf_row('chr1', 30, 'A', 'G', info='DP=1'), vcf_row('chr2', 10, 'C', 'T', info='DP=1'),
+                      vcf_row('chr1', 20, 'G', 'A', info='DP=1')]
+        self.second = [vcf_row('chr1', 30, 'A', 'G', info='DP=1'), vcf_row('chr1', 5, 'T', 'C', info='DP=1'),
+                       vcf_row('chr1', 30, 'A', 'C', info='DP=1')]
+
+    def _vcfs(self):
+        return parse_vcf_file(self.header + self.first), parse_vcf_file(self.header + self.second)
+
+    def test_query_matches_vcf(self):
+        for key in ('row', 'loc', 'normalized'):
+            vcf1, vcf2 = self._vcfs()
+            expected = (vcf1.annotate('A') + vcf2.annotate('B')).deduplicate(key=key)
+            vcf1, vcf2 = self._vcfs()
+            query = vcf1.lazy().annotate('A').concat(vcf2.lazy().annotate('B')).deduplicate(key=key)
+            actual = query.collect()
+            self.assertEqual([row._format_row() for row in actual.rows], [row._format_row() for row in expected.rows])
+            self.assertEqual(actual.header, expected.header)
+
+    def test_query_is_lazy(self):
+        vcf1, _ = self._vcfs()
+        query = vcf1.lazy().annotate('A')
+        self.assertNotIn('Annotation', vcf1.rows[0].info)
+        self.assertIn(ANNOTATION_INFO, query.header)
+        self.assertEqual(len(query.collect()), 3)
+        self.assertEqual(vcf1.rows[0].info['Annotation'], 'A')
+
+    def test_query_sorted(self):
+        vcf1, vcf2 = self._vcfs()
+        query = vcf1.lazy().sort()
+        self.assertTrue(query.is_sorted)
+        self.assertIs(query.sort(), query)
+        self.assertTrue(query.deduplicate().is_sorted)
+        self.assertEqual([row.loc.pos for row in query], [10, 20, 30])
+        # Sorted parts are merged instead of sorted again, keeping the first input first for equal positions
+        merged = vcf1.sort().lazy(is_sorted=True).concat(vcf2.sort().lazy(is_sorted=True)).annotate('X')
+        self.assertFalse(merged.is_sorted)
+        self.assertEqual([row._format_row() for row in merged.deduplicate()],
+                         [row._format_row() for row in (vcf1.annotate('X') + vcf2.annotate('X')).deduplicate().rows])
+        self.assertEqual([(row.loc.chrom, row.loc.pos) for row in merged.sort()],
+                         [('chr2', 10), ('chr1', 5), ('chr1', 20), ('chr1', 30), ('chr1', 30), ('chr1', 30)])
+
+    def test_query_filter_and_region(self):
+        vcf1, vcf2 = self._vcfs()
+        query = vcf1.lazy().concat(vcf2.lazy())
+        self.assertEqual([row.loc.pos for row in query.region('chr1', 10, 30)], [30, 20, 30, 30])
+        self.assertEqual([row.loc.pos for row in query.region('chr1', 10)], [30, 20, 30, 30])
+        self.assertEqual([row.alt for row in query.filter(lambda row: row.ref == 'A').region('chr1', end=25)], [])
+        self.assertEqual([row.alt for row in query.filter(lambda row: row.ref == 'A')], ['G', 'G', 'C'])
+
+    def test_query_to_file(self):
+        vcf1, _ = self._vcfs()
+        fname = self.path('out.vcf')
+        n = vcf1.lazy().annotate('A').deduplicate(key='loc').to_file(fname)
+        self.assertEqual(n, 3)
+        lines = list(read_vcf(fname))
+        self.assertEqual(lines[:4], self.header[:3] + [ANNOTATION_INFO])
+        self.assertEqual([line.split('\t')[:2] + line.split('\t')[7:8] for line in lines[4:]],
+                         [['chr2', '10', 'DP=1;Annotation=A'], ['chr1', '20', 'DP=1;Annotation=A'],
+                          ['chr1', '30', 'DP=1;Annotation=A']])
@@ -0,0 +1,75 @@
+import json
+import os
+import pstats
+import subprocess
+import sys
+import unittest
+
+from click.testing import CliRunner
+
+from tests import TempDirTestCase, vcf_row
+from varcomb.client import client
+from varcomb.stats import Stats
+
+
+class TestStats(unittest.TestCase):
+    def test_stage(self):
+        stats = Stats('test')
+        with stats.stage('count') as stage:
+            stage.records = sum(1 for _ in range(100000))
+            stage.bytes = 1000
+        with self.assertRaises(ValueError):
+            with stats.stage('fail'):
+                raise ValueError
+        data = stats.to_dict()
+        self.assertEqual(data['command'], 'test')
+        self.assertEqual([stage['name'] for stage in data['stages']], ['count', 'fail'])
+        count = data['stages'][0]
+        self.assertEqual(count['records'], 100000)
+        self.assertGreater(count['wall'], 0)
+        self.assertGreater(count['peak_rss'], 0)
+        self.assertAlmostEqual(count['records_per_sec'], 100000 / count['wall'])
+        self.assertAlmostEqual(count['bytes_per_sec'], 1000 / count['wall'])
+
+    def test_stage_children(self):
+        # CPU time of child processes is counted once they have finished
+        stats = Stats('test')
+        with stats.stage('child') as stage:
+            subprocess.run([sys.executable, '-c', 'sum(range(3_000_000))'], check=True)
+        self.assertGreater(stage.cpu_children, 0)
+        self.assertGreaterEqual(stage.cpu, stage.cpu_children)
+        self.assertGreater(stats.to_dict()['cpu_children'], 0)
+
+
+class TestStatsClient(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.fname = self.write_vcf('in.vcf', ['##fileformat=VCFv4.2'] + [vcf_row('chr1', pos) for pos in range(1, 101)])
+
+    def _run(self, *args):
+        result = CliRunner().invoke(client, list(args), catch_exceptions=False)
+        self.assertEqual(result.exit_code, 0, result.output)
+        return result
+
+    def test_stats_json(self):
+        stats_json = self.path('stats.json')
+        profile = self.path('profile.out')
+        out = self.path('out.vcf')
+        self._run('--stats_json', stats_json, '--profile', profile,
+                  'merge-vcfs', '--vcf_file1', self.fname, '--vcf_file2', self.fname, '--vcf_out', out)
+        with open(stats_json) as f:
+            stats = json.load(f)
+        self.assertEqual(stats['command'], 'merge-vcfs')
+        stages = {stage['name']: stage for stage in stats['stages']}
+        self.assertEqual(list(stages), [f'read {self.fname}', 'merge+deduplicate', 'write'])
+        self.assertEqual(stages['merge+deduplicate']['records'], 200)
+        self.assertEqual(stages['write']['records'], 100)
+        self.assertEqual(stages['write']['bytes'], os.path.getsize(out))
+        self.assertGreater(pstats.Stats(profile).total_calls, 0)
+
+    def test_stats_json_stdout(self):
+        out = self.path('out.vcf')
+        result = self._run('--stats_json', '-', 'merge-vcfs', '--vcf_file', self.fname, '--vcf_out', out, '--streaming')
+        stats = json.loads(result.output)
+        self.assertEqual([stage['name'] for stage in stats['stages']], ['merge_streaming'])
+        self.assertEqual(stats['stages'][0]['records'], 100)
@@ -0,0 +1,45 @@
+import os
+
+from tests import TempDirTestCase
+from varcomb.parsers import _parse_vcf_line, parse_vcf_file
+from varcomb.utilities import read_vcf
+from varcomb.writer import BATCH_SIZE, VCFWriter
+
+
+class TestVCFWriter(TempDirTestCase):
+    def setUp(self):
+        super().setUp()
+        self.header = ['##fileformat=VCFv4.2']
+        self.rows = ['\t'.join(['chr1', str(pos), '.', 'A', 'G', '.', 'PASS', '.', 'GT', '0/1'])
+                     for pos in range(1, 3 * BATCH_SIZE)]
+
+    def test_writer_streams_rows(self):
+        for name in ('test.vcf', 'test.vcf.gz'):
+            fname = self.path(name)
+            with VCFWriter(fname, header=self.header) as writer:
+                n = writer.write_rows(_parse_vcf_line(line) for line in self.rows[:-1])
+                writer.write_row(_parse_vcf_line(self.rows[-1]))
+            self.assertEqual(n, len(self.rows) - 1)
+            self.assertEqual(writer.n, len(self.rows))
+            self.assertEqual(list(read_vcf(fname)), self.header + self.rows)
+
+    def test_writer_index(self):
+        fname = self.path('test.vcf.gz')
+        with VCFWriter(fname, index='tbi') as writer:
+            writer.write_lines(self.rows)
+        self.assertTrue(os.path.exists(fname + '.tbi'))
+        with self.assertRaises(ValueError):
+            VCFWriter(fname[:-3], index='tbi')
+
+    def test_writer_failure_removes_output(self):
+        fname = self.path('test.vcf.gz')
+        with self.assertRaises(RuntimeError):
+            with VCFWriter(fname, header=self.header, index='tbi') as writer:
+                writer.write_lines(self.rows)
+                raise RuntimeError('merge failed')
+        self.assertFalse(os.path.exists(fname))
+        self.assertFalse(os.path.exists(fname + '.tbi'))
+
+    def test_vcf_str(self):
+        vcf = parse_vcf_file(self.rows[:3])
+        self.assertEqual(str(vcf), '\n'.join(self.rows[:3]) + '\n')